@@ -1,13 +1,17 @@
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import MongoClient, UpdateOne
+from pymongo.errors import OperationFailure
 from passlib.context import CryptContext
 from datetime import datetime, timedelta, timezone
 from jose import JWTError, jwt
-from fastapi import HTTPException, status, Depends
+from fastapi import HTTPException, status, Depends, Header
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from pydantic import BaseModel, EmailStr
 import os
+import time
+import asyncio
 from dotenv import load_dotenv
-from typing import Optional
+from typing import Optional, Dict, Tuple
 
 load_dotenv()
 
@@ -20,6 +24,15 @@ SECRET_KEY = os.getenv("SECRET_KEY", "your-secret-key-change-this-in-production"
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 60 * 24  # 24 hours
 
+# Admin endpoints (catalog reload etc.) are disabled unless ADMIN_TOKEN is set
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN")
+
+# Saved sessions not updated for this many days are deleted by a TTL index (0 keeps them forever)
+SESSION_DOCUMENT_TTL_DAYS = float(os.getenv("SESSION_DOCUMENT_TTL_DAYS", "90"))
+
+# Authenticated users are cached briefly so reconnect storms do not each hit Mongo
+USER_CACHE_TTL = float(os.getenv("USER_CACHE_TTL", "60"))
+
 # Password hashing
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 
@@ -31,6 +44,12 @@ client = AsyncIOMotorClient(MONGODB_URL)
 db = client[DATABASE_NAME]
 users_collection = db["users"]
 sessions_collection = db["sessions"]
+turn_events_collection = db["turn_events"]
+_sync_client: Optional[MongoClient] = None
+
+# email -> (expiry, user document); lookups in flight are shared by concurrent callers
+_user_cache: Dict[str, Tuple[float, dict]] = {}
+_user_lookups: Dict[str, asyncio.Future] = {}
 
 
 # Pydantic Models
@@ -102,12 +121,51 @@ async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(s
         print(f"JWT Error: {e}")
         raise credentials_exception
     
-    user = await users_collection.find_one({"email": email})
+    user = await get_user_by_email(email)
     if user is None:
         raise credentials_exception
     return user
 
 
+async def get_user_by_email(email: str) -> Optional[dict]:
+    """User document by email, served from a short TTL cache; concurrent misses share one query"""
+    cached = _user_cache.get(email)
+    if cached is not None and cached[0] > time.monotonic():
+        return cached[1]
+    
+    pending = _user_lookups.get(email)
+    if pending is not None:
+        return await asyncio.shield(pending)
+    
+    future = asyncio.get_running_loop().create_future()
+    _user_lookups[email] = future
+    try:
+        user = await users_collection.find_one({"email": email})
+        if user is not None and USER_CACHE_TTL > 0:
+            _user_cache[email] = (time.monotonic() + USER_CACHE_TTL, user)
+        future.set_result(user)
+        return user
+    except Exception as e:
+        future.set_exception(e)
+        future.exception()  # mark retrieved when nobody else was waiting
+        raise
+    finally:
+        del _user_lookups[email]
+
+
+def invalidate_user(email: str):
+    """Drop a cached user after their document changes"""
+    _user_cache.pop(email, None)
+
+
+async def require_admin(x_admin_token: Optional[str] = Header(None)):
+    if not ADMIN_TOKEN or x_admin_token != ADMIN_TOKEN:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Admin token required"
+        )
+
+
 # Authentication functions
 async def register_user(user_data: UserRegister):
     # Check if user already exists
@@ -199,6 +257,43 @@ async def save_user_session(email: str, session_data: dict):
     )
 
 
+async def save_user_sessions(sessions: Dict[str, dict]):
+    """Save several users' sessions in one unordered bulk write"""
+    updated_at = datetime.now(timezone.utc)
+    await sessions_collection.bulk_write([
+        UpdateOne({"email": email},
+                  {"$set": {"email": email, "session_data": session_data, "updated_at": updated_at}},
+                  upsert=True)
+        for email, session_data in sessions.items()
+    ], ordered=False)
+
+
+async def ensure_session_ttl_index():
+    """Let Mongo expire sessions idle for SESSION_DOCUMENT_TTL_DAYS; updates the TTL of an existing index"""
+    if SESSION_DOCUMENT_TTL_DAYS <= 0:
+        return
+    seconds = int(SESSION_DOCUMENT_TTL_DAYS * 86400)
+    try:
+        await sessions_collection.create_index("updated_at", expireAfterSeconds=seconds)
+    except OperationFailure:
+        # Index already exists with another TTL
+        await db.command("collMod", sessions_collection.name,
+                         index={"keyPattern": {"updated_at": 1}, "expireAfterSeconds": seconds})
+    print(f"✓ Saved sessions expire after {SESSION_DOCUMENT_TTL_DAYS:g} days without an update")
+
+
+def inventory_collections():
+    """
+    Blocking (pymongo) stock and hold collections: reservations run in the
+    turn's worker thread and must be atomic across every server process
+    """
+    global _sync_client
+    if _sync_client is None:
+        _sync_client = MongoClient(MONGODB_URL)
+    sync_db = _sync_client[DATABASE_NAME]
+    return sync_db["inventory"], sync_db["inventory_holds"]
+
+
 async def load_user_session(email: str):
     """Load user chat session from MongoDB"""
     session = await sessions_collection.find_one({"email": email})
@@ -0,0 +1,51 @@
+"""
+Recall@k and latency of IVF-flat against the exact scan on synthetic clustered embeddings.
+Run from app/: python -m benchmarks.ann_recall [n_rows] [dim]
+"""
+import sys
+import time
+
+import numpy as np
+
+from vector_index import ExactIndex, IVFFlatIndex
+
+TOP_K = 10
+QUERIES = 200
+
+
+def synthetic_embeddings(n: int, dim: int, clusters: int = 200, seed: int = 0) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((clusters, dim)).astype(np.float32)
+    vectors = centers[rng.integers(0, clusters, n)] + 0.6 * rng.standard_normal((n, dim)).astype(np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def timed_search(index, queries, **params):
+    results = []
+    start = time.perf_counter()
+    for q in queries:
+        results.append(index.search(q, TOP_K, **params)[0])
+    return results, (time.perf_counter() - start) / len(queries) * 1000
+
+
+def recall(truth, found) -> float:
+    return float(np.mean([len(set(t) & set(f)) / len(t) for t, f in zip(truth, found)]))
+
+
+if __name__ == "__main__":
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    dim = int(sys.argv[2]) if len(sys.argv) > 2 else 256
+    vectors = synthetic_embeddings(n, dim)
+    queries = synthetic_embeddings(QUERIES, dim, seed=1)
+
+    exact = ExactIndex(vectors)
+    truth, exact_ms = timed_search(exact, queries)
+    print(f"{n} rows x {dim} dims, recall@{TOP_K} over {QUERIES} queries")
+    print(f"  exact           {exact_ms:7.2f} ms/query")
+
+    start = time.perf_counter()
+    ivf = IVFFlatIndex.build(vectors)
+    print(f"  ivf build       {time.perf_counter() - start:7.2f} s ({len(ivf.centroids)} lists)")
+    for n_probe in (1, 4, 8, 16, 32, 64):
+        found, ms = timed_search(ivf, queries, n_probe=n_probe)
+        print(f"  ivf n_probe={n_probe:<3} {ms:7.2f} ms/query  recall={recall(truth, found):.3f}")
@@ -0,0 +1,54 @@
+"""
+Per-query latency and document throughput of the embedding backends.
+Run from app/: python -m benchmarks.embedder_latency [backend ...]   (default: hashing onnx)
+"""
+import sys
+import time
+import json
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from embedders import EMBEDDING_BATCH_SIZE, create_embedder
+
+QUERIES = ["warm jacket for winter", "running shoes", "1B", "silk gown for a formal party",
+           "something breathable for summer", "leather boots", "bag for school", "navy polo"]
+ROUNDS = 50
+THREADS = 8
+
+
+def product_texts(path: str = "rproducts.json"):
+    with open(path) as f:
+        products = json.load(f)["products"]
+    return [f"{p['name']} {p['category']} {p['description']}" for p in products]
+
+
+if __name__ == "__main__":
+    backends = sys.argv[1:] or ["hashing", "onnx"]
+    texts = product_texts() * 50
+    for kind in backends:
+        embedder = create_embedder(kind)
+        embedder.embed_query("warm up")
+
+        latencies = []
+        for _ in range(ROUNDS):
+            for query in QUERIES:
+                start = time.perf_counter()
+                embedder.embed_query(query)
+                latencies.append((time.perf_counter() - start) * 1000)
+
+        # Concurrent callers share batches through the query batcher
+        start = time.perf_counter()
+        with ThreadPoolExecutor(THREADS) as pool:
+            list(pool.map(embedder.embed_query, QUERIES * ROUNDS))
+        concurrent_qps = len(QUERIES) * ROUNDS / (time.perf_counter() - start)
+
+        start = time.perf_counter()
+        for i in range(0, len(texts), EMBEDDING_BATCH_SIZE):
+            embedder.embed_documents(texts[i:i + EMBEDDING_BATCH_SIZE])
+        docs_per_s = len(texts) / (time.perf_counter() - start)
+
+        print(f"{embedder.name}")
+        print(f"  query p50 {np.percentile(latencies, 50):7.2f} ms  p95 {np.percentile(latencies, 95):7.2f} ms")
+        print(f"  {THREADS} threads {concurrent_qps:9.0f} queries/s")
+        print(f"  documents {docs_per_s:9.0f} /s")
@@ -0,0 +1,34 @@
+"""
+Memory, latency and recall@k of quantized vector storage against the float32 exact scan.
+Run from app/: python -m benchmarks.quantization_recall [n_rows] [dim]
+"""
+import sys
+
+from benchmarks.ann_recall import TOP_K, QUERIES, synthetic_embeddings, timed_search, recall
+from vector_index import ExactIndex, IVFFlatIndex
+
+if __name__ == "__main__":
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    dim = int(sys.argv[2]) if len(sys.argv) > 2 else 768
+    vectors = synthetic_embeddings(n, dim)
+    queries = synthetic_embeddings(QUERIES, dim, seed=1)
+
+    baseline = ExactIndex(vectors, quantization="none")
+    truth, base_ms = timed_search(baseline, queries)
+    print(f"{n} rows x {dim} dims, recall@{TOP_K} over {QUERIES} queries")
+    print(f"  {'exact float32':<28} {baseline.store.nbytes / 2**20:7.1f} MiB {base_ms:7.2f} ms/query  recall=1.000")
+
+    for mode in ("float16", "int8"):
+        for rerank in (0, 4):
+            index = ExactIndex(vectors, quantization=mode, rerank=rerank)
+            found, ms = timed_search(index, queries)
+            label = f"exact {mode} rerank={rerank}"
+            print(f"  {label:<28} {index.store.nbytes / 2**20:7.1f} MiB {ms:7.2f} ms/query  recall={recall(truth, found):.3f}")
+
+    ivf = IVFFlatIndex.build(vectors, quantization="none")
+    for mode in ("none", "int8"):
+        index = ivf if mode == "none" else IVFFlatIndex(ivf.centroids, ivf.list_offsets, ivf.row_ids, vectors,
+                                                        ivf.n_probe, quantization=mode, rerank=4)
+        found, ms = timed_search(index, queries)
+        label = f"ivf {mode} n_probe={index.n_probe}"
+        print(f"  {label:<28} {index.store.nbytes / 2**20:7.1f} MiB {ms:7.2f} ms/query  recall={recall(truth, found):.3f}")
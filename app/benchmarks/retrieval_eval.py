@@ -0,0 +1,61 @@
+"""
+Relevance and latency of lexical, vector and hybrid retrieval on labelled queries over rproducts.json.
+Run from app/: python -m benchmarks.retrieval_eval [catalog] [queries]
+With the Gemini embedder, vector and hybrid modes need GOOGLE_API_KEY; EMBEDDER=onnx or hashing runs offline.
+"""
+import os
+import sys
+import json
+import time
+from typing import Dict, List
+
+import numpy as np
+
+import embedders
+from product_rag import ProductRAGWithEmbeddings
+
+TOP_K = 5
+QUERIES_PATH = os.path.join(os.path.dirname(__file__), "retrieval_queries.json")
+
+
+def evaluate(rag: ProductRAGWithEmbeddings, cases: List[Dict], mode: str) -> Dict[str, float]:
+    hits_at_1, hits_at_k, reciprocal_ranks, latencies = [], [], [], []
+    for case in cases:
+        start = time.perf_counter()
+        results = rag.search_products_with_scores(case["query"], TOP_K, mode=mode)
+        latencies.append((time.perf_counter() - start) * 1000)
+        ids = [product.get("id") for product, _ in results]
+        relevant = set(case["relevant"])
+        ranks = [rank for rank, pid in enumerate(ids, 1) if pid in relevant]
+        hits_at_1.append(bool(ranks) and ranks[0] == 1)
+        hits_at_k.append(bool(ranks))
+        reciprocal_ranks.append(1.0 / ranks[0] if ranks else 0.0)
+    return {
+        "hit@1": float(np.mean(hits_at_1)),
+        f"hit@{TOP_K}": float(np.mean(hits_at_k)),
+        "mrr": float(np.mean(reciprocal_ranks)),
+        "p50_ms": float(np.percentile(latencies, 50)),
+        "p95_ms": float(np.percentile(latencies, 95)),
+    }
+
+
+if __name__ == "__main__":
+    catalog = sys.argv[1] if len(sys.argv) > 1 else "rproducts.json"
+    with open(sys.argv[2] if len(sys.argv) > 2 else QUERIES_PATH) as f:
+        cases = json.load(f)
+
+    rag = ProductRAGWithEmbeddings(catalog)
+    modes = ["lexical"]
+    if embedders.EMBEDDER != "gemini" or os.getenv("GOOGLE_API_KEY"):
+        rag.generate_embeddings()
+        # Warm the query-embedding cache so latency reflects retrieval, not the embedding API
+        for case in cases:
+            rag._embed_query(case["query"])
+        modes += ["vector", "hybrid"]
+    else:
+        print("GOOGLE_API_KEY not set; evaluating lexical retrieval only")
+
+    print(f"{len(cases)} queries over {len(rag.products)} products, embedder {rag.embedder.name}")
+    for mode in modes:
+        result = evaluate(rag, cases, mode)
+        print(f"  {mode:<8} " + "  ".join(f"{k}={v:.3f}" for k, v in result.items()))
@@ -0,0 +1,55 @@
+"""
+Per-session memory: legacy dict context vs. slotted SessionContext.
+Run from app/: python -m benchmarks.session_memory
+"""
+import datetime
+import tracemalloc
+
+from models import SessionContext
+
+SESSIONS = 1000
+TURNS = 30
+AGENTS = ["Recommendation Agent", "Sales Specialist", "Shopping Cart Specialist"]
+
+
+def legacy_context(turns: int) -> dict:
+    context = {
+        "conversation_history": [], "user_preferences": {}, "products_mentioned": [],
+        "cart_items": [], "customer_info": {}, "issues_reported": [],
+        "recommendations_given": [], "transactions": [], "loyalty_points": 0,
+        "follow_ups": [],
+        "session_metadata": {"start_time": None, "last_interaction": None, "interaction_count": 0}
+    }
+    for i in range(turns):
+        context["conversation_history"].append({
+            "user": f"show me jackets {i}",
+            "agent": "".join(AGENTS[i % 3]),  # decoded from JSON: not interned
+            "reply": f"Here are some options {i}",
+            "product_ids": [1, 2, 3],
+            "timestamp": datetime.datetime.now().isoformat()
+        })
+    return context
+
+
+def slotted_context(turns: int) -> SessionContext:
+    context = SessionContext()
+    for i in range(turns):
+        context.add_turn(f"show me jackets {i}", "".join(AGENTS[i % 3]), f"Here are some options {i}", [1, 2, 3])
+    return context
+
+
+def measure(factory) -> float:
+    tracemalloc.start()
+    sessions = [factory(TURNS) for _ in range(SESSIONS)]
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del sessions
+    return current / SESSIONS
+
+
+if __name__ == "__main__":
+    legacy = measure(legacy_context)
+    slotted = measure(slotted_context)
+    print(f"{SESSIONS} sessions x {TURNS} turns")
+    print(f"  dict context:    {legacy / 1024:7.1f} KiB/session")
+    print(f"  SessionContext:  {slotted / 1024:7.1f} KiB/session ({100 * (1 - slotted / legacy):.0f}% smaller)")
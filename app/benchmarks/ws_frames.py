@@ -0,0 +1,111 @@
+"""
+Bytes on the wire and CPU per /ws frame: JSON vs msgpack, with and without permessage-deflate.
+Run from app/: python -m benchmarks.ws_frames
+"""
+import json
+import time
+import zlib
+import random
+
+import msgpack
+
+SESSIONS = 200
+TURNS = 20
+# What the websockets server negotiates by default: 4 KiB window, memLevel 5, context takeover
+DEFLATE_WBITS = 12
+DEFLATE_MEM_LEVEL = 5
+
+
+def conversation(products, turns: int, rng: random.Random):
+    """A welcome frame, then bot replies naming catalog products (text dominates, like real replies)"""
+    frames = [{
+        "agent": "System", "message": "👋 Welcome back, Ann! Your previous session has been restored.",
+        "product_ids": [], "seq": 1,
+        "session": {"restored": True, "resumed": False, "cart_items": [], "loyalty_points": 120,
+                    "interaction_count": 7}
+    }]
+    for turn in range(turns):
+        picks = rng.sample(products, 3)
+        lines = [f"**{p['name']}** ({p['category']}): {p['description']} "
+                 f"Available in {', '.join(i['variant'] for i in p['items'])} from ${min(i['price'] for i in p['items'])}."
+                 for p in picks]
+        frames.append({
+            "agent": rng.choice(["Recommendation Agent", "Sales Specialist", "Shopping Cart Specialist"]),
+            "message": "Here are a few options you might like:\n\n" + "\n\n".join(lines),
+            "product_ids": [p["id"] for p in picks],
+            "seq": turn + 2,
+            "reply_to": f"lq{turn:04x}-{turn}"
+        })
+    return frames
+
+
+class Deflater:
+    """permessage-deflate sender side: one stream per connection (or per message without context takeover)"""
+
+    def __init__(self, context_takeover: bool = True):
+        self.context_takeover = context_takeover
+        self._stream = self._new()
+
+    @staticmethod
+    def _new():
+        return zlib.compressobj(zlib.Z_DEFAULT_COMPRESSION, zlib.DEFLATED, -DEFLATE_WBITS, DEFLATE_MEM_LEVEL)
+
+    def compress(self, data: bytes) -> bytes:
+        stream = self._stream if self.context_takeover else self._new()
+        # RFC 7692: sync flush, then drop the trailing 00 00 ff ff
+        return (stream.compress(data) + stream.flush(zlib.Z_SYNC_FLUSH))[:-4]
+
+
+class Inflater:
+    def __init__(self, context_takeover: bool = True):
+        self.context_takeover = context_takeover
+        self._stream = zlib.decompressobj(-DEFLATE_WBITS)
+
+    def decompress(self, data: bytes) -> bytes:
+        stream = self._stream if self.context_takeover else zlib.decompressobj(-DEFLATE_WBITS)
+        return stream.decompress(data + b"\x00\x00\xff\xff")
+
+
+MODES = {
+    "json": (lambda f: json.dumps(f).encode(), lambda b: json.loads(b)),
+    "msgpack": (lambda f: msgpack.packb(f, use_bin_type=True), lambda b: msgpack.unpackb(b)),
+}
+
+
+def run(sessions, mode: str, deflate: str):
+    encode, decode = MODES[mode]
+    raw_bytes = wire_bytes = 0
+    send_cpu = receive_cpu = 0.0
+    frames = 0
+    for frames_of_session in sessions:
+        deflater = Deflater(deflate == "takeover") if deflate else None
+        inflater = Inflater(deflate == "takeover") if deflate else None
+        for frame in frames_of_session:
+            start = time.perf_counter()
+            payload = encode(frame)
+            wire = deflater.compress(payload) if deflater else payload
+            mid = time.perf_counter()
+            decode(inflater.decompress(wire) if inflater else wire)
+            end = time.perf_counter()
+            send_cpu += mid - start
+            receive_cpu += end - mid
+            raw_bytes += len(payload)
+            wire_bytes += len(wire)
+            frames += 1
+    return raw_bytes / frames, wire_bytes / frames, send_cpu / frames * 1e6, receive_cpu / frames * 1e6
+
+
+if __name__ == "__main__":
+    with open("rproducts.json") as f:
+        products = json.load(f)["products"]
+    rng = random.Random(7)
+    sessions = [conversation(products, TURNS, rng) for _ in range(SESSIONS)]
+    print(f"{SESSIONS} sessions x {TURNS + 1} frames")
+    print(f"  {'encoding':<30} {'bytes/frame':>11} {'vs json':>8} {'send us':>8} {'recv us':>8}")
+    baseline = None
+    for mode in ("json", "msgpack"):
+        for deflate, label in ((None, ""), ("per_message", " + deflate (no takeover)"),
+                               ("takeover", " + deflate")):
+            _, wire, send_us, recv_us = run(sessions, mode, deflate)
+            baseline = baseline or wire
+            print(f"  {mode + label:<30} {wire:11.0f} {100 * wire / baseline:7.0f}% {send_us:8.1f} {recv_us:8.1f}")
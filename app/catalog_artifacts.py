@@ -0,0 +1,101 @@
+"""
+Prebuilt catalog artifacts: the columnar product store, text digests, id
+lookups and BM25 postings, saved as .npy files next to the catalog. The
+server memory-maps them at boot instead of parsing and indexing the
+catalog. Written by `python -m catalog_import`.
+"""
+import os
+import json
+import shutil
+import hashlib
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+
+from catalog_store import ProductStore, MappedStringTable, SortedIndex
+from lexical_index import LexicalIndex
+
+# Bumped when the layout changes; older bundles are ignored and the catalog is parsed instead
+ARTIFACT_VERSION = 1
+MANIFEST = "manifest.json"
+
+
+def artifacts_dir(catalog_path: str) -> str:
+    return os.path.splitext(catalog_path)[0] + ".artifacts"
+
+
+def catalog_signature(catalog_path: str) -> str:
+    """sha256 of the catalog file; a bundle is only used for the exact file it was built from"""
+    digest = hashlib.sha256()
+    with open(catalog_path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _int_keys(mapping: Dict[int, Dict]) -> Dict[int, Dict]:
+    return {int(row): value for row, value in mapping.items()}
+
+
+def save(directory: str, signature: str, store: ProductStore, text_digests: np.ndarray,
+         lexical: LexicalIndex, product_rows: Dict[int, int], item_rows: Dict[str, int]):
+    """Write the bundle to a temporary directory and swap it in, so readers never see half of one"""
+    tmp_dir = f"{directory}.{os.getpid()}.tmp"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+    blob, offsets = store.strings.to_arrays()
+    product_index = SortedIndex.from_dict(product_rows, np.int64)
+    item_index = SortedIndex.from_dict(item_rows, str)
+    vocabulary = SortedIndex.from_dict(lexical.vocabulary, str)
+    arrays = dict(
+        store.columns(),
+        string_blob=blob, string_offsets=offsets, text_digests=text_digests,
+        product_keys=product_index.keys, product_key_rows=product_index.rows,
+        item_keys=item_index.keys, item_key_rows=item_index.rows,
+        vocabulary_terms=vocabulary.keys, vocabulary_ids=vocabulary.rows,
+        posting_offsets=lexical.offsets, posting_rows=lexical.rows, posting_weights=lexical.weights,
+        doc_lengths=lexical.doc_lengths,
+    )
+    for name, value in arrays.items():
+        np.save(os.path.join(tmp_dir, f"{name}.npy"), np.ascontiguousarray(value))
+    with open(os.path.join(tmp_dir, "extras.json"), "w") as f:
+        json.dump({"extras": store.extras, "item_extras": store.item_extras}, f)
+    with open(os.path.join(tmp_dir, MANIFEST), "w") as f:
+        json.dump({"version": ARTIFACT_VERSION, "catalog_sha256": signature,
+                   "products": len(store), "variants": len(store.item_ids), "terms": len(vocabulary)}, f)
+
+    old_dir = f"{directory}.{os.getpid()}.old"
+    if os.path.isdir(directory):
+        os.replace(directory, old_dir)
+    os.replace(tmp_dir, directory)
+    # Processes still mapping the old files keep them until they unmap
+    shutil.rmtree(old_dir, ignore_errors=True)
+
+
+def load(directory: str, signature: str) -> Optional[Tuple[ProductStore, np.ndarray, LexicalIndex,
+                                                           SortedIndex, SortedIndex]]:
+    """(store, text digests, lexical index, product rows, item rows), or None if missing or stale"""
+    try:
+        with open(os.path.join(directory, MANIFEST)) as f:
+            manifest = json.load(f)
+        if manifest.get("version") != ARTIFACT_VERSION or manifest.get("catalog_sha256") != signature:
+            return None
+        arrays = {name[:-4]: np.load(os.path.join(directory, name), mmap_mode="r")
+                  for name in os.listdir(directory) if name.endswith(".npy")}
+        with open(os.path.join(directory, "extras.json")) as f:
+            extras = json.load(f)
+        store = ProductStore.from_columns(
+            MappedStringTable(arrays["string_blob"], arrays["string_offsets"]),
+            {name: arrays[name] for name in ProductStore.COLUMNS},
+            _int_keys(extras["extras"]), _int_keys(extras["item_extras"])
+        )
+        lexical = LexicalIndex(SortedIndex(arrays["vocabulary_terms"], arrays["vocabulary_ids"]),
+                               arrays["posting_offsets"], arrays["posting_rows"], arrays["posting_weights"],
+                               arrays["doc_lengths"])
+        return (store, arrays["text_digests"], lexical,
+                SortedIndex(arrays["product_keys"], arrays["product_key_rows"]),
+                SortedIndex(arrays["item_keys"], arrays["item_key_rows"]))
+    except (FileNotFoundError, KeyError, ValueError, OSError) as e:
+        if not isinstance(e, FileNotFoundError):
+            print(f"⚠ Ignoring catalog artifacts in {directory}: {e}")
+        return None
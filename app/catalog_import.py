@@ -0,0 +1,245 @@
+"""
+Bulk catalog import: validate a JSON, JSON Lines or CSV catalog against the
+id/name/category/items schema, write it as the catalog file, and build every
+derived artifact in one pass (store columns, id lookups, BM25 postings, text
+digests, embeddings and the vector index). The server maps them at boot.
+Validation and the store are cheap and run in this process; only local
+(non-Gemini) embedding is spread over worker processes.
+Run from app/: python -m catalog_import new_catalog.csv [--out rproducts.json] [--workers 4]
+"""
+import os
+import csv
+import sys
+import json
+import math
+import argparse
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+import catalog_artifacts
+from catalog_store import ProductStore, iter_products, product_text, text_digests
+from embedders import GeminiEmbedder, create_embedder
+from product_rag import CatalogSnapshot, ProductRAGWithEmbeddings
+
+# CSV catalogs have one row per variant; rows with the same id are one product
+CSV_PRODUCT_FIELDS = ("id", "name", "category", "description")
+CSV_ITEM_FIELDS = {"item_id": "item_id", "variant": "variant", "price": "price", "item_description": "description"}
+# Texts per embedding task
+EMBED_CHUNK_SIZE = 256
+ERRORS_SHOWN = 20
+
+_worker_embedder = None
+
+
+def read_csv(path: str) -> Iterator[Dict]:
+    """Products from a CSV with id, name, category, description, item_id, variant, price, item_description"""
+    products: Dict[str, Dict] = {}
+    with open(path, newline="") as f:
+        for line_number, row in enumerate(csv.DictReader(f), 2):
+            row = {k.strip(): (v or "").strip() for k, v in row.items() if k}
+            key = row.get("id", "") or f"line {line_number}"
+            product = products.get(key)
+            if product is None:
+                product = {field: row[field] for field in CSV_PRODUCT_FIELDS if row.get(field)}
+                product.update({k: v for k, v in row.items()
+                                if v and k not in CSV_PRODUCT_FIELDS and k not in CSV_ITEM_FIELDS})
+                product["items"] = []
+                products[key] = product
+            item = {field: row[column] for column, field in CSV_ITEM_FIELDS.items() if row.get(column)}
+            if item:
+                product["items"].append(item)
+    yield from products.values()
+
+
+def read_catalog(path: str) -> Iterator[Dict]:
+    if path.endswith(".csv"):
+        return read_csv(path)
+    return iter_products(path)
+
+
+def _number(value) -> Optional[float]:
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, (int, float)):
+        return float(value) if math.isfinite(value) else None
+    try:
+        number = float(str(value).replace(",", ""))
+    except ValueError:
+        return None
+    return number if math.isfinite(number) else None
+
+
+def validate_product(raw, position: int) -> Tuple[Optional[Dict], List[str]]:
+    """Normalised product (numeric strings converted, blanks dropped) and the problems found"""
+    where = f"product #{position}"
+    if not isinstance(raw, dict):
+        return None, [f"{where}: expected an object, got {type(raw).__name__}"]
+    product = {k: v for k, v in raw.items() if v is not None and v != ""}
+    errors = []
+
+    pid = _number(product.get("id"))
+    if pid is None or pid != int(pid) or pid < 0:
+        errors.append(f"{where}: id must be a non-negative integer, got {raw.get('id')!r}")
+    else:
+        product["id"] = int(pid)
+        where = f"product #{position} (id {product['id']})"
+    for field in ("name", "category"):
+        value = product.get(field)
+        if not isinstance(value, str) or not value.strip():
+            errors.append(f"{where}: {field} must be a non-empty string")
+    if "description" in product and not isinstance(product["description"], str):
+        errors.append(f"{where}: description must be a string")
+
+    items = product.get("items")
+    if not isinstance(items, list) or not items:
+        errors.append(f"{where}: items must be a non-empty list of variants")
+        items = []
+    normalised = []
+    for i, item in enumerate(items):
+        if not isinstance(item, dict):
+            errors.append(f"{where}: items[{i}] must be an object")
+            continue
+        item = {k: v for k, v in item.items() if v is not None and v != ""}
+        if not isinstance(item.get("item_id"), str) or not item["item_id"].strip():
+            errors.append(f"{where}: items[{i}].item_id must be a non-empty string")
+        if "price" in item:
+            price = _number(item["price"])
+            if price is None or price < 0:
+                errors.append(f"{where}: items[{i}].price must be a non-negative number, got {item['price']!r}")
+            else:
+                item["price"] = price
+        normalised.append(item)
+    product["items"] = normalised
+    return (None if errors else product), errors
+
+
+def _embed_chunk(texts: List[str]) -> np.ndarray:
+    """Runs in a pool worker; each worker loads the embedding model once"""
+    global _worker_embedder
+    if _worker_embedder is None:
+        _worker_embedder = create_embedder()
+    return np.asarray(_worker_embedder.embed_documents(texts), dtype=np.float32)
+
+
+def _chunks(items: List, size: int) -> Iterator[List]:
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def validate_catalog(raw_products: Iterable) -> Tuple[List[Dict], List[str]]:
+    """Products that passed, and every problem found (including duplicate ids and item_ids)"""
+    errors, seen_ids, seen_items, unique = [], set(), {}, []
+    for position, raw in enumerate(raw_products, 1):
+        product, problems = validate_product(raw, position)
+        errors.extend(problems)
+        if product is None:
+            continue
+        if product["id"] in seen_ids:
+            errors.append(f"product id {product['id']}: duplicate id")
+            continue
+        clashes = [item["item_id"] for item in product["items"] if item["item_id"] in seen_items]
+        if clashes:
+            errors.extend(f"product id {product['id']}: item_id {item_id} already used by product "
+                          f"{seen_items[item_id]}" for item_id in clashes)
+            continue
+        seen_ids.add(product["id"])
+        seen_items.update((item["item_id"], product["id"]) for item in product["items"])
+        unique.append(product)
+    return unique, errors
+
+
+def write_catalog(products: List[Dict], path: str):
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump({"products": products}, f, indent=2)
+    os.replace(tmp_path, path)
+
+
+def build_embeddings(rag, products: List[Dict], digests: np.ndarray, previous_digests: Optional[np.ndarray],
+                     workers: int):
+    """Embed only products whose text is new (rows of the previous build are reused); returns rows embedded"""
+    if rag._load_cached_embeddings(digests) is not None:
+        return 0
+    previous = rag._load_cached_embeddings(previous_digests) if previous_digests is not None else None
+    source = np.full(len(products), -1, dtype=np.int64)
+    if previous is not None:
+        previous_rows = {int(d): row for row, d in enumerate(previous_digests)}
+        source = np.array([previous_rows.get(int(d), -1) for d in digests], dtype=np.int64)
+    missing = np.flatnonzero(source < 0).tolist()
+
+    new_rows = None
+    if missing and isinstance(rag.embedder.backend, GeminiEmbedder):
+        # Remote API: one process, so the client-side quota scheduler sees every request
+        new_rows = rag._embed_documents(rag._snapshot.products, missing)
+    elif missing:
+        texts = [product_text(products[row]) for row in missing]
+        # spawn: workers import only this module's light dependencies, never the chat backend
+        with ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context("spawn")) as pool:
+            chunks = list(pool.map(_embed_chunk, _chunks(texts, EMBED_CHUNK_SIZE)))
+        new_rows = rag._normalize(np.concatenate(chunks))
+
+    dim = (previous if previous is not None else new_rows).shape[1]
+    embeddings = np.empty((len(products), dim), dtype=np.float32)
+    kept = np.flatnonzero(source >= 0)
+    if len(kept):
+        embeddings[kept] = previous[source[kept]]
+    if missing:
+        embeddings[missing] = new_rows
+    embeddings = rag._save_cached_embeddings(embeddings, digests)
+    rag._build_index(embeddings, digests)
+    return len(missing)
+
+
+def _previous_digests(directory: str) -> Optional[np.ndarray]:
+    try:
+        return np.load(os.path.join(directory, "text_digests.npy"))
+    except (FileNotFoundError, ValueError, OSError):
+        return None
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("input", help="Catalog to import (.json, .jsonl/.ndjson or .csv)")
+    parser.add_argument("--out", default="rproducts.json", help="Catalog file the server loads")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="Processes for local embedding")
+    parser.add_argument("--skip-invalid", action="store_true", help="Import the valid products despite errors")
+    parser.add_argument("--no-embeddings", action="store_true", help="Leave embedding to the server's warm-up")
+    args = parser.parse_args()
+
+    try:
+        products, errors = validate_catalog(read_catalog(args.input))
+    except (OSError, ValueError) as e:
+        print(f"⚠ Could not read {args.input}: {e}")
+        sys.exit(1)
+    for error in errors[:ERRORS_SHOWN]:
+        print(f"  ⚠ {error}")
+    if len(errors) > ERRORS_SHOWN:
+        print(f"  ... and {len(errors) - ERRORS_SHOWN} more")
+    if errors and not args.skip_invalid:
+        print(f"⚠ {len(errors)} problems; nothing written (use --skip-invalid to import the valid products)")
+        sys.exit(1)
+    if not products:
+        print("⚠ No valid products to import")
+        sys.exit(1)
+    print(f"✓ Validated {len(products)} products")
+
+    digests = text_digests(products)
+    directory = catalog_artifacts.artifacts_dir(args.out)
+    previous_digests = _previous_digests(directory)
+    write_catalog(products, args.out)
+
+    store = ProductStore()
+    for product in products:
+        store.append(product)
+    snapshot = CatalogSnapshot.build(store, digests)
+    catalog_artifacts.save(directory, catalog_artifacts.catalog_signature(args.out), store, digests,
+                           snapshot.lexical, snapshot.product_rows, snapshot.item_rows)
+    print(f"✓ Wrote {args.out} and {directory}/ ({len(snapshot.lexical.vocabulary)} terms)")
+
+    if not args.no_embeddings:
+        rag = ProductRAGWithEmbeddings(args.out)
+        embedded = build_embeddings(rag, products, digests, previous_digests, args.workers)
+        print(f"✓ Embeddings ready: {embedded} embedded, {len(products) - embedded} reused")
@@ -0,0 +1,389 @@
+"""Streaming catalog loader and compact columnar product store"""
+import json
+import math
+import hashlib
+from array import array
+from collections.abc import Mapping
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+from models import Product, Variant
+
+# Keys stored in dedicated columns; anything else on a product lands in the sparse extras map
+PRODUCT_COLUMNS = ("id", "name", "category", "description", "items")
+ITEM_COLUMNS = ("item_id", "variant", "price", "description")
+
+MISSING_ID = -1
+CHUNK_SIZE = 1 << 16
+
+
+class StringTable:
+    """Interned string storage; ref 0 is reserved for a missing value"""
+
+    def __init__(self):
+        self.strings: List[Optional[str]] = [None]
+        self._refs: Dict[str, int] = {}
+
+    def intern(self, value) -> int:
+        if value is None:
+            return 0
+        value = str(value)
+        ref = self._refs.get(value)
+        if ref is None:
+            ref = len(self.strings)
+            self.strings.append(value)
+            self._refs[value] = ref
+        return ref
+
+    def __getitem__(self, ref: int) -> Optional[str]:
+        return self.strings[ref]
+
+    def __len__(self):
+        return len(self.strings) - 1
+
+    def nbytes(self) -> int:
+        return sum(len(s) for s in self.strings if s is not None)
+
+    def to_arrays(self) -> Tuple[np.ndarray, np.ndarray]:
+        """UTF-8 blob of every string and end offsets, ref r spanning offsets[r-1]:offsets[r]"""
+        encoded = [s.encode() for s in self.strings[1:]]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum([len(b) for b in encoded])
+        return np.frombuffer(b"".join(encoded), dtype=np.uint8), offsets
+
+
+class MappedStringTable:
+    """Read-only StringTable over a (memory-mapped) blob; strings are decoded on access"""
+
+    def __init__(self, blob: np.ndarray, offsets: np.ndarray):
+        self.blob = blob
+        self.offsets = offsets
+
+    def __getitem__(self, ref: int) -> Optional[str]:
+        if ref == 0:
+            return None
+        return self.blob[self.offsets[ref - 1]:self.offsets[ref]].tobytes().decode()
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def nbytes(self) -> int:
+        return len(self.blob)
+
+
+class SortedIndex(Mapping):
+    """Read-only key -> row mapping over sorted key and row arrays, so it can be memory-mapped"""
+
+    def __init__(self, keys: np.ndarray, rows: np.ndarray):
+        self.keys = keys
+        self.rows = rows
+
+    @classmethod
+    def from_dict(cls, mapping: Dict, dtype) -> "SortedIndex":
+        keys = np.array(list(mapping.keys()), dtype=dtype)
+        rows = np.array(list(mapping.values()), dtype=np.int64)
+        order = np.argsort(keys, kind="stable")
+        return cls(keys[order], rows[order])
+
+    def __getitem__(self, key) -> int:
+        i = int(np.searchsorted(self.keys, key))
+        if i < len(self.keys) and self.keys[i] == key:
+            return int(self.rows[i])
+        raise KeyError(key)
+
+    def __iter__(self):
+        return (key.item() for key in self.keys)
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+
+class ProductStore:
+    """
+    Columnar catalog: ids and prices in typed arrays, text in an interned
+    string table. Behaves like a read-only list of product dicts; each
+    access materialises a fresh dict, so callers cannot mutate the store.
+    """
+
+    # Typed columns, in the order they are saved as artifacts
+    COLUMNS = ("ids", "names", "categories", "descriptions", "item_offsets",
+               "item_ids", "item_variants", "item_prices", "item_descriptions")
+
+    def __init__(self):
+        self.strings = StringTable()
+        self.ids = array('q')
+        self.names = array('I')
+        self.categories = array('I')
+        self.descriptions = array('I')
+        self.item_offsets = array('I', [0])
+        self.item_ids = array('I')
+        self.item_variants = array('I')
+        self.item_prices = array('d')
+        self.item_descriptions = array('I')
+        self.extras: Dict[int, Dict] = {}
+        self.item_extras: Dict[int, Dict] = {}
+
+    @classmethod
+    def from_columns(cls, strings, columns: Dict[str, np.ndarray], extras: Dict[int, Dict],
+                     item_extras: Dict[int, Dict]) -> "ProductStore":
+        """Read-only store over saved (typically memory-mapped) columns; append() is not supported"""
+        store = cls.__new__(cls)
+        store.strings = strings
+        for name in cls.COLUMNS:
+            setattr(store, name, columns[name])
+        store.extras = extras
+        store.item_extras = item_extras
+        return store
+
+    def columns(self) -> Dict[str, np.ndarray]:
+        """Zero-copy numpy views of the typed columns"""
+        return {name: np.asarray(getattr(self, name)) for name in self.COLUMNS}
+
+    def append(self, product: Dict):
+        row = len(self.ids)
+        pid = product.get("id")
+        has_int_id = isinstance(pid, int) and not isinstance(pid, bool) and pid != MISSING_ID
+        self.ids.append(pid if has_int_id else MISSING_ID)
+        self.names.append(self.strings.intern(product.get("name")))
+        self.categories.append(self.strings.intern(product.get("category")))
+        self.descriptions.append(self.strings.intern(product.get("description")))
+
+        extras = {k: v for k, v in product.items() if k not in PRODUCT_COLUMNS}
+        if "id" in product and not has_int_id:
+            extras["id"] = pid
+        if extras:
+            self.extras[row] = extras
+
+        for item in product.get("items") or []:
+            item_row = len(self.item_ids)
+            self.item_ids.append(self.strings.intern(item.get("item_id")))
+            self.item_variants.append(self.strings.intern(item.get("variant")))
+            price = item.get("price")
+            self.item_prices.append(float(price) if isinstance(price, (int, float)) else math.nan)
+            self.item_descriptions.append(self.strings.intern(item.get("description")))
+            item_extras = {k: v for k, v in item.items() if k not in ITEM_COLUMNS}
+            if price is not None and not isinstance(price, (int, float)):
+                item_extras["price"] = price
+            if item_extras:
+                self.item_extras[item_row] = item_extras
+        self.item_offsets.append(len(self.item_ids))
+
+    def _item(self, item_row: int) -> Dict:
+        item = {}
+        for key, column in (("item_id", self.item_ids), ("variant", self.item_variants)):
+            value = self.strings[column[item_row]]
+            if value is not None:
+                item[key] = value
+        price = float(self.item_prices[item_row])
+        if not math.isnan(price):
+            item["price"] = price
+        description = self.strings[self.item_descriptions[item_row]]
+        if description is not None:
+            item["description"] = description
+        item.update(self.item_extras.get(item_row, {}))
+        return item
+
+    def product(self, row: int) -> Dict:
+        product = {}
+        if self.ids[row] != MISSING_ID:
+            product["id"] = int(self.ids[row])
+        for key, column in (("name", self.names), ("category", self.categories),
+                            ("description", self.descriptions)):
+            value = self.strings[column[row]]
+            if value is not None:
+                product[key] = value
+        product["items"] = [self._item(i) for i in range(self.item_offsets[row], self.item_offsets[row + 1])]
+        product.update(self.extras.get(row, {}))
+        return product
+
+    def model(self, row: int) -> Product:
+        """Typed view of a row, built straight from the columns"""
+        strings = self.strings
+        items = []
+        for i in range(self.item_offsets[row], self.item_offsets[row + 1]):
+            price = float(self.item_prices[i])
+            items.append(Variant(
+                strings[self.item_ids[i]] or "",
+                strings[self.item_variants[i]] or "",
+                None if math.isnan(price) else price,
+                strings[self.item_descriptions[i]] or ""
+            ))
+        pid = int(self.ids[row])
+        return Product(
+            pid if pid != MISSING_ID else self.extras.get(row, {}).get("id"),
+            strings[self.names[row]] or "Unknown",
+            strings[self.categories[row]] or "",
+            strings[self.descriptions[row]] or "",
+            tuple(items)
+        )
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self.product(row) for row in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("product index out of range")
+        return self.product(index)
+
+    def __iter__(self) -> Iterator[Dict]:
+        for row in range(len(self)):
+            yield self.product(row)
+
+    def __bool__(self) -> bool:
+        return len(self) > 0
+
+    def nbytes(self) -> int:
+        """Approximate payload size of the columns and string table"""
+        columns = (self.ids, self.names, self.categories, self.descriptions, self.item_offsets,
+                   self.item_ids, self.item_variants, self.item_prices, self.item_descriptions)
+        return sum(c.itemsize * len(c) for c in columns) + self.strings.nbytes()
+
+
+class _JSONStream:
+    """Pulls successive JSON values out of a file without reading it whole"""
+
+    def __init__(self, f, chunk_size: int = CHUNK_SIZE):
+        self.f = f
+        self.chunk_size = chunk_size
+        self.buf = ""
+        self.pos = 0
+        self.eof = False
+        self.decoder = json.JSONDecoder()
+
+    def _fill(self) -> bool:
+        chunk = self.f.read(self.chunk_size)
+        if not chunk:
+            self.eof = True
+            return False
+        self.buf = self.buf[self.pos:] + chunk
+        self.pos = 0
+        return True
+
+    def peek(self) -> str:
+        """Next non-whitespace character without consuming it ('' at end of input)"""
+        while True:
+            while self.pos < len(self.buf) and self.buf[self.pos] in " \t\r\n":
+                self.pos += 1
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            if not self._fill():
+                return ""
+
+    def expect(self, char: str):
+        found = self.peek()
+        if found != char:
+            raise json.JSONDecodeError(f"Expected {char!r}, found {found!r}", self.buf, self.pos)
+        self.pos += 1
+
+    def value(self):
+        self.peek()
+        while True:
+            try:
+                obj, end = self.decoder.raw_decode(self.buf, self.pos)
+            except json.JSONDecodeError:
+                if not self._fill():
+                    raise
+                continue
+            # A scalar that touches the end of the buffer may continue in the next chunk
+            if end == len(self.buf) and not self.eof and not isinstance(obj, (dict, list)):
+                if self._fill():
+                    continue
+            self.pos = end
+            return obj
+
+    def array_items(self) -> Iterator:
+        self.expect("[")
+        if self.peek() == "]":
+            self.pos += 1
+            return
+        while True:
+            yield self.value()
+            if self.peek() == ",":
+                self.pos += 1
+                continue
+            self.expect("]")
+            return
+
+
+def _iter_json(f) -> Iterator[Dict]:
+    """Stream products from a top-level array or a {"products": [...]} document"""
+    stream = _JSONStream(f)
+    first = stream.peek()
+    if first == "[":
+        yield from stream.array_items()
+        return
+    if first != "{":
+        raise json.JSONDecodeError("Catalog must be a JSON array or object", stream.buf, stream.pos)
+
+    # Walk the top-level object; only the "products" array is streamed
+    stream.expect("{")
+    other_fields = {}
+    found_products = False
+    while stream.peek() != "}":
+        key = stream.value()
+        stream.expect(":")
+        if key == "products" and stream.peek() == "[":
+            found_products = True
+            yield from stream.array_items()
+        else:
+            other_fields[key] = stream.value()
+        if stream.peek() == ",":
+            stream.pos += 1
+    stream.expect("}")
+    if not found_products:
+        # A single bare product object
+        yield other_fields
+
+
+def _iter_jsonl(f) -> Iterator[Dict]:
+    for line_number, line in enumerate(f, 1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            yield json.loads(line)
+        except json.JSONDecodeError as e:
+            raise ValueError(f"Invalid JSON on line {line_number}: {e}") from e
+
+
+def iter_products(path: str) -> Iterator[Dict]:
+    """Yield product dicts one at a time from a .json or .jsonl/.ndjson catalog"""
+    with open(path, "r") as f:
+        if path.endswith((".jsonl", ".ndjson")):
+            yield from _iter_jsonl(f)
+        else:
+            yield from _iter_json(f)
+
+
+def product_text(product: Dict) -> str:
+    """Convert product dict to searchable text for embedding"""
+    name = product.get('name') or product.get('title', 'Unknown')
+    category = product.get('category') or product.get('type', '')
+    description = product.get('description', '')
+    price = str(product.get('price', ''))
+    features = product.get('features', '')
+
+    text = f"{name} {category} {description} {features} {price}"
+    return text.strip()
+
+
+def text_digests(products) -> np.ndarray:
+    """64-bit digest of each product's embedding text, used for diffing and cache checks"""
+    digests = np.empty(len(products), dtype=np.uint64)
+    for row, product in enumerate(products):
+        text = product_text(product).encode()
+        digests[row] = int.from_bytes(hashlib.blake2b(text, digest_size=8).digest(), "little")
+    return digests
+
+
+def load_product_store(path: str) -> ProductStore:
+    """Build a ProductStore from a catalog file without materialising the whole JSON graph"""
+    store = ProductStore()
+    for product in iter_products(path):
+        store.append(product)
+    return store
@@ -1,229 +1,103 @@
-from crewai import Agent, LLM
 from dotenv import load_dotenv
 import os
-import json
 import datetime
+import time
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+from dataclasses import dataclass
 import google.generativeai as genai
-from typing import List, Dict, Tuple
+from typing import List, Dict, Tuple, Optional
 import numpy as np
+import metrics
+from models import SessionContext
+import llm_client
+import fast_paths
+import turn_events
+from inventory import INVENTORY_FILTER
+import scheduler
+from model_pool import ModelPool, PoolUnavailable
+from product_rag import ProductRAGWithEmbeddings
+from search_sidecar import SEARCH_SIDECAR, SearchSidecarClient
 
-genai.configure(api_key=os.getenv("GOOGLE_API_KEY"))
 load_dotenv()
+genai.configure(api_key=os.getenv("GOOGLE_API_KEY"))
 
-llm = LLM(
-    model="gemini/gemini-2.5-flash-lite",
-    api_key=os.getenv("GOOGLE_API_KEY")
-)
+# Run retrieval concurrently with prompt assembly; past the deadline the turn goes ahead without products
+PIPELINED_RETRIEVAL = os.getenv("PIPELINED_RETRIEVAL", "true").lower() in ("1", "true", "yes")
+RETRIEVAL_DEADLINE_MS = float(os.getenv("RETRIEVAL_DEADLINE_MS", "300"))
+RETRIEVAL_WORKERS = int(os.getenv("RETRIEVAL_WORKERS", "8"))
 
-class ProductRAGWithEmbeddings:
-    """Proper RAG system using embeddings and cosine similarity"""
-    
-    def __init__(self, products_json_path: str = "rproducts.json"):
-        self.products = self._load_products(products_json_path)
-        self.product_embeddings = None
-        self.embeddings_generated = False
-        
-    def _load_products(self, path: str) -> List[Dict]:
-        """Load products from JSON file"""
-        try:
-            with open(path, 'r') as f:
-                data = json.load(f)
-                if isinstance(data, list):
-                    return data
-                elif isinstance(data, dict) and 'products' in data:
-                    return data['products']
-                else:
-                    return [data]
-        except FileNotFoundError:
-            print(f"Warning: {path} not found. Using empty product list.")
-            return []
-    
-    def _prepare_product_text(self, product: Dict) -> str:
-        """Convert product dict to searchable text for embedding"""
-        name = product.get('name') or product.get('title', 'Unknown')
-        category = product.get('category') or product.get('type', '')
-        description = product.get('description', '')
-        price = str(product.get('price', ''))
-        features = product.get('features', '')
-        
-        text = f"{name} {category} {description} {features} {price}"
-        return text.strip()
-    
-    def generate_embeddings(self):
-        """
-        ONE-TIME PREPROCESSING: Generate embeddings for all products
-        Call this once when initializing the system
-        """
-        if self.embeddings_generated:
-            print("✓ Embeddings already generated")
-            return
-        
-        if not self.products:
-            print("⚠ No products to embed")
-            return
-        
-        print(f"🔄 Generating embeddings for {len(self.products)} products...")
-        
-        embeddings_list = []
-        
-        for i, product in enumerate(self.products):
-            product_text = self._prepare_product_text(product)
-            
-            result = genai.embed_content(
-                model="models/text-embedding-004",
-                content=product_text,
-                task_type="retrieval_document"
-            )
-            
-            embeddings_list.append(result['embedding'])
-            
-            if (i + 1) % 50 == 0 or (i + 1) == len(self.products):
-                print(f"  Progress: {i + 1}/{len(self.products)} products")
-        
-        self.product_embeddings = np.array(embeddings_list)
-        self.embeddings_generated = True
-        
-        print(f"✓ Embeddings generated: {self.product_embeddings.shape}")
-    
-    def cosine_similarity(self, vec1: np.ndarray, vec2: np.ndarray) -> float:
-        """Calculate cosine similarity between two vectors"""
-        dot_product = np.dot(vec1, vec2)
-        magnitude1 = np.linalg.norm(vec1)
-        magnitude2 = np.linalg.norm(vec2)
-        
-        if magnitude1 == 0 or magnitude2 == 0:
-            return 0.0
-        
-        return dot_product / (magnitude1 * magnitude2)
-    
-    def search_products(self, query: str, top_k: int = 5) -> List[Dict]:
-        """
-        Search products using embedding similarity
-        Returns: List of relevant products (without scores for backward compatibility)
-        """
-        if not self.embeddings_generated:
-            print("⚠ Embeddings not generated yet! Using fallback search.")
-            return self._keyword_search(query, top_k)
-        
-        if not self.products:
-            return []
-        
-        # Generate query embedding
-        result = genai.embed_content(
-            model="models/text-embedding-004",
-            content=query,
-            task_type="retrieval_query"
-        )
-        query_embedding = np.array(result['embedding'])
-        
-        # Calculate similarities with all products
-        similarities = []
-        for i, product_emb in enumerate(self.product_embeddings):
-            similarity_score = self.cosine_similarity(query_embedding, product_emb)
-            similarities.append((i, similarity_score))
-        
-        # Sort by similarity (highest first)
-        similarities.sort(key=lambda x: x[1], reverse=True)
-        
-        # Return top-k products
-        top_results = [self.products[i] for i, score in similarities[:top_k]]
-        return top_results
-    
-    def search_products_with_scores(self, query: str, top_k: int = 5) -> List[Tuple[Dict, float]]:
-        """
-        Search products and return with similarity scores
-        Useful for debugging or showing confidence
-        """
-        if not self.embeddings_generated:
-            return [(p, 0.0) for p in self._keyword_search(query, top_k)]
-        
-        if not self.products:
-            return []
-        
-        result = genai.embed_content(
-            model="models/text-embedding-004",
-            content=query,
-            task_type="retrieval_query"
-        )
-        query_embedding = np.array(result['embedding'])
-        
-        similarities = []
-        for i, product_emb in enumerate(self.product_embeddings):
-            similarity_score = self.cosine_similarity(query_embedding, product_emb)
-            similarities.append((i, similarity_score))
-        
-        similarities.sort(key=lambda x: x[1], reverse=True)
-        
-        return [(self.products[i], score) for i, score in similarities[:top_k]]
-    
-    def _keyword_search(self, query: str, top_k: int = 5) -> List[Dict]:
-        """Fallback keyword-based search if embeddings fail"""
-        query_lower = query.lower()
-        scored_products = []
-        
-        for product in self.products:
-            score = 0
-            searchable_text = json.dumps(product).lower()
-            
-            for term in query_lower.split():
-                if len(term) > 2:
-                    score += searchable_text.count(term)
-            
-            if score > 0:
-                scored_products.append((score, product))
-        
-        scored_products.sort(reverse=True, key=lambda x: x[0])
-        return [p[1] for p in scored_products[:top_k]]
-    
-    def _format_products_for_context(self, products: List[Dict]) -> str:
-        """Format products for LLM context"""
-        formatted = []
-        for i, p in enumerate(products, 1):
-            name = p.get('name') or p.get('title') or p.get('product_name', 'Unknown')
-            price = p.get('price') or p.get('cost', 'N/A')
-            category = p.get('category') or p.get('type', 'General')
-            description = p.get('description', '')[:100]
-            product_id = p.get('id', 'N/A')
-            
-            formatted.append(
-                f"{i}. {name} (ID: {product_id}) | Category: {category} | Price: {price} | {description}"
-            )
-        return "\n".join(formatted)
+# Replies remembered for the degraded path when the model misses the turn deadline
+RESPONSE_CACHE_SIZE = int(os.getenv("RESPONSE_CACHE_SIZE", "512"))
+# Only these agents' replies are remembered; cart, order and account replies depend on session state
+CACHEABLE_AGENTS = ("Recommendation Agent", "Sales Specialist")
+
+# Personalised re-ranking: EMA rate of the preference profile (the re-rank weight is in product_rag)
+PREFERENCE_ALPHA = float(os.getenv("PREFERENCE_ALPHA", "0.2"))
+# Strength of each interest signal: shown in a reply, asked about directly, put in the cart
+SHOWN_WEIGHT = 0.5
+VIEWED_WEIGHT = 1.0
+CARTED_WEIGHT = 2.0
+VIEW_INTENTS = ("show_product", "show_item", "stock_check")
+
+# Retrieved products that get cross-sell lines, and neighbours listed per product
+CROSS_SELL_PRODUCTS = 3
+CROSS_SELL_NEIGHBOURS = 3
+
+NO_PRODUCTS_CONTEXT = "No specific products retrieved for this query."
+RETRIEVAL_TIMEOUT_CONTEXT = "Product search is taking longer than usual; answer without specific products."
+
+
+def session_owner(context: SessionContext) -> str:
+    """Key for what belongs to one session (stock holds, remembered replies): the customer's email"""
+    return context.customer_info.get("email") or f"local-{id(context)}"
+
+
+@dataclass(frozen=True)
+class AgentProfile:
+    """Role description exposed to Gemini as a function declaration"""
+    role: str
+    goal: str
+    backstory: str
 
 
 class ConversationalCrew:
     def __init__(self, agents, products_json_path: str = "rproducts.json"):
         self.agents = agents
-        self.product_rag = ProductRAGWithEmbeddings(products_json_path)
+        self.product_rag = ProductRAGWithEmbeddings(
+            products_json_path, search_client=SearchSidecarClient(SEARCH_SIDECAR) if SEARCH_SIDECAR else None
+        )
+        self.warmup_error = None
         
-        # Initialize embeddings at startup (one-time preprocessing)
+        self.context = SessionContext()
+        
+        # One or more keys / model tiers from LLM_POOL; a single default-key model otherwise
+        self.genai_model = ModelPool.from_env()
+        self.agent_tools = self._create_gemini_tools()
+        self.retrieval_executor = ThreadPoolExecutor(RETRIEVAL_WORKERS, thread_name_prefix="retrieval")
+        self.llm = llm_client.HedgedCaller()
+        # Recent replies by message text, served when the model misses the turn deadline
+        self._response_cache: "OrderedDict[Tuple[str, str], Tuple[str, str, List[int]]]" = OrderedDict()
+        self._response_cache_lock = threading.Lock()
+
+    @property
+    def is_ready(self) -> bool:
+        """True once the embedding index is loaded; until then retrieval uses keyword search"""
+        return self.product_rag.embeddings_generated
+    
+    def warm_up(self):
+        """Load or build the embedding index; meant to run off the event loop at startup"""
         print("\n" + "="*60)
         print("INITIALIZING RAG SYSTEM")
         print("="*60)
-        self.product_rag.generate_embeddings()
+        try:
+            self.product_rag.generate_embeddings()
+        except Exception as e:
+            self.warmup_error = str(e)
+            print(f"⚠ Embedding warm-up failed, staying on keyword search: {e}")
         print("="*60 + "\n")
-        
-        self.context = {
-            "conversation_history": [],
-            "user_preferences": {},
-            "products_mentioned": [],
-            "cart_items": [],
-            "customer_info": {},
-            "issues_reported": [],
-            "recommendations_given": [],
-            "transactions": [],
-            "loyalty_points": 0,
-            "follow_ups": [],
-            "session_metadata": {
-                "start_time": None,
-                "last_interaction": None,
-                "interaction_count": 0
-            }
-        }
-        
-        self.genai_model = genai.GenerativeModel('gemini-2.5-flash-lite')
-        self.agent_tools = self._create_gemini_tools()
-
+    
     def _create_gemini_tools(self):
         """Create Gemini function declarations for each agent"""
         function_declarations = []
@@ -240,10 +114,15 @@ class ConversationalCrew:
                                 type=genai.protos.Type.STRING,
                                 description="The agent's response to the user in first-person tone"
                             ),
-                            "cart_items": genai.protos.Schema(
+                            "cart_add": genai.protos.Schema(
                                 type=genai.protos.Type.ARRAY,
-                                description="Products to add to cart",
-                                items=genai.protos.Schema(type=genai.protos.Type.STRING)
+                                description="Variants to add to the cart, by item_id from the product list",
+                                items=self._cart_line_schema()
+                            ),
+                            "cart_remove": genai.protos.Schema(
+                                type=genai.protos.Type.ARRAY,
+                                description="Variants to take out of the cart, by item_id; omit quantity to remove the line",
+                                items=self._cart_line_schema()
                             ),
                             "products_mentioned": genai.protos.Schema(
                                 type=genai.protos.Type.ARRAY,
@@ -271,59 +150,292 @@ class ConversationalCrew:
         
         return genai.protos.Tool(function_declarations=function_declarations)
     
-    def _get_rag_context(self, user_input: str) -> str:
-        """
-        Get relevant products using RAG (with embeddings)
-        This now uses fast vector similarity instead of LLM inference
-        """
+    @staticmethod
+    def _cart_line_schema():
+        return genai.protos.Schema(
+            type=genai.protos.Type.OBJECT,
+            properties={
+                "item_id": genai.protos.Schema(type=genai.protos.Type.STRING, description="Variant item_id, e.g. 1A"),
+                "quantity": genai.protos.Schema(type=genai.protos.Type.NUMBER, description="Units, default 1")
+            },
+            required=["item_id"]
+        )
+    
+    def _needs_retrieval(self, user_input: str) -> bool:
+        """Cheap intent check deciding whether the turn gets product context"""
         recommendation_keywords = [
             'recommend', 'suggest', 'looking for', 'need', 'want', 
             'show me', 'find', 'search', 'buy', 'purchase', 'get'
         ]
         
         user_input_lower = user_input.lower()
-        is_recommendation_query = any(keyword in user_input_lower for keyword in recommendation_keywords)
-        
-        if is_recommendation_query:
-            # Use embedding-based search (FAST!)
-            relevant_products = self.product_rag.search_products(user_input, top_k=5)
-            
-            if relevant_products:
-                return self.product_rag._format_products_for_context(relevant_products)
-        
-        return "No specific products retrieved for this query."
+        return any(keyword in user_input_lower for keyword in recommendation_keywords)
+    
+    def _retrieve_products(self, user_input: str, preference: Optional[np.ndarray] = None) -> List[Dict]:
+        """Search the catalog for the products to put in the prompt, re-ranked for the user if a profile exists"""
+        with metrics.span("retrieval"):
+            products = self.product_rag.search_products(user_input, top_k=5, in_stock_only=INVENTORY_FILTER,
+                                                        preference=preference)
+        metrics.record_products("retrieved", [p["id"] for p in products])
+        return products
+    
+    def _preference_vector(self, context: SessionContext) -> Optional[np.ndarray]:
+        profile = context.preferences
+        return profile.vector if profile.matches(self.product_rag.embedder.name) else None
+    
+    def _record_interest(self, context: SessionContext, product_ids: List[int], weight: float):
+        """Move the user's preference profile towards the given products"""
+        if not product_ids:
+            return
+        vector = self.product_rag.mean_embedding(product_ids)
+        if vector is not None:
+            context.preferences.update(vector, self.product_rag.embedder.name, PREFERENCE_ALPHA, weight)
+    
+    def _rag_context_text(self, products: Optional[List[Dict]]) -> str:
+        """Prompt section for the retrieved products (None means retrieval missed its deadline)"""
+        if products is None:
+            return RETRIEVAL_TIMEOUT_CONTEXT
+        if products:
+            text = self.product_rag._format_products_for_context(products)
+            availability = self.product_rag.inventory.availability_map(
+                item.get("item_id") for p in products for item in p.get("items") or []
+            )
+            if availability:
+                # Units left per variant, so the model never has to guess or ask about stock
+                text += f"\nAvailability (units left by item_id): {availability}"
+            cross_sell = self._cross_sell_context([p.get("id") for p in products[:CROSS_SELL_PRODUCTS]])
+            if cross_sell:
+                text += f"\nCross-sell suggestions:\n{cross_sell}"
+            return text
+        return NO_PRODUCTS_CONTEXT
+    
+    def _related_names(self, product_ids: List[int]) -> str:
+        names = []
+        for pid in product_ids:
+            product = self.product_rag.get_product(pid)
+            if product is not None:
+                names.append(f"{product.get('name')} (ID: {pid})")
+        return ", ".join(names)
+    
+    def _cross_sell_context(self, product_ids: List[int]) -> str:
+        """Bought-together and similar products from the precomputed tables, one line per product"""
+        related = self.product_rag.related
+        if related is None:
+            return ""
+        lines = []
+        for pid in product_ids:
+            if pid is None:
+                continue
+            together = self._related_names(related.bought_together(pid, CROSS_SELL_NEIGHBOURS))
+            similar = self._related_names(related.similar(pid, CROSS_SELL_NEIGHBOURS))
+            parts = ([f"often bought with {together}"] if together else []) + \
+                ([f"similar: {similar}"] if similar else [])
+            if parts:
+                lines.append(f"- ID {pid}: " + "; ".join(parts))
+        return "\n".join(lines)
+    
+    def _get_rag_context(self, user_input: str) -> str:
+        """
+        Get relevant products using RAG (with embeddings)
+        This now uses fast vector similarity instead of LLM inference
+        """
+        if self._needs_retrieval(user_input):
+            return self._rag_context_text(self._retrieve_products(user_input))
+        return NO_PRODUCTS_CONTEXT
+    
+    def _start_retrieval(self, user_input: str, preference: Optional[np.ndarray] = None):
+        """Submit retrieval to the pool as (future, timer); its spans join the turn only if it is awaited in time"""
+        if not self._needs_retrieval(user_input):
+            return None
+        ctx, timer = metrics.branch()
+        return self.retrieval_executor.submit(ctx.run, self._retrieve_products, user_input, preference), timer
+    
+    def _await_retrieval(self, retrieval, deadline: float) -> Optional[List[Dict]]:
+        """Retrieved products; None if retrieval misses the deadline, [] if it fails"""
+        if retrieval is None:
+            return []
+        future, timer = retrieval
+        with metrics.span("retrieval_wait"):
+            try:
+                products = future.result(timeout=max(0.0, deadline - time.monotonic()))
+                metrics.merge_branch(timer)
+                return products
+            except FutureTimeout:
+                # Not started yet: dropped. Already running: left to warm the query-embedding cache
+                # for a follow-up turn, but its spans and products stay off this turn
+                future.cancel()
+                print(f"⚠ Retrieval missed the {RETRIEVAL_DEADLINE_MS:.0f} ms deadline; continuing without products")
+                metrics.record_degraded("retrieval")
+                return None
+            except Exception as e:
+                metrics.merge_branch(timer)
+                print(f"⚠ Retrieval failed; continuing without products: {e}")
+                metrics.record_degraded("retrieval")
+                return []
     
-    def route_message(self, user_input):
+    def route_message(self, user_input, context: Optional[SessionContext] = None,
+                      session_id: Optional[str] = None):
         """Single LLM call that decides agent AND generates response with RAG"""
-        
+        context = context or self.context
+        with metrics.turn() as turn:
+            agent_name, reply, product_ids = self._route_message(user_input, context)
+            turn.agent = agent_name
+        turn_events.log.record(turn, session_id, context.interaction_count, agent_name, product_ids)
+        return agent_name, reply, product_ids
+    
+    def _route_message(self, user_input, context: SessionContext):
         # Update session metadata
-        if self.context["session_metadata"]["start_time"] is None:
-            self.context["session_metadata"]["start_time"] = datetime.datetime.now().isoformat()
-        
-        self.context["session_metadata"]["last_interaction"] = datetime.datetime.now().isoformat()
-        self.context["session_metadata"]["interaction_count"] += 1
+        context.touch()
+        
+        if fast_paths.FAST_PATHS:
+            # Cart, points and product lookups are answered from the context and catalog, without the model
+            with metrics.span("fast_path"):
+                routed = fast_paths.router.route(self.product_rag, context, user_input)
+            if routed is not None:
+                intent, (agent_name, reply, product_ids) = routed
+                metrics.record_fast_path(intent)
+                if intent in VIEW_INTENTS:
+                    self._record_interest(context, product_ids, VIEWED_WEIGHT)
+                context.add_turn(user_input, agent_name, reply, product_ids)
+                return agent_name, reply, product_ids
+        
+        turn_deadline = time.monotonic() + llm_client.TURN_DEADLINE_MS / 1000
+        
+        if PIPELINED_RETRIEVAL:
+            # Retrieval runs while the context half of the prompt is assembled
+            deadline = min(turn_deadline, time.monotonic() + RETRIEVAL_DEADLINE_MS / 1000)
+            retrieval = self._start_retrieval(user_input, self._preference_vector(context))
+            with metrics.span("prompt_build"):
+                context_sections = self._context_sections(context)
+            products = self._await_retrieval(retrieval, deadline)
+        else:
+            # Get RAG context using embedding-based retrieval
+            products = self._retrieve_products(user_input, self._preference_vector(context)) \
+                if self._needs_retrieval(user_input) else []
+            with metrics.span("prompt_build"):
+                context_sections = self._context_sections(context)
+        
+        prompt = self._build_prompt(user_input, self._rag_context_text(products), context_sections)
         
+        try:
+            # Single LLM call with function calling, hedged and bounded by the turn deadline
+            with metrics.span("llm_call"):
+                response = self.llm.generate(
+                    self.genai_model,
+                    turn_deadline,
+                    contents=prompt,
+                    tools=[self.agent_tools],
+                    tool_config={'function_calling_config': 'ANY'}
+                )
+            metrics.record_tokens(getattr(response, "usage_metadata", None))
+            
+            with metrics.span("function_call_parsing"):
+                agent_name, reply, product_ids = self._process_response(response, user_input, context)
+            self._record_interest(context, product_ids, SHOWN_WEIGHT)
+            self._remember_response(context, user_input, agent_name, reply, product_ids)
+            return agent_name, reply, product_ids
+        
+        except (llm_client.DeadlineExceeded, scheduler.QuotaExceeded, PoolUnavailable) as e:
+            print(f"⚠ {e}; answering from the degraded path")
+            metrics.record_degraded("llm_call")
+            metrics.record_route("degraded")
+            return self._fallback_response(context, user_input, products or [])
+                
+        except Exception as e:
+            if scheduler.is_rate_limit_error(e):
+                print("⚠ Rate limited until the turn deadline; answering from the degraded path")
+                metrics.record_degraded("llm_call")
+                metrics.record_route("degraded")
+                return self._fallback_response(context, user_input, products or [])
+            import traceback
+            error_msg = f"I apologize, I encountered an error: {str(e)}"
+            print(f"\nDebug - Full error:\n{traceback.format_exc()}")
+            metrics.record_route("error")
+            return "Error Handler", error_msg, []
+    
+    @staticmethod
+    def _response_key(context: SessionContext, user_input: str) -> Tuple[str, str]:
+        """Cached replies are only ever served back to the session that received them"""
+        return session_owner(context), user_input.strip().lower()
+    
+    def _remember_response(self, context: SessionContext, user_input: str, agent_name: str, reply: str,
+                           product_ids: List[int]):
+        """Keep recent product replies for the degraded path"""
+        if agent_name not in CACHEABLE_AGENTS:
+            return
+        key = self._response_key(context, user_input)
+        with self._response_cache_lock:
+            self._response_cache[key] = (agent_name, reply, list(product_ids))
+            self._response_cache.move_to_end(key)
+            if len(self._response_cache) > RESPONSE_CACHE_SIZE:
+                self._response_cache.popitem(last=False)
+    
+    def _fallback_response(self, context: SessionContext, user_input: str, products: List[Dict]):
+        """Answer without the model: a cached reply to the same message, else a product template"""
+        with self._response_cache_lock:
+            cached = self._response_cache.get(self._response_key(context, user_input))
+        metrics.record_cache("fallback_response", cached is not None)
+        
+        if cached is not None:
+            agent_name, reply, product_ids = cached
+        elif products:
+            agent_name = "Recommendation Agent"
+            lines = []
+            for p in products[:3]:
+                prices = [item.get('price') for item in p.get('items', []) if item.get('price') is not None]
+                price = f" from ${min(prices):.2f}" if prices else ""
+                lines.append(f"- {p.get('name', 'Unknown')}{price}")
+            reply = ("I'm responding a little slower than usual, but here are some products that match:\n"
+                     + "\n".join(lines) + "\nWould you like details on any of these?")
+            product_ids = [p['id'] for p in products[:3] if isinstance(p.get('id'), int)]
+        else:
+            agent_name = "Sales Specialist"
+            reply = ("Sorry, I'm taking longer than usual to respond right now. "
+                     "Could you try again in a moment, or tell me which product you're interested in?")
+            product_ids = []
+        
+        context.add_turn(user_input, agent_name, reply, product_ids)
+        return agent_name, reply, product_ids
+    
+    def _context_sections(self, context: SessionContext) -> Tuple[str, str]:
+        """Session state and recent history, the parts of the prompt that do not need retrieval"""
         # Build context summary
-        recent_history = self.context["conversation_history"][-5:]
+        recent_history = context.conversation_history[-5:]
         context_text = "\n".join(
-            [f"User: {m['user']}\n{m['agent']}: {m['reply']}" for m in recent_history]
+            [f"User: {m.user}\n{m.agent}: {m.reply}" for m in recent_history]
         ) if recent_history else "No previous conversation"
         
-        # Get RAG context using embedding-based retrieval
-        rag_context = self._get_rag_context(user_input)
+        cart_ids = {line.product_id for line in context.cart.lines if line.product_id is not None}
+        goes_with = ""
+        if cart_ids and self.product_rag.related is not None:
+            partners = [pid for cart_id in cart_ids
+                        for pid in self.product_rag.related.bought_together(cart_id, CROSS_SELL_NEIGHBOURS)
+                        if pid not in cart_ids]
+            goes_with = self._related_names(list(dict.fromkeys(partners))[:CROSS_SELL_NEIGHBOURS])
+        
+        cart_line = f"{context.cart.digest()}\n- Often bought with the cart: {goes_with}" if goes_with \
+            else context.cart.digest()
+        
+        current_context = f"""- Cart: {cart_line}
+- Products Mentioned: {context.products_mentioned[-10:] if context.products_mentioned else 'None'}
+- Loyalty Points: {context.loyalty_points}
+- Customer Info: {context.customer_info}
+- Active Issues: {len(context.issues_reported)} reported"""
+        return current_context, context_text
+    
+    def _build_prompt(self, user_input: str, rag_context: str,
+                      context_sections: Optional[Tuple[str, str]] = None) -> str:
+        """Assemble the routing prompt from session context and retrieved products"""
+        current_context, context_text = context_sections or self._context_sections(self.context)
         
         # Create comprehensive prompt
-        prompt = f"""
+        return f"""
 
 You are a multi-agent customer service system for an e-commerce platform.
 Analyze the user's message and call the MOST APPROPRIATE agent function to respond.
 
 CURRENT CONTEXT:
-- Cart Items: {self.context['cart_items']}
-- Products Mentioned: {self.context['products_mentioned'][-10:] if self.context['products_mentioned'] else 'None'}
-- Loyalty Points: {self.context['loyalty_points']}
-- Customer Info: {self.context['customer_info']}
-- Active Issues: {len(self.context['issues_reported'])} reported
+{current_context}
 
 RECENT CONVERSATION:
 {context_text}
@@ -338,7 +450,7 @@ Instructions:
 2. If this is a recommendation/product query, USE THE RELEVANT PRODUCTS listed above
 3. Generate a helpful, personalized response as that agent
 4. Extract product IDs from the database above and include them in the product_ids array
-5. Extract any relevant data (cart items, products, issues, etc.)
+5. Extract any relevant data (products, issues, etc.); change the cart only through cart_add / cart_remove with item_ids from the product variants, and quote totals from the Cart line above rather than computing them
 6. Stay in character for the chosen agent
 7. When recommending products, reference the specific products from the database above
 8. ALWAYS include product IDs in the product_ids field when mentioning products
@@ -349,170 +461,237 @@ Instructions:
 13. Purchase is not completed without payment
 14. If a product is not available, apologize and ask if the user would like to see some suggested items (suggest alternatives in the category ).
 """
-        
-        try:
-            # Single LLM call with function calling
-            response = self.genai_model.generate_content(
-                contents=prompt,
-                tools=[self.agent_tools],
-                tool_config={'function_calling_config': 'ANY'}
-            )
-            
-            # Process response
-            for part in response.parts:
-                if part.function_call:
-                    function_call = part.function_call
-                    agent_function_name = function_call.name
-                    
-                    function_args = {}
-                    for key, value in function_call.args.items():
-                        function_args[key] = value
-                    
-                    agent_name = agent_function_name.replace("_", " ").title()
-                    reply = function_args.get("response", "I'm here to help!")
-                    
-                    # Extract product IDs
-                    product_ids = []
-                    if "product_ids" in function_args:
-                        product_ids = [int(pid) for pid in list(function_args["product_ids"])]
-                    
-                    # Extract and update context data
-                    if "cart_items" in function_args:
-                        new_items = list(function_args["cart_items"])
-                        self.context["cart_items"].extend(new_items)
-                    
-                    if "products_mentioned" in function_args:
-                        new_products = list(function_args["products_mentioned"])
-                        self.context["products_mentioned"].extend(new_products)
-                        if agent_name == "Recommendation Agent":
-                            self.context["recommendations_given"].extend(new_products)
-                    
-                    if "loyalty_points" in function_args:
-                        self.context["loyalty_points"] = int(function_args["loyalty_points"])
-                    
-                    if "issue_reported" in function_args:
-                        self.context["issues_reported"].append({
-                            "issue": function_args["issue_reported"],
-                            "timestamp": datetime.datetime.now().isoformat()
-                        })
-                    
-                    # Store in conversation history
-                    self.context["conversation_history"].append({
-                        "user": user_input,
-                        "agent": agent_name,
-                        "reply": reply,
-                        "product_ids": product_ids,
-                        "timestamp": datetime.datetime.now().isoformat()
-                    })
-                    
-                    return agent_name, reply, product_ids
+    
+    def _process_response(self, response, user_input: str, context: SessionContext):
+        """Apply the chosen agent's function call to the context and return (agent, reply, product_ids)"""
+        for part in response.parts:
+            if part.function_call:
+                function_call = part.function_call
+                agent_function_name = function_call.name
+                
+                function_args = {}
+                for key, value in function_call.args.items():
+                    function_args[key] = value
+                
+                agent_name = agent_function_name.replace("_", " ").title()
+                reply = function_args.get("response", "I'm here to help!")
+                
+                # Extract product IDs
+                product_ids = []
+                if "product_ids" in function_args:
+                    product_ids = [int(pid) for pid in list(function_args["product_ids"])]
+                
+                # Extract and update context data; the cart itself does the math
+                if "cart_add" in function_args or "cart_remove" in function_args:
+                    notes = self._apply_cart_changes(context, function_args)
+                    if notes:
+                        reply = f"{reply}\n\n" + " ".join(notes)
                 
-                elif part.text:
-                    text_response = part.text
-                    self.context["conversation_history"].append({
-                        "user": user_input,
-                        "agent": "General Assistant",
-                        "reply": text_response,
-                        "product_ids": [],
+                if "products_mentioned" in function_args:
+                    new_products = list(function_args["products_mentioned"])
+                    context.products_mentioned.extend(new_products)
+                    if agent_name == "Recommendation Agent":
+                        context.recommendations_given.extend(new_products)
+                
+                if "loyalty_points" in function_args:
+                    context.loyalty_points = int(function_args["loyalty_points"])
+                
+                if "issue_reported" in function_args:
+                    context.issues_reported.append({
+                        "issue": function_args["issue_reported"],
                         "timestamp": datetime.datetime.now().isoformat()
                     })
-                    return "General Assistant", text_response, []
-            
-            raise ValueError("No valid response from model")
                 
+                # Store in conversation history
+                context.add_turn(user_input, agent_name, reply, product_ids)
+                
+                return agent_name, reply, product_ids
+            
+            elif part.text:
+                text_response = part.text
+                context.add_turn(user_input, "General Assistant", text_response)
+                return "General Assistant", text_response, []
+        
+        raise ValueError("No valid response from model")
+    
+    @staticmethod
+    def _cart_quantity(entry: Dict) -> Tuple[bool, Optional[int]]:
+        """(valid, quantity) of a cart_add / cart_remove entry; quantity None when the model left it out"""
+        value = entry.get("quantity")
+        if value is None:
+            return True, None
+        try:
+            quantity = float(value)
+        except (TypeError, ValueError):
+            return False, None
+        if quantity != quantity or quantity < 1 or quantity != int(quantity):
+            return False, None
+        return True, int(quantity)
+    
+    def _reserve(self, item_id: str, quantity: int, owner: str) -> Optional[bool]:
+        """inventory.reserve(), or None when shared stock could not be reached"""
+        try:
+            return self.product_rag.inventory.reserve(item_id, quantity, owner)
         except Exception as e:
-            import traceback
-            error_msg = f"I apologize, I encountered an error: {str(e)}"
-            print(f"\nDebug - Full error:\n{traceback.format_exc()}")
-            return "Error Handler", error_msg, []
+            print(f"⚠ Could not check stock for {item_id}: {e}")
+            metrics.record_degraded("inventory")
+            return None
+    
+    def _release(self, item_id: str, quantity: int, owner: str):
+        """inventory.release(); on failure the hold is left to expire"""
+        try:
+            self.product_rag.inventory.release(item_id, quantity, owner)
+        except Exception as e:
+            print(f"⚠ Could not release stock for {item_id}; its hold will expire: {e}")
+            metrics.record_degraded("inventory")
+    
+    def _apply_cart_changes(self, context: SessionContext, function_args: Dict) -> List[str]:
+        """
+        Apply cart_add / cart_remove, reserving and releasing stock as lines
+        change. item_ids not in the catalog are skipped; returns notes for
+        the user about items that could not be added.
+        """
+        inventory = self.product_rag.inventory
+        notes = []
+        for entry in function_args.get("cart_add") or []:
+            entry = dict(entry)
+            item_id = str(entry.get("item_id", "")).strip()
+            match = self.product_rag.find_variant(item_id) if item_id else None
+            if match is None:
+                print(f"⚠ Ignoring cart_add for unknown item_id {item_id!r}")
+                continue
+            product, variant = match
+            valid, quantity = self._cart_quantity(entry)
+            if not valid:
+                print(f"⚠ Ignoring cart_add for {item_id} with quantity {entry.get('quantity')!r}")
+                continue
+            quantity = quantity or 1
+            reserved = self._reserve(item_id, quantity, session_owner(context))
+            label = f"{product.name} ({variant.variant})" if variant.variant else product.name
+            if reserved is None:
+                notes.append(f"Sorry, I couldn't check stock for {label} [{item_id}] right now, "
+                             f"so it was not added to your cart. Please try again in a moment.")
+                continue
+            if not reserved:
+                available = inventory.available(item_id) or 0
+                notes.append(f"Sorry, only {available} of {label} [{item_id}] left, so it was not added to your cart."
+                             if available else f"Sorry, {label} [{item_id}] is out of stock and was not added to your cart.")
+                continue
+            context.cart.add(item_id, quantity, product, variant)
+            self._record_interest(context, [product.id], CARTED_WEIGHT)
+            metrics.record_products("carted", [product.id])
+        for entry in function_args.get("cart_remove") or []:
+            entry = dict(entry)
+            item_id = str(entry.get("item_id", "")).strip()
+            line = context.cart.get(item_id)
+            if line is None:
+                continue
+            valid, quantity = self._cart_quantity(entry)
+            if not valid:
+                print(f"⚠ Ignoring cart_remove for {item_id} with quantity {entry.get('quantity')!r}")
+                continue
+            held = line.quantity
+            context.cart.remove(item_id, quantity)
+            remaining = context.cart.get(item_id)
+            self._release(item_id, held - (remaining.quantity if remaining else 0), session_owner(context))
+        return notes
+    
+    def hold_cart(self, context: SessionContext) -> List[str]:
+        """
+        Reserve stock for a cart restored from a saved session (holds end
+        when a session leaves memory). Lines that can no longer be held are
+        removed; returns a note for each. Lines whose stock could not be
+        checked stay in the cart unheld.
+        """
+        owner = session_owner(context)
+        held = self.product_rag.inventory.held(owner)
+        notes = []
+        for line in context.cart.lines:
+            missing = line.quantity - held.get(line.item_id, 0)
+            reserved = self._reserve(line.item_id, missing, owner) if missing > 0 else True
+            if reserved is None:
+                notes.append(f"I couldn't check stock for {line.name or line.item_id} [{line.item_id}] right now; "
+                             f"it stays in your cart but is not reserved.")
+            elif not reserved:
+                context.cart.remove(line.item_id)
+                self._release(line.item_id, line.quantity, owner)
+                notes.append(f"{line.name or line.item_id} [{line.item_id}] is no longer available "
+                             f"and was removed from your cart.")
+        return notes
+    
+    def release_cart(self, context: SessionContext) -> int:
+        """Give back the stock a session's cart holds, once the session leaves memory"""
+        return self.product_rag.inventory.release_owner(session_owner(context))
     
-    def get_context_summary(self):
+    def get_context_summary(self, context: Optional[SessionContext] = None):
         """Get a summary of all stored context data"""
+        context = context or self.context
         return {
-            "total_interactions": self.context["session_metadata"]["interaction_count"],
-            "session_start": self.context["session_metadata"]["start_time"],
-            "cart_items": self.context["cart_items"],
-            "products_discussed": len(self.context["products_mentioned"]),
-            "unique_products": len(set(self.context["products_mentioned"])),
-            "issues_count": len(self.context["issues_reported"]),
-            "loyalty_points": self.context["loyalty_points"],
-            "recommendations_made": len(self.context["recommendations_given"]),
+            "total_interactions": context.interaction_count,
+            "session_start": context.started_at,
+            "cart_items": context.cart.to_list(),
+            "cart_subtotal": context.cart.subtotal,
+            "products_discussed": len(context.products_mentioned),
+            "unique_products": len(set(context.products_mentioned)),
+            "issues_count": len(context.issues_reported),
+            "loyalty_points": context.loyalty_points,
+            "recommendations_made": len(context.recommendations_given),
             "total_products_in_db": len(self.product_rag.products),
             "embeddings_ready": self.product_rag.embeddings_generated
         }
 
 
 class MeetingPrepAgents:
-    Sales_Agent = Agent(
+    Sales_Agent = AgentProfile(
         role="Sales Specialist",
         goal="Drive sales and meet performance targets by upselling and cross selling products.",
-        backstory="Experienced in sales strategies and customer engagement. Subtly influences customer decisions to maximize revenue.",
-        llm=llm,
-        verbose=False
+        backstory="Experienced in sales strategies and customer engagement. Subtly influences customer decisions to maximize revenue."
     )
-    Recommendation_Agent = Agent(
+    Recommendation_Agent = AgentProfile(
         role="Recommendation Agent",
         goal="Analyze items available in the store and make personalized recommendations based on product database.",
         backstory="Expert in product analytics with access to comprehensive product database. Uses data-driven insights to match customers with perfect products. " \
-        "Start showing relevant products from the database the moment a user expresses interest. ALWAYS include product IDs.",
-        llm=llm,
-        verbose=False
+        "Start showing relevant products from the database the moment a user expresses interest. ALWAYS include product IDs."
     )
-    Inventory_Agent = Agent(
+    Inventory_Agent = AgentProfile(
         role="Inventory Specialist",
         goal="Manage inventory levels and stock availability.",
-        backstory="Detail-oriented and experienced in inventory management.",
-        llm=llm,
-        verbose=False
+        backstory="Detail-oriented and experienced in inventory management."
     )
-    Cart_Agent = Agent(
+    Cart_Agent = AgentProfile(
         role="Shopping Cart Specialist",
         goal="Manage shopping cart operations and user interactions.",
-        backstory="Experienced in e-commerce and user experience. Check inventory before adding items to cart.",
-        llm=llm,
-        verbose=False
+        backstory="Experienced in e-commerce and user experience. Check inventory before adding items to cart."
     )
-    Fulfillment_Agent = Agent(
+    Fulfillment_Agent = AgentProfile(
         role="Logistics Coordinator",
         goal="Coordinate logistics and ensure timely delivery of items.",
-        backstory="Detail-oriented and efficient in managing supply chains.",
-        llm=llm,
-        verbose=False
+        backstory="Detail-oriented and efficient in managing supply chains."
     )
-    Payment_Agent = Agent(
+    Payment_Agent = AgentProfile(
         role="Financial Transactions Expert",
         goal="Handle payment processing and financial records.",
-        backstory="Skilled in secure and efficient payment systems.",  
-        llm=llm,
-        verbose=False
+        backstory="Skilled in secure and efficient payment systems."
     )
-    Post_Purchase_Agent = Agent(
+    Post_Purchase_Agent = AgentProfile(
         role="Customer Relations Specialist",
         goal="Manage post-purchase follow-ups and customer satisfaction.",
-        backstory="Focused on building strong customer relationships.",
-        llm=llm,
-        verbose=False
+        backstory="Focused on building strong customer relationships."
     )
-    Loyalty_and_Offers_Agent = Agent(
+    Loyalty_and_Offers_Agent = AgentProfile(
         role="Customer Loyalty Specialist",
         goal="Manage customer loyalty programs and special offers.",
-        backstory="Expert in enhancing customer retention through rewards.",
-        llm=llm,
-        verbose=False
+        backstory="Expert in enhancing customer retention through rewards."
     )
-    CRM_Agent = Agent(
+    CRM_Agent = AgentProfile(
         role="Customer Relationship Manager",
         goal="Maintain and update customer relationship management systems.",
-        backstory="Proficient in CRM tools and customer data analysis.",
-        llm=llm,
-        verbose=False
+        backstory="Proficient in CRM tools and customer data analysis."
     )
-    Error_Handling_Agent = Agent(
+    Error_Handling_Agent = AgentProfile(
         role="Technical Support Specialist",
         goal="Identify and resolve technical issues in the shopping process.",
-        backstory="Experienced in troubleshooting and customer support.",
-        llm=llm,
-        verbose=False
+        backstory="Experienced in troubleshooting and customer support."
     )
 
 
@@ -534,5 +713,5 @@ crew = ConversationalCrew(
 )
 
 print("\n### CrewAI with Embedding-Based RAG ###")
-print(f"✓ System ready with {len(crew.product_rag.products)} products")
+print(f"✓ Loaded {len(crew.product_rag.products)} products (embedding index warms up in the background)")
 print("Type 'exit' to quit, 'summary' to see context summary.\n")
\ No newline at end of file
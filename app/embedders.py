@@ -0,0 +1,188 @@
+"""Embedding backends for ProductRAGWithEmbeddings: Gemini API, in-process ONNX model, hashed n-grams"""
+import os
+import zlib
+import threading
+from concurrent.futures import Future
+from typing import List, Optional
+
+import numpy as np
+import google.generativeai as genai
+
+import scheduler
+from lexical_index import tokenize
+
+# "gemini" (remote API), "onnx" (local sentence-embedding model) or "hashing" (no model at all)
+EMBEDDER = os.getenv("EMBEDDER", "gemini")
+EMBEDDING_MODEL = "models/text-embedding-004"
+EMBEDDING_BATCH_SIZE = int(os.getenv("EMBEDDING_BATCH_SIZE", "100"))
+# Directory holding model.onnx and tokenizer.json (e.g. an all-MiniLM-L6-v2 export)
+ONNX_MODEL_DIR = os.getenv("ONNX_MODEL_DIR", "models/all-MiniLM-L6-v2")
+ONNX_MAX_TOKENS = int(os.getenv("ONNX_MAX_TOKENS", "256"))
+ONNX_THREADS = int(os.getenv("ONNX_THREADS", "0"))  # 0 = onnxruntime default
+HASHING_DIM = int(os.getenv("HASHING_DIM", "1024"))
+QUERY_BATCH_SIZE = int(os.getenv("QUERY_BATCH_SIZE", "32"))
+
+
+class GeminiEmbedder:
+    """text-embedding-004 over the network; one request per batch"""
+    batched = True
+
+    def __init__(self, model: str = EMBEDDING_MODEL):
+        self.model = model
+        self.name = model
+
+    def _embed(self, texts: List[str], task_type: str) -> np.ndarray:
+        # One request per batch against the embedding quota; reindexing runs at background priority
+        result = scheduler.embedding_scheduler.run(
+            lambda: genai.embed_content(model=self.model, content=texts, task_type=task_type)
+        )
+        return np.asarray(result['embedding'], dtype=np.float32)
+
+    def embed_documents(self, texts: List[str]) -> np.ndarray:
+        return self._embed(texts, "retrieval_document")
+
+    def embed_queries(self, texts: List[str]) -> np.ndarray:
+        return self._embed(texts, "retrieval_query")
+
+
+class HashingEmbedder:
+    """
+    Signed feature hashing of words, word bigrams and character trigrams.
+    No model or network; matches morphology ("sneaker" ~ "sneakers") but not synonyms.
+    """
+    batched = False
+    CHAR_NGRAM = 3
+    CHAR_WEIGHT = 0.5
+
+    def __init__(self, dim: int = HASHING_DIM):
+        self.dim = dim
+        self.name = f"hashing-{dim}"
+
+    def _features(self, text: str):
+        words = tokenize(text)
+        for word in words:
+            yield word, 1.0
+            padded = f"<{word}>"
+            for i in range(len(padded) - self.CHAR_NGRAM + 1):
+                yield "#" + padded[i:i + self.CHAR_NGRAM], self.CHAR_WEIGHT
+        for first, second in zip(words, words[1:]):
+            yield f"{first} {second}", 1.0
+
+    def embed_documents(self, texts: List[str]) -> np.ndarray:
+        matrix = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for feature, weight in self._features(text):
+                h = zlib.crc32(feature.encode())
+                # The top bit picks the sign so colliding features tend to cancel rather than add up
+                matrix[row, h % self.dim] += weight if h & 0x80000000 else -weight
+        return matrix
+
+    embed_queries = embed_documents
+
+
+class OnnxEmbedder:
+    """Sentence-embedding model run in-process with onnxruntime; mean-pooled token states"""
+    batched = True
+
+    def __init__(self, model_dir: str = ONNX_MODEL_DIR, max_tokens: int = ONNX_MAX_TOKENS,
+                 threads: int = ONNX_THREADS):
+        import onnxruntime as ort
+        from tokenizers import Tokenizer
+
+        model_path = os.path.join(model_dir, "model.onnx")
+        self.tokenizer = Tokenizer.from_file(os.path.join(model_dir, "tokenizer.json"))
+        self.tokenizer.enable_truncation(max_length=max_tokens)
+        self.tokenizer.enable_padding()
+        options = ort.SessionOptions()
+        if threads:
+            options.intra_op_num_threads = threads
+        self.session = ort.InferenceSession(model_path, options, providers=["CPUExecutionProvider"])
+        self.input_names = {i.name for i in self.session.get_inputs()}
+        # Size in the name so a swapped model file invalidates cached embeddings
+        self.name = f"onnx:{os.path.basename(os.path.normpath(model_dir))}:{os.path.getsize(model_path)}"
+
+    def embed_documents(self, texts: List[str]) -> np.ndarray:
+        encodings = self.tokenizer.encode_batch(texts)
+        input_ids = np.array([e.ids for e in encodings], dtype=np.int64)
+        mask = np.array([e.attention_mask for e in encodings], dtype=np.int64)
+        feeds = {"input_ids": input_ids, "attention_mask": mask}
+        if "token_type_ids" in self.input_names:
+            feeds["token_type_ids"] = np.zeros_like(input_ids)
+        output = self.session.run(None, feeds)[0]
+        if output.ndim == 2:
+            return output.astype(np.float32)  # model already pools
+        weights = mask[:, :, None].astype(np.float32)
+        return ((output * weights).sum(axis=1) / np.maximum(weights.sum(axis=1), 1e-9)).astype(np.float32)
+
+    embed_queries = embed_documents
+
+
+class QueryBatcher:
+    """
+    Coalesces concurrent embed_query calls. The first caller runs a batch
+    immediately; callers arriving while it is in flight queue up and go
+    out together in the next batch, so a lone query never waits.
+    """
+
+    def __init__(self, embedder, max_batch: int = QUERY_BATCH_SIZE):
+        self.embedder = embedder
+        self.max_batch = max_batch
+        self._pending: List = []
+        self._running = False
+        self._cond = threading.Condition()
+
+    def embed_query(self, text: str) -> np.ndarray:
+        future: Future = Future()
+        with self._cond:
+            self._pending.append((text, future))
+        while not future.done():
+            with self._cond:
+                while self._running and not future.done():
+                    self._cond.wait()
+                if future.done():
+                    break
+                self._running = True
+                batch, self._pending = self._pending[:self.max_batch], self._pending[self.max_batch:]
+            try:
+                vectors = self.embedder.embed_queries([t for t, _ in batch])
+                for (_, f), vector in zip(batch, vectors):
+                    f.set_result(vector)
+            except Exception as e:
+                for _, f in batch:
+                    f.set_exception(e)
+            finally:
+                with self._cond:
+                    self._running = False
+                    self._cond.notify_all()
+        return future.result()
+
+
+class Embedder:
+    """Backend plus query batching; the interface ProductRAGWithEmbeddings uses"""
+
+    def __init__(self, backend):
+        self.backend = backend
+        self.name = backend.name
+        self._batcher = QueryBatcher(backend) if backend.batched else None
+
+    def embed_documents(self, texts: List[str]) -> np.ndarray:
+        return self.backend.embed_documents(texts)
+
+    def embed_query(self, text: str) -> np.ndarray:
+        if self._batcher is not None:
+            return self._batcher.embed_query(text)
+        return self.backend.embed_queries([text])[0]
+
+
+def create_embedder(kind: Optional[str] = None) -> Embedder:
+    """Embedder for the configured backend; an unusable ONNX setup falls back to hashing"""
+    kind = kind or EMBEDDER
+    if kind == "onnx":
+        try:
+            return Embedder(OnnxEmbedder())
+        except Exception as e:  # missing packages, missing model files, or a bad export
+            print(f"⚠ ONNX embedder unavailable ({e}); using hashed n-gram embeddings")
+            return Embedder(HashingEmbedder())
+    if kind == "hashing":
+        return Embedder(HashingEmbedder())
+    return Embedder(GeminiEmbedder())
@@ -0,0 +1,162 @@
+"""
+Deterministic answers for structured intents (cart, loyalty points,
+product lookups) that need only the session context and the catalog.
+Anything the rules do not match exactly goes to the LLM.
+"""
+import os
+import re
+from typing import Callable, List, Optional, Tuple
+
+from models import SessionContext
+
+# Set to false to send every message to the LLM
+FAST_PATHS = os.getenv("FAST_PATHS", "true").lower() in ("1", "true", "yes")
+
+CART_AGENT = "Shopping Cart Specialist"
+LOYALTY_AGENT = "Customer Loyalty Specialist"
+PRODUCT_AGENT = "Recommendation Agent"
+INVENTORY_AGENT = "Inventory Specialist"
+# Products listed by the related-products answer
+RELATED_SHOWN = 4
+
+# Politeness and punctuation that do not change the intent
+_FILLER = re.compile(r"^(?:(?:hi|hey|hello|ok|okay|please|can you|could you)[\s,]+)+|[\s?.!]+$")
+
+FastPathResult = Tuple[str, str, List[int]]
+
+
+def _normalize(text: str) -> str:
+    return _FILLER.sub("", " ".join(text.lower().split()))
+
+
+def _price(value: Optional[float]) -> str:
+    return f"{value:.2f}" if value is not None else "price on request"
+
+
+def cart_contents(rag, context: SessionContext, match) -> Optional[FastPathResult]:
+    cart = context.cart
+    if not len(cart):
+        return CART_AGENT, "Your cart is empty. Would you like some recommendations?", []
+    lines = []
+    for line in cart.lines:
+        label = f"{line.name} ({line.variant})" if line.variant else line.name
+        lines.append(f"- {line.quantity} x {label} [{line.item_id}]: {_price(line.price)}")
+    reply = "Here's what's in your cart:\n" + "\n".join(lines) + \
+        f"\n\nSubtotal: {cart.subtotal:.2f} for {cart.item_count} item(s). Ready to check out?"
+    product_ids = list(dict.fromkeys(line.product_id for line in cart.lines if line.product_id is not None))
+    return CART_AGENT, reply, product_ids
+
+
+def cart_total(rag, context: SessionContext, match) -> Optional[FastPathResult]:
+    cart = context.cart
+    if not len(cart):
+        return CART_AGENT, "Your cart is empty, so your total is 0.00.", []
+    reply = f"Your cart subtotal is {cart.subtotal:.2f} for {cart.item_count} item(s)."
+    if any(line.price is None for line in cart.lines):
+        reply += " Some items don't have a price yet and aren't included."
+    return CART_AGENT, reply, []
+
+
+def loyalty_points(rag, context: SessionContext, match) -> Optional[FastPathResult]:
+    return LOYALTY_AGENT, f"You have {context.loyalty_points} loyalty points.", []
+
+
+def show_product(rag, context: SessionContext, match) -> Optional[FastPathResult]:
+    product = rag.get_product(int(match.group("id")))
+    if product is None:
+        return None  # let the model apologise and suggest alternatives
+    variants = "\n".join(
+        f"- {item.get('variant') or item.get('item_id')} [{item.get('item_id')}]: {_price(item.get('price'))}"
+        for item in product.get("items") or []
+    )
+    reply = f"**{product.get('name')}** ({product.get('category')})\n{product.get('description', '')}"
+    if variants:
+        reply += f"\n\nAvailable as:\n{variants}"
+    return PRODUCT_AGENT, reply, [product["id"]]
+
+
+def show_item(rag, context: SessionContext, match) -> Optional[FastPathResult]:
+    found = rag.find_variant(match.group("item").upper())
+    if found is None:
+        return None
+    product, variant = found
+    reply = (f"**{product.name}** - {variant.variant} [{variant.item_id}]: {_price(variant.price)}\n"
+             f"{variant.description or product.description}")
+    return PRODUCT_AGENT, reply, [product.id]
+
+
+def stock_check(rag, context: SessionContext, match) -> Optional[FastPathResult]:
+    item_id = match.group("item").upper()
+    found = rag.find_variant(item_id)
+    available = rag.inventory.available(item_id)
+    if found is None or available is None:
+        return None  # unknown or untracked item
+    product, variant = found
+    label = f"{product.name} ({variant.variant})" if variant.variant else product.name
+    if available:
+        reply = f"Yes, {label} [{item_id}] is in stock: {available} left. Shall I add it to your cart?"
+    else:
+        reply = f"Sorry, {label} [{item_id}] is out of stock right now. Would you like to see similar items?"
+    return INVENTORY_AGENT, reply, [product.id]
+
+
+def related_products(rag, context: SessionContext, match) -> Optional[FastPathResult]:
+    product_id = int(match.group("id"))
+    product = rag.get_product(product_id)
+    if product is None or rag.related is None:
+        return None
+    together = rag.related.bought_together(product_id, RELATED_SHOWN)
+    similar = [pid for pid in rag.related.similar(product_id, RELATED_SHOWN * 2) if pid not in together]
+    picks = [(pid, rag.get_product(pid)) for pid in (together + similar)[:RELATED_SHOWN]]
+    picks = [(pid, p) for pid, p in picks if p is not None]
+    if not picks:
+        return None
+    lines = "\n".join(f"- **{p.get('name')}** ({p.get('category')})"
+                      + (" - often bought together" if pid in together else "")
+                      for pid, p in picks)
+    reply = f"Great pairings for **{product.get('name')}**:\n{lines}\n\nWould you like details on any of these?"
+    return PRODUCT_AGENT, reply, [pid for pid, _ in picks]
+
+
+class FastPathRouter:
+    """Ordered (intent, pattern, handler) rules; patterns must match the whole normalized message"""
+
+    def __init__(self):
+        self.rules: List[Tuple[str, re.Pattern, Callable]] = []
+
+    def add(self, intent: str, pattern: str, handler: Callable):
+        self.rules.append((intent, re.compile(pattern), handler))
+
+    def route(self, rag, context: SessionContext, user_input: str) -> Optional[Tuple[str, FastPathResult]]:
+        """(intent, (agent, reply, product_ids)) for a message a rule answers, else None"""
+        text = _normalize(user_input)
+        if len(text) > 80:
+            return None
+        for intent, pattern, handler in self.rules:
+            match = pattern.fullmatch(text)
+            if match is None:
+                continue
+            result = handler(rag, context, match)
+            if result is not None:
+                return intent, result
+        return None
+
+
+router = FastPathRouter()
+router.add("cart_total", r"(?:what(?:'s| is) )?(?:the |my )?(?:cart )?(?:sub)?total(?: of my cart| in my cart)?",
+           cart_total)
+router.add("cart_contents", r"(?:what(?:'s| is) in (?:my|the) (?:cart|bag|basket)|(?:show|view|see|check)(?: me)?"
+                            r" (?:my|the) (?:cart|bag|basket)|(?:my )?cart)",
+           cart_contents)
+router.add("loyalty_points", r"(?:how many (?:loyalty |reward )?points (?:do i have|have i got)|"
+                             r"(?:what(?:'s| is| are) )?my (?:loyalty |reward )?points(?: balance)?|"
+                             r"(?:loyalty |reward )?points balance)",
+           loyalty_points)
+router.add("show_product", r"(?:show|view|open|see)(?: me)? (?:the )?product (?:id )?#?(?P<id>\d+)", show_product)
+router.add("show_item", r"(?:show|view|open|see)(?: me)? (?:the )?item #?(?P<item>\d+[a-z])", show_item)
+router.add("stock_check", r"(?:is |are |do you have |how many (?:of )?|stock (?:of |for ))(?:item )?#?(?P<item>\d+[a-z])"
+                          r"(?: in stock| left| available)",
+           stock_check)
+router.add("related_products", r"(?:(?:show (?:me )?)?(?:(?:products|items|something) )?(?:similar to|like|that goes? with)|"
+                               r"what goes (?:well )?with) product #?(?P<id>\d+)",
+           related_products)
@@ -0,0 +1,259 @@
+"""
+Stock levels by item_id. Reads hit in-memory counters; reservations are
+per-owner holds. With Mongo attached (opt-in, INVENTORY_FLUSH_INTERVAL > 0),
+reserve() is a guarded $inc on the shared item document, so every worker
+sells from one count, and each hold is also a document that expires unless
+its session is still live. Items with no stock record are untracked and
+always count as available.
+"""
+import os
+import threading
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Iterable, List, Optional
+
+from pymongo import ReturnDocument
+
+# Drop products with no variant in stock from retrieval results
+INVENTORY_FILTER = os.getenv("INVENTORY_FILTER", "true").lower() in ("1", "true", "yes")
+# Seconds between refreshes of the local counters from Mongo (and hold renewal / expiry); 0 (default) keeps
+# stock in this process's memory and never touches Mongo
+INVENTORY_FLUSH_INTERVAL = float(os.getenv("INVENTORY_FLUSH_INTERVAL", "0"))
+# Seconds a hold survives without being renewed by its live session (covers crashed workers)
+INVENTORY_HOLD_TTL = float(os.getenv("INVENTORY_HOLD_TTL", "900"))
+
+
+def _floor_reserved(quantity: int) -> List[Dict]:
+    """Update pipeline taking quantity off reserved without going below zero"""
+    return [{"$set": {"reserved": {"$max": [0, {"$subtract": [{"$ifNull": ["$reserved", 0]}, quantity]}]}}}]
+
+
+class InventoryService:
+    """
+    on_hand and reserved units per item_id, and the units each owner (a
+    session) holds; available = on_hand - reserved. Without a collection
+    the counters behind one lock are authoritative. With one, Mongo is:
+    reserve/release/set_stock write through, and the local counters are a
+    read cache refreshed by refresh().
+    """
+
+    def __init__(self):
+        self._on_hand: Dict[str, int] = {}
+        self._reserved: Dict[str, int] = {}
+        self._holds: Dict[str, Dict[str, int]] = {}  # owner -> item_id -> units
+        # Local writes are numbered so a refresh that started earlier does not undo them
+        self._version = 0
+        self._written: Dict[str, int] = {}
+        self._lock = threading.Lock()
+        self._items = None
+        self._hold_docs = None
+
+    def attach(self, items, holds):
+        """Use pymongo collections ({_id: item_id, on_hand, reserved} and hold documents) as the source of truth"""
+        self._items, self._hold_docs = items, holds
+
+    @property
+    def tracking(self) -> bool:
+        return bool(self._on_hand)
+
+    def available(self, item_id: str) -> Optional[int]:
+        """Units that can still be reserved, or None for an untracked item"""
+        on_hand = self._on_hand.get(item_id)
+        if on_hand is None:
+            return None
+        return max(0, on_hand - self._reserved.get(item_id, 0))
+
+    def in_stock(self, item_id: str, quantity: int = 1) -> bool:
+        available = self.available(item_id)
+        return available is None or available >= quantity
+
+    def _cache(self, item_id: str, on_hand: Optional[int], reserved: int):
+        """Record a value just written (or read back); the lock must be held"""
+        self._version += 1
+        self._written[item_id] = self._version
+        if on_hand is None:
+            self._on_hand.pop(item_id, None)
+            self._reserved.pop(item_id, None)
+        else:
+            self._on_hand[item_id] = on_hand
+            self._reserved[item_id] = reserved
+
+    def _hold(self, owner: str, item_id: str, quantity: int):
+        """Adjust owner's hold on item_id by quantity; the lock must be held"""
+        held = self._holds.setdefault(owner, {})
+        held[item_id] = held.get(item_id, 0) + quantity
+        if held[item_id] <= 0:
+            del held[item_id]
+        if not held:
+            del self._holds[owner]
+
+    def set_stock(self, item_id: str, on_hand: int):
+        on_hand = max(0, int(on_hand))
+        if self._items is not None:
+            doc = self._items.find_one_and_update(
+                {"_id": item_id}, {"$set": {"on_hand": on_hand}, "$setOnInsert": {"reserved": 0}},
+                upsert=True, return_document=ReturnDocument.AFTER
+            )
+            with self._lock:
+                self._cache(item_id, doc["on_hand"], doc.get("reserved", 0))
+            return
+        with self._lock:
+            self._cache(item_id, on_hand, self._reserved.get(item_id, 0))
+
+    def reserve(self, item_id: str, quantity: int, owner: str) -> bool:
+        """
+        Hold quantity units for owner's cart; False (and nothing held) if not
+        enough are available. Items untracked in the local counters are
+        unlimited and never reach Mongo. Mongo errors propagate.
+        """
+        if item_id not in self._on_hand:
+            return True
+        if self._items is not None:
+            return self._reserve_shared(item_id, quantity, owner)
+        with self._lock:
+            on_hand = self._on_hand.get(item_id)
+            if on_hand is None:
+                return True
+            reserved = self._reserved.get(item_id, 0)
+            if on_hand - reserved < quantity:
+                return False
+            self._cache(item_id, on_hand, reserved + quantity)
+            self._hold(owner, item_id, quantity)
+            return True
+
+    def _reserve_shared(self, item_id: str, quantity: int, owner: str) -> bool:
+        doc = self._items.find_one_and_update(
+            {"_id": item_id,
+             "$expr": {"$gte": [{"$subtract": ["$on_hand", {"$ifNull": ["$reserved", 0]}]}, quantity]}},
+            {"$inc": {"reserved": quantity}},
+            return_document=ReturnDocument.AFTER
+        )
+        if doc is None:
+            current = self._items.find_one({"_id": item_id})
+            with self._lock:
+                if current is None:
+                    self._cache(item_id, None, 0)
+                else:
+                    self._cache(item_id, current["on_hand"], current.get("reserved", 0))
+            return current is None
+        # Counted before the hold document exists: a crash in between over-reserves until an
+        # admin resets the level, but can never oversell
+        self._hold_docs.update_one(
+            {"_id": {"owner": owner, "item_id": item_id}},
+            {"$inc": {"quantity": quantity},
+             "$set": {"owner": owner, "item_id": item_id, "expires_at": self._expiry()}},
+            upsert=True
+        )
+        with self._lock:
+            self._cache(item_id, doc["on_hand"], doc.get("reserved", 0))
+            self._hold(owner, item_id, quantity)
+        return True
+
+    def release(self, item_id: str, quantity: int, owner: str):
+        """Give back units owner's cart no longer holds (never more than it holds)"""
+        with self._lock:
+            quantity = min(quantity, self._holds.get(owner, {}).get(item_id, 0))
+            if quantity <= 0:
+                return
+            self._hold(owner, item_id, -quantity)
+            if self._items is None:
+                if item_id in self._on_hand:
+                    self._cache(item_id, self._on_hand[item_id], max(0, self._reserved.get(item_id, 0) - quantity))
+                return
+        hold_id = {"owner": owner, "item_id": item_id}
+        self._hold_docs.update_one({"_id": hold_id}, {"$inc": {"quantity": -quantity}})
+        self._hold_docs.delete_one({"_id": hold_id, "quantity": {"$lte": 0}})
+        self._give_back(item_id, quantity)
+
+    def _give_back(self, item_id: str, quantity: int):
+        doc = self._items.find_one_and_update({"_id": item_id}, _floor_reserved(quantity),
+                                              return_document=ReturnDocument.AFTER)
+        if doc is not None:
+            with self._lock:
+                self._cache(item_id, doc["on_hand"], doc.get("reserved", 0))
+
+    def release_owner(self, owner: str) -> int:
+        """Release everything owner holds (its session left memory); returns the units given back"""
+        with self._lock:
+            held = dict(self._holds.get(owner, {}))
+        for item_id, quantity in held.items():
+            self.release(item_id, quantity, owner)
+        return sum(held.values())
+
+    def held(self, owner: str) -> Dict[str, int]:
+        with self._lock:
+            return dict(self._holds.get(owner, {}))
+
+    def availability_map(self, item_ids: Iterable[str]) -> str:
+        """Compact "1A: 12, 1B: 0" for the tracked items among item_ids; empty if none are tracked"""
+        entries = []
+        for item_id in dict.fromkeys(item_ids):
+            available = self.available(item_id)
+            if available is not None:
+                entries.append(f"{item_id}: {available}")
+        return ", ".join(entries)
+
+    def levels(self) -> Dict[str, Dict[str, int]]:
+        with self._lock:
+            return {item_id: {"on_hand": on_hand, "reserved": self._reserved.get(item_id, 0)}
+                    for item_id, on_hand in self._on_hand.items()}
+
+    @staticmethod
+    def _expiry() -> datetime:
+        return datetime.now(timezone.utc) + timedelta(seconds=INVENTORY_HOLD_TTL)
+
+    def refresh(self) -> int:
+        """Reload the counters from Mongo, keeping items this process wrote while the read was running"""
+        with self._lock:
+            started = self._version
+        on_hand, reserved = {}, {}
+        for doc in self._items.find({}):
+            on_hand[doc["_id"]] = int(doc.get("on_hand", 0))
+            reserved[doc["_id"]] = int(doc.get("reserved", 0))
+        with self._lock:
+            for item_id, version in self._written.items():
+                if version > started:
+                    if item_id in self._on_hand:
+                        on_hand[item_id] = self._on_hand[item_id]
+                        reserved[item_id] = self._reserved.get(item_id, 0)
+                    else:
+                        on_hand.pop(item_id, None)
+                        reserved.pop(item_id, None)
+            self._on_hand, self._reserved = on_hand, reserved
+            self._written = {}
+        return len(on_hand)
+
+    def renew(self, owners: Iterable[str]):
+        """
+        Push back the expiry of holds whose sessions are still live, and
+        forget local holds another worker already expired
+        """
+        owners = [owner for owner in owners if owner in self._holds]
+        if not owners:
+            return
+        self._hold_docs.update_many({"owner": {"$in": owners}}, {"$set": {"expires_at": self._expiry()}})
+        stored = {(doc["owner"], doc["item_id"]): doc.get("quantity", 0)
+                  for doc in self._hold_docs.find({"owner": {"$in": owners}})}
+        with self._lock:
+            for owner in owners:
+                for item_id, quantity in list(self._holds.get(owner, {}).items()):
+                    self._hold(owner, item_id, min(quantity, stored.get((owner, item_id), 0)) - quantity)
+
+    def expire_holds(self) -> int:
+        """Release holds nobody renewed (their worker crashed or restarted); returns the units given back"""
+        released = 0
+        now = datetime.now(timezone.utc)
+        for hold in self._hold_docs.find({"expires_at": {"$lt": now}}):
+            # Deleted first, so two workers sweeping at once give each hold back only once
+            if self._hold_docs.find_one_and_delete({"_id": hold["_id"], "expires_at": {"$lt": now}}) is None:
+                continue
+            if hold.get("quantity", 0) > 0:
+                self._give_back(hold["item_id"], hold["quantity"])
+                released += hold["quantity"]
+            with self._lock:
+                owner_holds = self._holds.get(hold["owner"], {})
+                if hold["item_id"] in owner_holds:
+                    self._hold(hold["owner"], hold["item_id"], -owner_holds[hold["item_id"]])
+        return released
+
+
+stock = InventoryService()
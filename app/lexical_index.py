@@ -0,0 +1,133 @@
+"""BM25 lexical index over the columnar catalog, and reciprocal rank fusion"""
+import re
+from typing import Dict, List, Sequence, Tuple
+
+import numpy as np
+
+from catalog_store import ProductStore
+
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+")
+# Connectives that appear in most descriptions and only add noise to short catalog queries
+STOP_WORDS = frozenset((
+    "a", "an", "and", "are", "as", "at", "be", "both", "by", "for", "from", "i", "in", "is",
+    "it", "me", "my", "of", "on", "or", "some", "something", "that", "the", "to", "with", "you"
+))
+
+# Matches in a product's name or a variant's item_id count for more than description words
+FIELD_WEIGHTS = {
+    "name": 3.0,
+    "category": 2.0,
+    "description": 1.0,
+    "item_id": 5.0,
+    "variant": 2.0,
+    "item_description": 0.5,
+}
+
+BM25_K1 = 1.2
+BM25_B = 0.75
+RRF_K = 60
+
+
+def tokenize(text: str) -> List[str]:
+    if not text:
+        return []
+    return [t for t in TOKEN_PATTERN.findall(text.lower()) if t not in STOP_WORDS]
+
+
+class LexicalIndex:
+    """
+    Field-weighted BM25 with postings in CSR arrays: term -> slice of
+    (row, weighted tf). Scoring a query touches only the postings of its terms.
+    """
+
+    def __init__(self, vocabulary: Dict[str, int], offsets: np.ndarray, rows: np.ndarray,
+                 weights: np.ndarray, doc_lengths: np.ndarray):
+        self.vocabulary = vocabulary
+        self.offsets = offsets
+        self.rows = rows
+        self.weights = weights
+        self.doc_lengths = doc_lengths
+        self.avg_length = float(doc_lengths.mean()) if len(doc_lengths) else 0.0
+        n = len(doc_lengths)
+        doc_freq = np.diff(offsets).astype(np.float32)
+        self.idf = np.log(1.0 + (n - doc_freq + 0.5) / (doc_freq + 0.5)).astype(np.float32)
+
+    def __len__(self):
+        return len(self.doc_lengths)
+
+    @staticmethod
+    def product_fields(store: ProductStore, row: int):
+        """(field, text) pairs indexed for a product row"""
+        strings = store.strings
+        yield "name", strings[store.names[row]]
+        yield "category", strings[store.categories[row]]
+        yield "description", strings[store.descriptions[row]]
+        for i in range(store.item_offsets[row], store.item_offsets[row + 1]):
+            yield "item_id", strings[store.item_ids[i]]
+            yield "variant", strings[store.item_variants[i]]
+            yield "item_description", strings[store.item_descriptions[i]]
+
+    @classmethod
+    def build(cls, store: ProductStore) -> "LexicalIndex":
+        vocabulary: Dict[str, int] = {}
+        postings: List[Dict[int, float]] = []
+        doc_lengths = np.zeros(len(store), dtype=np.float32)
+
+        for row in range(len(store)):
+            term_weights: Dict[int, float] = {}
+            for field, text in cls.product_fields(store, row):
+                weight = FIELD_WEIGHTS[field]
+                for token in tokenize(text):
+                    term = vocabulary.setdefault(token, len(vocabulary))
+                    term_weights[term] = term_weights.get(term, 0.0) + weight
+                    doc_lengths[row] += weight
+            for term, weight in term_weights.items():
+                if term == len(postings):
+                    postings.append({})
+                postings[term][row] = weight
+
+        offsets = np.zeros(len(postings) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum([len(p) for p in postings])
+        rows = np.empty(offsets[-1], dtype=np.int32)
+        weights = np.empty(offsets[-1], dtype=np.float32)
+        for term, plist in enumerate(postings):
+            rows[offsets[term]:offsets[term + 1]] = list(plist.keys())
+            weights[offsets[term]:offsets[term + 1]] = list(plist.values())
+        return cls(vocabulary, offsets, rows, weights, doc_lengths)
+
+    def scores(self, query: str) -> np.ndarray:
+        """Dense BM25 score per product row (zeros where no query term matches)"""
+        scores = np.zeros(len(self.doc_lengths), dtype=np.float32)
+        if not len(scores):
+            return scores
+        norm = BM25_K1 * (1 - BM25_B + BM25_B * self.doc_lengths / (self.avg_length or 1.0))
+        for token in set(tokenize(query)):
+            term = self.vocabulary.get(token)
+            if term is None:
+                continue
+            start, end = self.offsets[term], self.offsets[term + 1]
+            rows = self.rows[start:end]
+            tf = self.weights[start:end]
+            # rows are unique within one posting list, so fancy-index += is safe
+            scores[rows] += self.idf[term] * tf * (BM25_K1 + 1) / (tf + norm[rows])
+        return scores
+
+    def search(self, query: str, top_k: int) -> Tuple[np.ndarray, np.ndarray]:
+        scores = self.scores(query)
+        matched = np.flatnonzero(scores > 0)
+        if not len(matched):
+            return matched.astype(np.int64), scores[matched]
+        k = min(top_k, len(matched))
+        top = matched[np.argpartition(-scores[matched], k - 1)[:k]]
+        top = top[np.argsort(-scores[top], kind="stable")]
+        return top.astype(np.int64), scores[top]
+
+
+def reciprocal_rank_fusion(rankings: Sequence[Sequence[int]], top_k: int,
+                           k: int = RRF_K) -> List[Tuple[int, float]]:
+    """Fuse ranked row lists: score(row) = sum over lists of 1 / (k + rank)"""
+    fused: Dict[int, float] = {}
+    for ranking in rankings:
+        for rank, row in enumerate(ranking, 1):
+            fused[int(row)] = fused.get(int(row), 0.0) + 1.0 / (k + rank)
+    return sorted(fused.items(), key=lambda x: x[1], reverse=True)[:top_k]
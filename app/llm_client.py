@@ -0,0 +1,119 @@
+"""Deadline-bounded Gemini calls with hedged duplicate requests"""
+import os
+import time
+import threading
+import contextvars
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from typing import Optional
+
+import numpy as np
+
+import metrics
+import scheduler
+from model_pool import ModelPool
+
+# Whole-turn budget; past it the caller answers from the degraded path
+TURN_DEADLINE_MS = float(os.getenv("TURN_DEADLINE_MS", "8000"))
+# Send a duplicate request once the first has run this long; 0 = use the observed p95
+HEDGE_AFTER_MS = float(os.getenv("HEDGE_AFTER_MS", "0"))
+HEDGE_DEFAULT_MS = float(os.getenv("HEDGE_DEFAULT_MS", "2500"))  # until enough samples exist
+HEDGE_MIN_SAMPLES = 20
+MAX_HEDGES = int(os.getenv("MAX_HEDGES", "1"))
+LLM_WORKERS = int(os.getenv("LLM_WORKERS", "32"))
+
+
+class DeadlineExceeded(Exception):
+    """No model response arrived before the turn deadline"""
+
+
+class LatencyTracker:
+    """Sliding window of recent call latencies (seconds)"""
+
+    def __init__(self, window: int = 500):
+        self._samples = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def add(self, seconds: float):
+        with self._lock:
+            self._samples.append(seconds)
+
+    def __len__(self):
+        return len(self._samples)
+
+    def percentile(self, q: float) -> Optional[float]:
+        with self._lock:
+            if not self._samples:
+                return None
+            samples = np.fromiter(self._samples, dtype=np.float64)
+        return float(np.percentile(samples, q))
+
+
+class HedgedCaller:
+    """
+    Runs generate_content in a worker pool. If the first request is slower
+    than the hedge delay (p95 of recent calls by default), an identical
+    request is sent and whichever answers first wins. Losing requests are
+    abandoned; their per-request timeout bounds how long they linger.
+    """
+
+    def __init__(self, hedge_after_ms: float = HEDGE_AFTER_MS, max_hedges: int = MAX_HEDGES,
+                 workers: int = LLM_WORKERS):
+        self.hedge_after_ms = hedge_after_ms
+        self.max_hedges = max_hedges
+        self.latency = LatencyTracker()
+        self.executor = ThreadPoolExecutor(workers, thread_name_prefix="llm")
+
+    def hedge_delay(self) -> float:
+        """Seconds to wait on a request before hedging it"""
+        if self.hedge_after_ms:
+            return self.hedge_after_ms / 1000
+        if len(self.latency) < HEDGE_MIN_SAMPLES:
+            return HEDGE_DEFAULT_MS / 1000
+        return self.latency.percentile(95)
+
+    def _timed_call(self, pool: ModelPool, deadline: float, kwargs):
+        """One request routed by the pool; the chosen member's quota scheduler admits it"""
+        # A hedge is routed like any request, usually to another member
+        start = time.perf_counter()
+        response = pool.generate(deadline, **kwargs)
+        self.latency.add(time.perf_counter() - start)
+        return response
+
+    def _submit(self, pool: ModelPool, deadline: float, kwargs):
+        ctx = contextvars.copy_context()
+        return self.executor.submit(ctx.run, self._timed_call, pool, deadline, kwargs)
+
+    def generate(self, pool: ModelPool, deadline: float, **kwargs):
+        """generate_content(**kwargs) answered before the monotonic deadline, or DeadlineExceeded"""
+        primary = self._submit(pool, deadline, kwargs)
+        pending = {primary}
+        hedges = 0
+        last_error = None
+        hedge_at = time.monotonic() + self.hedge_delay()
+
+        while pending:
+            now = time.monotonic()
+            if now >= deadline:
+                break
+            can_hedge = hedges < self.max_hedges
+            wake_at = min(hedge_at, deadline) if can_hedge else deadline
+            done, pending = wait(pending, timeout=max(0.0, wake_at - now), return_when=FIRST_COMPLETED)
+            for future in done:
+                try:
+                    response = future.result()
+                except Exception as e:
+                    last_error = e
+                    continue
+                if future is not primary:
+                    metrics.record_hedge("won")
+                return response
+            if pending and can_hedge and hedge_at <= time.monotonic() < deadline:
+                hedges += 1
+                metrics.record_hedge("sent")
+                pending.add(self._submit(pool, deadline, kwargs))
+                hedge_at = time.monotonic() + self.hedge_delay()
+
+        if last_error is not None and not pending:
+            raise last_error
+        raise DeadlineExceeded(f"no model response within the turn deadline ({hedges} hedged)")
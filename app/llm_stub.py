@@ -0,0 +1,73 @@
+"""
+Local stand-in for the Gemini generateContent REST endpoint, for load tests
+and as a model pool member. Replies call a routing function chosen by
+keyword, citing the product IDs found in the prompt.
+Run from app/: python -m llm_stub [port]   (STUB_LATENCY_MS adds a fixed delay)
+"""
+import os
+import re
+import sys
+import json
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+STUB_LATENCY_MS = float(os.getenv("STUB_LATENCY_MS", "0"))
+PRODUCT_ID = re.compile(r"\(ID: (\d+)\)")
+
+# First matching keyword picks the function; otherwise the first declared one is used
+KEYWORD_FUNCTIONS = (
+    (("cart", "add"), "shopping_cart_specialist"),
+    (("pay", "checkout"), "financial_transactions_expert"),
+    (("points", "offer", "discount"), "customer_loyalty_specialist"),
+    (("recommend", "suggest", "looking for", "show me", "find"), "recommendation_agent"),
+)
+
+
+def stub_reply(request: dict) -> dict:
+    prompt = " ".join(part.get("text", "") for content in request.get("contents", [])
+                      for part in content.get("parts", []))
+    message = prompt.rsplit("USER MESSAGE:", 1)[-1].split("Instructions:", 1)[0].strip().lower()
+    declared = [f["name"] for tool in request.get("tools", []) for f in tool.get("functionDeclarations", [])]
+
+    name = declared[0] if declared else "sales_specialist"
+    for keywords, function in KEYWORD_FUNCTIONS:
+        if function in declared and any(k in message for k in keywords):
+            name = function
+            break
+
+    product_ids = [int(pid) for pid in PRODUCT_ID.findall(prompt)[:3]]
+    args = {"response": f"(stub) Happy to help with: {message[:80]}", "product_ids": product_ids}
+    prompt_tokens = len(prompt) // 4
+    return {
+        "candidates": [{
+            "content": {"role": "model", "parts": [{"functionCall": {"name": name, "args": args}}]},
+            "finishReason": "STOP"
+        }],
+        "usageMetadata": {"promptTokenCount": prompt_tokens, "candidatesTokenCount": 20,
+                          "totalTokenCount": prompt_tokens + 20}
+    }
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        if not self.path.split("?")[0].endswith(":generateContent"):
+            self.send_error(404)
+            return
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        if STUB_LATENCY_MS:
+            time.sleep(STUB_LATENCY_MS / 1000)
+        payload = json.dumps(stub_reply(json.loads(body or b"{}"))).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format, *args):
+        pass
+
+
+if __name__ == "__main__":
+    port = int(sys.argv[1]) if len(sys.argv) > 1 else 8090
+    print(f"🧪 Gemini stub listening on http://127.0.0.1:{port}")
+    ThreadingHTTPServer(("127.0.0.1", port), StubHandler).serve_forever()
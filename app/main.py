@@ -1,5 +1,5 @@
-from fastapi import FastAPI, WebSocket, Request, Depends, HTTPException, status
-from fastapi.responses import HTMLResponse, RedirectResponse
+from fastapi import FastAPI, WebSocket, WebSocketDisconnect, Request, Depends, HTTPException, status
+from fastapi.responses import HTMLResponse, RedirectResponse, Response, JSONResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
 from fastapi.security import HTTPBearer
@@ -7,17 +7,178 @@ from fastapi.security import HTTPBearer
 from jose import jwt, JWTError
 from auth import SECRET_KEY, ALGORITHM
 from pydantic import BaseModel
-from typing import Optional
+from typing import Dict, List, Optional, Tuple
+from contextlib import asynccontextmanager
 import asyncio
+import os
 from crew_backend import crew
+from models import SessionContext
+from session_store import (LiveSession, live_sessions, SESSION_EVICT_INTERVAL, SESSION_FLUSH_INTERVAL,
+                           SESSION_MEMORY_BUDGET_MB)
+import ws_codec
+from ws_codec import send_frame
+import metrics
+import scheduler
 from auth import (
     register_user, authenticate_user, get_current_user,
-    UserRegister, UserLogin, save_user_session, load_user_session,
-    users_collection
+    UserRegister, UserLogin, save_user_session, save_user_sessions, load_user_session, ensure_session_ttl_index,
+    users_collection, require_admin, get_user_by_email, invalidate_user,
+    inventory_collections, turn_events_collection
 )
+import inventory
+import turn_events
 import json
 
-app = FastAPI(title="CrewAI Chatbot")
+# Poll the catalog file for changes every N seconds (0 disables the watcher)
+CATALOG_WATCH_INTERVAL = float(os.getenv("CATALOG_WATCH_INTERVAL", "0"))
+
+
+def _catalog_mtime() -> Optional[float]:
+    try:
+        return os.path.getmtime(crew.product_rag.products_json_path)
+    except OSError:
+        return None
+
+
+async def watch_catalog(interval: float):
+    """Reload the catalog whenever the file's mtime changes"""
+    last_mtime = _catalog_mtime()
+    while True:
+        await asyncio.sleep(interval)
+        mtime = _catalog_mtime()
+        if mtime is None or mtime == last_mtime:
+            continue
+        last_mtime = mtime
+        try:
+            await asyncio.to_thread(crew.product_rag.reload_catalog)
+        except Exception as e:
+            print(f"⚠ Catalog reload failed: {e}")
+
+
+async def maintain_inventory(interval: float):
+    """
+    Share stock through Mongo: refresh the local counters, renew the holds
+    of live sessions and release expired ones every interval seconds
+    """
+    items, holds = inventory_collections()
+    inventory.stock.attach(items, holds)
+    try:
+        await asyncio.to_thread(holds.create_index, "expires_at")
+        await asyncio.to_thread(holds.create_index, "owner")
+        print(f"✓ Loaded stock levels for {await asyncio.to_thread(inventory.stock.refresh)} items")
+    except Exception as e:
+        print(f"⚠ Could not load stock levels; every item counts as available: {e}")
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await asyncio.to_thread(inventory.stock.renew, live_sessions.emails())
+            released = await asyncio.to_thread(inventory.stock.expire_holds)
+            if released:
+                print(f"⚠ Released {released} units held by sessions that were not renewed")
+            await asyncio.to_thread(inventory.stock.refresh)
+        except Exception as e:
+            print(f"⚠ Stock refresh failed, retrying next interval: {e}")
+
+
+async def write_turn_events(sink, interval: float):
+    """Write buffered turn events to the sink every interval seconds"""
+    try:
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await turn_events.log.flush(sink)
+            except Exception as e:
+                print(f"⚠ Turn event write failed, {len(turn_events.log)} events kept for the next interval: {e}")
+    finally:
+        try:
+            await turn_events.log.flush(sink)
+        except Exception:
+            pass
+
+
+async def maintain_sessions(interval: float):
+    """
+    Save changed sessions in one bulk write and evict idle ones from memory
+    every interval seconds; interval <= 0 means turns save themselves, and
+    this only evicts and retries failed saves.
+    """
+    try:
+        await ensure_session_ttl_index()
+    except Exception as e:
+        print(f"⚠ Could not set up session expiry in Mongo: {e}")
+    budget = SESSION_MEMORY_BUDGET_MB * 1024 * 1024
+    period = interval if interval > 0 else SESSION_EVICT_INTERVAL
+    try:
+        while True:
+            await asyncio.sleep(period)
+            try:
+                with metrics.span("session_flush"):
+                    await live_sessions.flush(save_user_sessions)
+            except Exception as e:
+                print(f"⚠ Session flush failed, retrying next interval: {e}")
+            expired, evicted, size = live_sessions.evict(budget)
+            # Holds are keyed by user, so a user who reconnected meanwhile keeps them
+            dropped = [s for s in live_sessions.take_dropped() if live_sessions.get(s.email) is None]
+            if dropped:
+                try:
+                    await asyncio.to_thread(_release_holds, dropped)
+                except Exception as e:
+                    print(f"⚠ Could not release stock held by {len(dropped)} closed sessions: {e}")
+            metrics.record_sessions(len(live_sessions), size, expired, evicted)
+            if evicted:
+                print(f"⚠ Live sessions over the {SESSION_MEMORY_BUDGET_MB:g} MB budget; evicted {evicted} idle")
+    finally:
+        # Last write on shutdown
+        try:
+            await live_sessions.flush(save_user_sessions)
+        except Exception:
+            pass
+
+
+def _release_holds(sessions: List[LiveSession]):
+    """Stock held by carts is given back once their sessions leave memory (restores hold it again)"""
+    for session in sessions:
+        crew.release_cart(session.context)
+
+
+async def _save_now(session: LiveSession):
+    version, document = session.snapshot()
+    # Outside a turn, so observed under agent "none" like the bulk session_flush
+    with metrics.span("session_save"):
+        await save_user_session(session.email, document)
+    session.mark_saved(version)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Start serving immediately and warm the embedding index in the background"""
+    warmup_task = asyncio.create_task(asyncio.to_thread(crew.warm_up))
+    watcher_task = None
+    if CATALOG_WATCH_INTERVAL > 0:
+        watcher_task = asyncio.create_task(watch_catalog(CATALOG_WATCH_INTERVAL))
+    inventory_task = None
+    if inventory.INVENTORY_FLUSH_INTERVAL > 0:
+        inventory_task = asyncio.create_task(maintain_inventory(inventory.INVENTORY_FLUSH_INTERVAL))
+    sessions_task = asyncio.create_task(maintain_sessions(SESSION_FLUSH_INTERVAL))
+    events_task = None
+    events_sink = turn_events.create_sink(collection=turn_events_collection)
+    if events_sink is not None:
+        events_task = asyncio.create_task(write_turn_events(events_sink, turn_events.EVENT_FLUSH_INTERVAL))
+    yield
+    if watcher_task:
+        watcher_task.cancel()
+    for task in (sessions_task, inventory_task, events_task):
+        if task:
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+    if not warmup_task.done():
+        print("⚠ Shutting down before embedding warm-up finished")
+
+
+app = FastAPI(title="CrewAI Chatbot", lifespan=lifespan)
 
 app.mount("/static", StaticFiles(directory="static"), name="static")
 templates = Jinja2Templates(directory="templates")
@@ -133,6 +294,7 @@ async def update_profile(
         {"email": current_user["email"]},
         {"$set": update_data}
     )
+    invalidate_user(current_user["email"])
     
     if result.modified_count == 0:
         raise HTTPException(
@@ -161,16 +323,127 @@ async def update_profile(
 @app.get("/api/products/{product_id}")
 async def get_product(product_id: int):
     """Get product details by ID"""
-    for product in crew.product_rag.products:
-        if product.get('id') == product_id:
-            return product
-    raise HTTPException(status_code=404, detail="Product not found")
+    product = crew.product_rag.get_product(product_id)
+    if product is None:
+        raise HTTPException(status_code=404, detail="Product not found")
+    return product
+
+
+@app.get("/api/products/{product_id}/related")
+async def get_related_products(product_id: int, limit: int = 6):
+    """Precomputed similar and frequently-bought-together product ids"""
+    rag = crew.product_rag
+    if rag.get_product(product_id) is None:
+        raise HTTPException(status_code=404, detail="Product not found")
+    if rag.related is None:
+        return {"similar": [], "bought_together": []}
+    return {
+        "similar": rag.related.similar(product_id, limit),
+        "bought_together": rag.related.bought_together(product_id, limit)
+    }
+
+
+@app.post("/api/admin/reload-catalog", dependencies=[Depends(require_admin)])
+async def reload_catalog():
+    """Diff the catalog file against the loaded one and swap it in without a restart"""
+    try:
+        stats = await asyncio.to_thread(crew.product_rag.reload_catalog)
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Catalog reload failed: {e}"
+        )
+    return {"message": "Catalog reloaded", **stats}
+
+@app.get("/api/admin/inventory", dependencies=[Depends(require_admin)])
+async def get_inventory():
+    """On-hand and reserved units per tracked item_id"""
+    return {"items": inventory.stock.levels()}
+
+
+@app.put("/api/admin/inventory", dependencies=[Depends(require_admin)])
+async def set_inventory(levels: Dict[str, int]):
+    """Set on-hand units, e.g. {"1A": 12, "1B": 0}; unknown item_ids are rejected"""
+    unknown = [item_id for item_id in levels if crew.product_rag.find_variant(item_id) is None]
+    if unknown:
+        raise HTTPException(status_code=404, detail=f"Unknown item_ids: {', '.join(unknown)}")
+    for item_id, on_hand in levels.items():
+        await asyncio.to_thread(inventory.stock.set_stock, item_id, on_hand)
+    return {"items": {item_id: inventory.stock.levels()[item_id] for item_id in levels}}
+
+@app.get("/api/admin/model-pool", dependencies=[Depends(require_admin)])
+async def model_pool_status():
+    """Health, latency and quota backlog of each LLM pool member"""
+    pool = crew.genai_model
+    return {"members": pool.status() if hasattr(pool, "status") else []}
+
+
+def _parse_client_message(raw: str) -> Tuple[Optional[str], str]:
+    """(message id, text) from a {"id", "text"} frame; plain text has no id"""
+    if raw.startswith("{"):
+        try:
+            data = json.loads(raw)
+            msg_id = data.get("id")
+            return (str(msg_id) if msg_id is not None else None), str(data.get("text", ""))
+        except (json.JSONDecodeError, AttributeError):
+            pass
+    return None, raw
+
+
+async def _answer(session: LiveSession, msg_id: Optional[str], user_msg: str) -> Tuple[Dict, str]:
+    # Process message; the rate limiter queues this user's calls fairly against others
+    session.running += 1
+    try:
+        with scheduler.request_class(user=session.email):
+            agent_name, reply, product_ids = await asyncio.to_thread(
+                crew.route_message,
+                user_msg,
+                session.context,
+                session.email
+            )
+    finally:
+        # Saved by the next flush
+        session.running -= 1
+        session.mark_changed()
+    if SESSION_FLUSH_INTERVAL <= 0:
+        try:
+            await _save_now(session)
+        except Exception as e:
+            print(f"⚠ Session save failed, retrying with the next flush: {e}")
+    # Buffered before it is sent, so a reply finished during a disconnect is replayed on resume
+    frame = session.frame({
+        "agent": agent_name,
+        "message": reply,
+        "product_ids": product_ids
+    }, reply_to=msg_id)
+    return frame, agent_name
+
+
+async def _reply(session: LiveSession, msg_id: Optional[str], user_msg: str) -> Tuple[Dict, Optional[str]]:
+    """
+    Reply frame and agent for a client message. A message id seen before
+    gets the first answer again (agent None), waiting for it if the call
+    is still running, instead of a second LLM call.
+    """
+    if msg_id is not None and msg_id in session.replies:
+        return session.replies[msg_id], None
+    task = session.inflight.get(msg_id) if msg_id is not None else None
+    if task is not None:
+        frame, _ = await asyncio.shield(task)
+        return frame, None
+    task = asyncio.ensure_future(_answer(session, msg_id, user_msg))
+    if msg_id is not None:
+        session.inflight[msg_id] = task
+        task.add_done_callback(lambda _: session.inflight.pop(msg_id, None))
+    # Shielded: a dropped connection must not cancel a reply the client may resume for
+    return await asyncio.shield(task)
 
 
 @app.websocket("/ws")
 async def websocket_endpoint(websocket: WebSocket):
     await websocket.accept()
     user_email = None
+    session = None
     
     try:
         # Wait for authentication message with timeout
@@ -214,17 +487,6 @@ async def websocket_endpoint(websocket: WebSocket):
                 await websocket.close()
                 return
             
-            user = await users_collection.find_one({"email": email})
-            
-            if not user:
-                await websocket.send_text(json.dumps({
-                    "agent": "System",
-                    "message": "❌ User not found",
-                    "product_ids": []
-                }))
-                await websocket.close()
-                return
-                
         except JWTError as e:
             print(f"JWT validation error: {e}")
             await websocket.send_text(json.dumps({
@@ -235,49 +497,82 @@ async def websocket_endpoint(websocket: WebSocket):
             await websocket.close()
             return
         
+        resume_seq = auth_data.get("resume_seq")
+        # Frames from here on use the encoding the client asked for (JSON unless msgpack is available)
+        codec = ws_codec.negotiate(auth_data.get("encoding"))
+        session = live_sessions.get(email)
+        resumed = session is not None
+        if resumed:
+            # The context is still in memory; only the (usually cached) user record is needed
+            user, saved_session = await get_user_by_email(email), None
+        else:
+            # User (usually cached) and saved session are fetched concurrently
+            user, saved_session = await asyncio.gather(
+                get_user_by_email(email),
+                load_user_session(email)
+            )
+        
+        if not user:
+            await websocket.send_text(json.dumps({
+                "agent": "System",
+                "message": "❌ User not found",
+                "product_ids": []
+            }))
+            await websocket.close()
+            return
+        
         # Authentication successful
         user_email = user["email"]
         user_name = user["full_name"]
         
-        # Load user's previous session
-        saved_session = await load_user_session(user_email)
+        # Resume the live session, or restore context for this user / start a fresh one
+        session = live_sessions.attach(
+            user_email, websocket, None if resumed else SessionContext.from_document(saved_session)
+        )
+        context = session.context
+        # Update customer info with current user details
+        context.customer_info.update({
+            "name": user_name,
+            "email": user_email,
+            "phone": user.get("phone", ""),
+            "address": user.get("address", ""),
+            "city": user.get("city", ""),
+            "state": user.get("state", ""),
+            "zipcode": user.get("zipcode", ""),
+            "country": user.get("country", "")
+        })
+        session.mark_changed()
+        cart_notes = [] if resumed else await asyncio.to_thread(crew.hold_cart, context)
         
-        if saved_session:
-            # Restore context for this user
-            crew.context = saved_session
-            # Update customer info with current user details
-            crew.context["customer_info"]["name"] = user_name
-            crew.context["customer_info"]["email"] = user_email
-            crew.context["customer_info"]["phone"] = user.get("phone", "")
-            crew.context["customer_info"]["address"] = user.get("address", "")
-            crew.context["customer_info"]["city"] = user.get("city", "")
-            crew.context["customer_info"]["state"] = user.get("state", "")
-            crew.context["customer_info"]["zipcode"] = user.get("zipcode", "")
-            crew.context["customer_info"]["country"] = user.get("country", "")
-            
+        missed = None
+        if resumed and resume_seq is not None:
+            missed = session.frames_after(int(resume_seq))
+        session_state = {
+            "restored": bool(saved_session) or resumed,
+            "resumed": missed is not None,
+            "cart_items": context.cart.to_list(),
+            "cart_subtotal": context.cart.subtotal,
+            "loyalty_points": context.loyalty_points,
+            "interaction_count": context.interaction_count
+        }
+        if missed is not None:
+            # Only the replies the client has not seen; no reload, no repeated LLM calls
+            for frame in missed:
+                await send_frame(websocket, codec, frame)
+            welcome_msg = f"🔄 Reconnected, {user_name}. {len(missed)} missed message(s) delivered."
+        elif saved_session or resumed:
             welcome_msg = f"👋 Welcome back, {user_name}! Your previous session has been restored."
-            await websocket.send_text(json.dumps({
-                "agent": "System",
-                "message": welcome_msg,
-                "product_ids": []
-            }))
         else:
-            # Initialize new session with user info
-            crew.context["customer_info"]["name"] = user_name
-            crew.context["customer_info"]["email"] = user_email
-            crew.context["customer_info"]["phone"] = user.get("phone", "")
-            crew.context["customer_info"]["address"] = user.get("address", "")
-            crew.context["customer_info"]["city"] = user.get("city", "")
-            crew.context["customer_info"]["state"] = user.get("state", "")
-            crew.context["customer_info"]["zipcode"] = user.get("zipcode", "")
-            crew.context["customer_info"]["country"] = user.get("country", "")
-            
             welcome_msg = f"👋 Welcome {user_name}! Start chatting with our AI agents."
-            await websocket.send_text(json.dumps({
-                "agent": "System",
-                "message": welcome_msg,
-                "product_ids": []
-            }))
+        if cart_notes:
+            welcome_msg += "\n" + "\n".join(cart_notes)
+        # One frame carries the greeting and the restored session state
+        await send_frame(websocket, codec, session.frame({
+            "agent": "System",
+            "message": welcome_msg,
+            "product_ids": [],
+            "session": session_state
+        }))
         
         # Store active session
         active_sessions[user_email] = websocket
@@ -285,41 +580,32 @@ async def websocket_endpoint(websocket: WebSocket):
         # Main message loop
         while True:
             try:
-                user_msg = await websocket.receive_text()
+                msg_id, user_msg = _parse_client_message(await websocket.receive_text())
                 
                 if user_msg.lower() in ["exit", "quit"]:
                     # Save session before closing
-                    await save_user_session(user_email, crew.context)
-                    summary = crew.get_context_summary()
-                    await websocket.send_text(json.dumps({
+                    await _save_now(session)
+                    summary = crew.get_context_summary(context)
+                    await send_frame(websocket, codec, session.frame({
                         "agent": "System",
                         "message": f"📊 Session Summary:\n{json.dumps(summary, indent=2)}",
                         "product_ids": []
                     }))
-                    await websocket.send_text(json.dumps({
+                    await send_frame(websocket, codec, session.frame({
                         "agent": "System",
                         "message": "👋 Session saved. See you next time!",
                         "product_ids": []
                     }))
+                    live_sessions.discard(user_email)
+                    session = None
                     break
                 
-                # Process message
-                agent_name, reply, product_ids = await asyncio.to_thread(
-                    crew.route_message, 
-                    user_msg
-                )
-                
-                # Send response with product IDs
-                response_data = {
-                    "agent": agent_name,
-                    "message": reply,
-                    "product_ids": product_ids
-                }
-                await websocket.send_text(json.dumps(response_data))
-                
-                # Auto-save session periodically
-                await save_user_session(user_email, crew.context)
+                frame, _ = await _reply(session, msg_id, user_msg)
+                # Send response with product IDs; the context is saved by the background flush
+                await send_frame(websocket, codec, frame)
                 
+            except WebSocketDisconnect:
+                break
             except Exception as e:
                 print(f"Error processing message: {e}")
                 import traceback
@@ -330,7 +616,7 @@ async def websocket_endpoint(websocket: WebSocket):
                     "message": f"⚠️ Error: {str(e)}",
                     "product_ids": []
                 }
-                await websocket.send_text(json.dumps(error_data))
+                await send_frame(websocket, codec, session.frame(error_data))
                 break
         
     except asyncio.TimeoutError:
@@ -363,28 +649,62 @@ async def websocket_endpoint(websocket: WebSocket):
         
     finally:
         # Clean up
-        if user_email and user_email in active_sessions:
+        if user_email and active_sessions.get(user_email) is websocket:
             del active_sessions[user_email]
+        if session is not None and session.owner is websocket:
+            # Keep the conversation resumable for a while, and persisted in case it is not resumed
+            live_sessions.detach(session, websocket)
+            try:
+                await _save_now(session)
+            except Exception as e:
+                print(f"⚠ Session save on disconnect failed; the background flush will retry: {e}")
         
         try:
             await websocket.close()
         except:
             pass
 
+@app.get("/api/ready")
+async def readiness():
+    """Readiness probe: 503 until the embedding index is warm (keyword search serves meanwhile)"""
+    body = {
+        "ready": crew.is_ready,
+        "retrieval": "embeddings" if crew.is_ready else "keyword",
+        "products": len(crew.product_rag.products),
+        "warmup_error": crew.warmup_error
+    }
+    return JSONResponse(body, status_code=200 if crew.is_ready else 503)
+
+
+@app.get("/metrics")
+async def metrics_endpoint():
+    """Prometheus scrape endpoint"""
+    content, content_type = metrics.render()
+    return Response(content=content, media_type=content_type)
+
+
 @app.get("/api/summary")
 async def get_summary(current_user: dict = Depends(get_current_user)):
     """Get chat summary for authenticated user"""
-    return crew.get_context_summary()
+    session = live_sessions.get(current_user["email"])
+    if session is not None:
+        return crew.get_context_summary(session.context)
+    saved = await load_user_session(current_user["email"])
+    return crew.get_context_summary(SessionContext.from_document(saved))
 
 
 @app.post("/api/logout")
 async def logout(current_user: dict = Depends(get_current_user)):
     """Logout user - save session"""
     email = current_user["email"]
-    await save_user_session(email, crew.context)
+    session = live_sessions.get(email)
+    if session is not None:
+        await _save_now(session)
+        live_sessions.discard(email)
     return {"message": "Logged out successfully"}
 
 
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run("main:app", host="0.0.0.0", port=8000, reload=True)
\ No newline at end of file
+    uvicorn.run("main:app", host="0.0.0.0", port=8000, reload=True,
+                ws_per_message_deflate=ws_codec.WS_PER_MESSAGE_DEFLATE)
\ No newline at end of file
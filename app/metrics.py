@@ -0,0 +1,253 @@
+"""Per-stage latency spans and Prometheus metrics for the chat pipeline"""
+import time
+import threading
+import contextvars
+from contextlib import contextmanager
+from typing import Dict, List, Optional, Tuple
+
+from prometheus_client import Counter, Gauge, Histogram, CONTENT_TYPE_LATEST, generate_latest
+
+# Label used for work that happens outside a chat turn (startup, reindexing)
+NO_AGENT = "none"
+
+STAGE_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1,
+                 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+STAGE_LATENCY = Histogram(
+    "crew_stage_latency_seconds",
+    "Latency of a single chat pipeline stage",
+    ["stage", "agent"],
+    buckets=STAGE_BUCKETS
+)
+TURN_LATENCY = Histogram(
+    "crew_turn_latency_seconds",
+    "End-to-end latency of route_message",
+    ["agent"],
+    buckets=STAGE_BUCKETS
+)
+LLM_TOKENS = Counter(
+    "crew_llm_tokens_total",
+    "Tokens reported by the model usage metadata",
+    ["agent", "kind"]
+)
+CACHE_REQUESTS = Counter(
+    "crew_cache_requests_total",
+    "Cache lookups by cache name and result",
+    ["cache", "result"]
+)
+DEGRADED_STAGES = Counter(
+    "crew_degraded_total",
+    "Stages skipped or replaced with a fallback to meet a deadline",
+    ["stage"]
+)
+LLM_HEDGES = Counter(
+    "crew_llm_hedges_total",
+    "Duplicate LLM requests sent after the hedge delay, and how many of them answered first",
+    ["result"]
+)
+QUOTA_WAIT = Histogram(
+    "crew_quota_wait_seconds",
+    "Time a request waited in the client-side rate limiter",
+    ["scheduler"],
+    buckets=STAGE_BUCKETS
+)
+POOL_REQUESTS = Counter(
+    "crew_model_pool_requests_total",
+    "Generate calls per model pool member and outcome",
+    ["member", "result"]
+)
+FAST_PATH_TURNS = Counter(
+    "crew_fast_path_total",
+    "Turns answered by a deterministic handler instead of the LLM",
+    ["intent"]
+)
+LIVE_SESSIONS = Gauge(
+    "crew_live_sessions",
+    "Sessions held in memory (connected or resumable)"
+)
+LIVE_SESSION_BYTES = Gauge(
+    "crew_live_session_bytes",
+    "Estimated memory held by live sessions"
+)
+TURN_EVENTS_DROPPED = Counter(
+    "crew_turn_events_dropped_total",
+    "Turn events dropped because the event buffer was full while the sink was slow or down"
+)
+SESSIONS_EVICTED = Counter(
+    "crew_sessions_evicted_total",
+    "Live sessions dropped from memory, by reason",
+    ["reason"]
+)
+
+_current_turn: contextvars.ContextVar[Optional["TurnTimer"]] = contextvars.ContextVar(
+    "current_turn", default=None
+)
+
+
+class TurnTimer:
+    """
+    Collects stage timings for one turn; they are observed once the agent
+    is known. Route, intent and product ids ride along for the turn event log.
+    Writes from threads that outlive the turn are dropped once it is observed.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.closed = False
+        self.started = time.perf_counter()
+        self.elapsed = 0.0
+        self.spans: Dict[str, float] = {}
+        self.tokens: Dict[str, int] = {}
+        self.agent = NO_AGENT
+        self.route = "llm"
+        self.intent: Optional[str] = None
+        self.products: Dict[str, List[int]] = {}
+
+    def add_span(self, stage: str, seconds: float):
+        with self._lock:
+            if not self.closed:
+                self.spans[stage] = self.spans.get(stage, 0.0) + seconds
+
+    def add_tokens(self, kind: str, count: int):
+        with self._lock:
+            if not self.closed:
+                self.tokens[kind] = self.tokens.get(kind, 0) + count
+
+    def add_products(self, kind: str, product_ids):
+        with self._lock:
+            if not self.closed:
+                self.products.setdefault(kind, []).extend(int(pid) for pid in product_ids)
+
+    def merge(self, other: "TurnTimer"):
+        """Fold in the spans and products of work that ran on a branch() of this turn"""
+        with other._lock:
+            other.closed = True
+            spans, tokens, products = dict(other.spans), dict(other.tokens), dict(other.products)
+        for stage, seconds in spans.items():
+            self.add_span(stage, seconds)
+        for kind, count in tokens.items():
+            self.add_tokens(kind, count)
+        for kind, product_ids in products.items():
+            self.add_products(kind, product_ids)
+
+    def observe(self):
+        with self._lock:
+            self.closed = True
+            spans, tokens = dict(self.spans), dict(self.tokens)
+        agent = self.agent or NO_AGENT
+        for stage, seconds in spans.items():
+            STAGE_LATENCY.labels(stage, agent).observe(seconds)
+        for kind, count in tokens.items():
+            LLM_TOKENS.labels(agent, kind).inc(count)
+        self.elapsed = time.perf_counter() - self.started
+        TURN_LATENCY.labels(agent).observe(self.elapsed)
+
+
+@contextmanager
+def turn():
+    """Open a turn; spans recorded inside it (in this thread or via to_thread) are attached to it"""
+    timer = TurnTimer()
+    token = _current_turn.set(timer)
+    try:
+        yield timer
+    finally:
+        _current_turn.reset(token)
+        timer.observe()
+
+
+def branch() -> Tuple[contextvars.Context, TurnTimer]:
+    """
+    Context for work handed to another thread, with a timer of its own: merge
+    the timer into the turn if the result is used, or drop it if abandoned
+    """
+    ctx = contextvars.copy_context()
+    timer = TurnTimer()
+    ctx.run(_current_turn.set, timer)
+    return ctx, timer
+
+
+def merge_branch(timer: TurnTimer):
+    current = _current_turn.get()
+    if current is not None:
+        current.merge(timer)
+
+
+@contextmanager
+def span(stage: str):
+    """Time a stage; attached to the current turn, or observed directly outside of one"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        current = _current_turn.get()
+        if current is not None:
+            current.add_span(stage, elapsed)
+        else:
+            STAGE_LATENCY.labels(stage, NO_AGENT).observe(elapsed)
+
+
+def record_tokens(usage_metadata):
+    """Attach token counts from a Gemini response's usage_metadata to the current turn"""
+    current = _current_turn.get()
+    if current is None or usage_metadata is None:
+        return
+    current.add_tokens("prompt", getattr(usage_metadata, "prompt_token_count", 0) or 0)
+    current.add_tokens("completion", getattr(usage_metadata, "candidates_token_count", 0) or 0)
+
+
+def record_cache(cache: str, hit: bool):
+    CACHE_REQUESTS.labels(cache, "hit" if hit else "miss").inc()
+
+
+def record_degraded(stage: str):
+    DEGRADED_STAGES.labels(stage).inc()
+
+
+def record_hedge(result: str):
+    LLM_HEDGES.labels(result).inc()
+
+
+def record_queue_wait(scheduler: str, seconds: float):
+    QUOTA_WAIT.labels(scheduler).observe(seconds)
+
+
+def record_pool(member: str, result: str):
+    POOL_REQUESTS.labels(member, result).inc()
+
+
+def record_fast_path(intent: str):
+    FAST_PATH_TURNS.labels(intent).inc()
+    current = _current_turn.get()
+    if current is not None:
+        current.route, current.intent = "fast_path", intent
+
+
+def record_route(route: str):
+    """How the current turn was answered: llm (default), fast_path, degraded or error"""
+    current = _current_turn.get()
+    if current is not None:
+        current.route = route
+
+
+def record_products(kind: str, product_ids):
+    """Product ids the current turn touched, by kind (retrieved, carted)"""
+    current = _current_turn.get()
+    if current is not None:
+        current.add_products(kind, product_ids)
+
+
+def record_sessions(count: int, size_bytes: int, expired: int, evicted: int):
+    LIVE_SESSIONS.set(count)
+    LIVE_SESSION_BYTES.set(size_bytes)
+    SESSIONS_EVICTED.labels("expired").inc(expired)
+    SESSIONS_EVICTED.labels("memory").inc(evicted)
+
+
+def record_events_dropped(count: int):
+    TURN_EVENTS_DROPPED.inc(count)
+
+
+def render() -> Tuple[bytes, str]:
+    """Prometheus text exposition of all metrics"""
+    return generate_latest(), CONTENT_TYPE_LATEST
@@ -0,0 +1,244 @@
+"""Pool of Gemini clients (API keys, model tiers, local stubs) with health- and quota-aware routing"""
+import os
+import json
+import time
+import threading
+from typing import Dict, List, Optional
+from urllib.parse import urlparse
+
+import google.generativeai as genai
+import google.ai.generativelanguage as glm
+
+import metrics
+import scheduler
+
+DEFAULT_MODEL = "gemini-2.5-flash-lite"
+# JSON list of members, e.g.
+# [{"model": "gemini-2.5-flash-lite", "api_key_env": "GOOGLE_API_KEY_2", "rpm": 1000},
+#  {"model": "gemini-2.5-flash", "tier": 1},
+#  {"model": "stub", "endpoint": "http://127.0.0.1:8090"}]
+LLM_POOL = os.getenv("LLM_POOL", "")
+BREAKER_FAILURES = int(os.getenv("BREAKER_FAILURES", "5"))
+BREAKER_RESET_SECONDS = float(os.getenv("BREAKER_RESET_SECONDS", "30"))
+# Latency assumed for a member that has not answered yet
+INITIAL_LATENCY = 1.0
+LATENCY_SMOOTHING = 0.2
+
+
+def _total_tokens(response) -> Optional[float]:
+    usage = getattr(response, "usage_metadata", None)
+    return getattr(usage, "total_token_count", None) if usage is not None else None
+
+
+class PoolUnavailable(Exception):
+    """Every member is open-circuited or already failed this request"""
+
+
+class CircuitBreaker:
+    """
+    Opens after BREAKER_FAILURES consecutive failures; after the reset
+    period one trial request is let through (half-open) and its outcome
+    closes or re-opens the circuit.
+    """
+
+    def __init__(self, failures: int = BREAKER_FAILURES, reset_after: float = BREAKER_RESET_SECONDS):
+        self.failure_threshold = failures
+        self.reset_after = reset_after
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self.trial_in_flight = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        return "half_open" if time.monotonic() - self.opened_at >= self.reset_after else "open"
+
+    def available(self) -> bool:
+        state = self.state
+        return state == "closed" or (state == "half_open" and not self.trial_in_flight)
+
+    def begin(self) -> bool:
+        """Claim permission for one request"""
+        with self._lock:
+            state = self.state
+            if state == "closed":
+                return True
+            if state == "half_open" and not self.trial_in_flight:
+                self.trial_in_flight = True
+                return True
+            return False
+
+    def release(self):
+        """End a request that says nothing about health (quota waits, 429s)"""
+        with self._lock:
+            self.trial_in_flight = False
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self.trial_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.trial_in_flight or self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+            self.trial_in_flight = False
+
+
+def _make_client(api_key: Optional[str] = None, endpoint: Optional[str] = None):
+    """Dedicated client for a member; None uses the process default from genai.configure"""
+    if endpoint:
+        from google.auth.credentials import AnonymousCredentials
+        from google.ai.generativelanguage_v1beta.services.generative_service.transports.rest import (
+            GenerativeServiceRestTransport
+        )
+        url = urlparse(endpoint)
+        transport = GenerativeServiceRestTransport(
+            host=url.netloc, url_scheme=url.scheme or "http", credentials=AnonymousCredentials()
+        )
+        return glm.GenerativeServiceClient(transport=transport)
+    if api_key:
+        return glm.GenerativeServiceClient(client_options={"api_key": api_key})
+    return None
+
+
+class PoolMember:
+    """One model on one key (or endpoint), with its own quota, latency estimate and breaker"""
+
+    def __init__(self, name: str, model, quota: scheduler.QuotaScheduler, tier: int = 0):
+        self.name = name
+        self.model = model
+        self.quota = quota
+        self.tier = tier
+        self.breaker = CircuitBreaker()
+        self.latency: Optional[float] = None
+        self.inflight = 0
+        self.rate_limited = 0  # consecutive 429s, for backoff
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, entry: Dict, index: int) -> "PoolMember":
+        model_name = entry.get("model", DEFAULT_MODEL)
+        api_key = os.getenv(entry["api_key_env"]) if entry.get("api_key_env") else entry.get("api_key")
+        model = genai.GenerativeModel(model_name)
+        client = _make_client(api_key, entry.get("endpoint"))
+        if client is not None:
+            model._client = client
+        name = entry.get("name") or f"{model_name}#{index}"
+        quota = scheduler.QuotaScheduler(name, entry.get("rpm", 0), entry.get("tpm", 0))
+        return cls(name, model, quota, entry.get("tier", 0))
+
+    def expected_seconds(self) -> float:
+        """Routing cost: smoothed latency scaled by requests already in flight, plus quota backlog"""
+        latency = self.latency if self.latency is not None else INITIAL_LATENCY
+        return latency * (1 + self.inflight) + self.quota.backlog_seconds()
+
+    def observe(self, seconds: float):
+        with self._lock:
+            self.latency = seconds if self.latency is None else (
+                (1 - LATENCY_SMOOTHING) * self.latency + LATENCY_SMOOTHING * seconds
+            )
+
+    def call(self, deadline: float, kwargs: Dict, retry_rate_limits: bool = False):
+        """
+        One request admitted by this member's quota scheduler (fair per user,
+        settled with the real token count). A 429 pauses the member's
+        scheduler; it is retried on the same key only with retry_rate_limits.
+        """
+        def send():
+            with self._lock:
+                self.inflight += 1
+            try:
+                start = time.perf_counter()
+                response = self.model.generate_content(
+                    **kwargs, request_options={"timeout": max(0.1, deadline - time.monotonic())}
+                )
+                self.observe(time.perf_counter() - start)
+                return response
+            finally:
+                with self._lock:
+                    self.inflight -= 1
+
+        estimate = scheduler.estimate_tokens(str(kwargs.get("contents", "")))
+        return self.quota.run(send, estimate, deadline, usage=_total_tokens, retry_rate_limits=retry_rate_limits)
+
+
+class ModelPool:
+    """
+    Routes each generate call to the healthy member with the lowest tier,
+    then the lowest expected latency. Members out of quota rank behind
+    those with headroom; failures fail over to the next member while the
+    deadline allows.
+    """
+
+    def __init__(self, members: List[PoolMember]):
+        if not members:
+            raise ValueError("model pool needs at least one member")
+        self.members = members
+
+    @classmethod
+    def from_env(cls, config: str = LLM_POOL) -> "ModelPool":
+        """Members from LLM_POOL, or a single default-key member limited by LLM_RPM / LLM_TPM"""
+        if not config:
+            return cls([PoolMember(DEFAULT_MODEL, genai.GenerativeModel(DEFAULT_MODEL), scheduler.llm_scheduler)])
+        return cls([PoolMember.from_config(entry, i) for i, entry in enumerate(json.loads(config))])
+
+    def pick(self, exclude=()) -> Optional[PoolMember]:
+        candidates = [m for m in self.members if m.name not in exclude and m.breaker.available()]
+        if not candidates:
+            return None
+        # A member that would have to queue is treated as one tier worse than it is
+        return min(candidates, key=lambda m: (m.tier + (1 if m.quota.backlog_seconds() > 0 else 0),
+                                              m.expected_seconds()))
+
+    def generate(self, deadline: float, **kwargs):
+        failed = set()
+        last_error: Optional[Exception] = None
+        while time.monotonic() < deadline:
+            member = self.pick(exclude=failed)
+            if member is None or not member.breaker.begin():
+                break
+            try:
+                # With nowhere to fail over to, a 429 is retried on the same key once its pause ends
+                response = member.call(deadline, kwargs, retry_rate_limits=len(self.members) == 1)
+            except scheduler.QuotaExceeded as e:
+                # Quota ran out for this member within the deadline; no health penalty
+                member.breaker.release()
+                failed.add(member.name)
+                last_error = e
+                continue
+            except Exception as e:
+                last_error = e
+                if scheduler.is_rate_limit_error(e):
+                    # Not a health problem: the scheduler paused this key; let routing prefer the others
+                    member.rate_limited += 1
+                    member.quota.backoff(scheduler.RATE_LIMIT_BACKOFF * (2 ** min(member.rate_limited - 1, 4)))
+                    member.breaker.release()
+                    metrics.record_pool(member.name, "rate_limited")
+                    continue
+                print(f"⚠ Model pool member {member.name} failed: {e}")
+                member.breaker.record_failure()
+                metrics.record_pool(member.name, "error")
+                failed.add(member.name)
+                continue
+            member.rate_limited = 0
+            member.breaker.record_success()
+            metrics.record_pool(member.name, "ok")
+            return response
+        if last_error is not None:
+            raise last_error
+        raise PoolUnavailable("no model pool member available")
+
+    def status(self) -> List[Dict]:
+        return [{
+            "name": m.name,
+            "tier": m.tier,
+            "breaker": m.breaker.state,
+            "latency_ms": round(m.latency * 1000, 1) if m.latency is not None else None,
+            "inflight": m.inflight,
+            "quota_backlog_s": round(m.quota.backlog_seconds(), 3)
+        } for m in self.members]
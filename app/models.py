@@ -0,0 +1,388 @@
+"""Slotted models for catalog entries and per-user session context"""
+import sys
+import datetime
+from dataclasses import dataclass, field, replace
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+
+def _now() -> float:
+    return datetime.datetime.now().timestamp()
+
+
+def _to_iso(ts: Optional[float]) -> Optional[str]:
+    return datetime.datetime.fromtimestamp(ts).isoformat() if ts is not None else None
+
+
+def _from_iso(value) -> Optional[float]:
+    if value is None:
+        return None
+    if isinstance(value, (int, float)):
+        return float(value)
+    if isinstance(value, datetime.datetime):
+        return value.timestamp()
+    try:
+        return datetime.datetime.fromisoformat(value).timestamp()
+    except (TypeError, ValueError):
+        return None
+
+
+@dataclass(slots=True, frozen=True)
+class Variant:
+    item_id: str
+    variant: str = ""
+    price: Optional[float] = None
+    description: str = ""
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> "Variant":
+        return cls(data.get("item_id", ""), data.get("variant", ""), data.get("price"), data.get("description", ""))
+
+    def to_dict(self) -> Dict:
+        return {"item_id": self.item_id, "variant": self.variant, "price": self.price, "description": self.description}
+
+
+@dataclass(slots=True, frozen=True)
+class Product:
+    id: int
+    name: str
+    category: str = ""
+    description: str = ""
+    items: Tuple[Variant, ...] = ()
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> "Product":
+        return cls(
+            data.get("id"),
+            data.get("name") or data.get("title", "Unknown"),
+            data.get("category") or data.get("type", ""),
+            data.get("description", ""),
+            tuple(Variant.from_dict(item) for item in data.get("items") or [])
+        )
+
+    def to_dict(self) -> Dict:
+        return {
+            "id": self.id,
+            "name": self.name,
+            "category": self.category,
+            "description": self.description,
+            "items": [item.to_dict() for item in self.items]
+        }
+
+    def variant(self, item_id: str) -> Optional[Variant]:
+        for item in self.items:
+            if item.item_id == item_id:
+                return item
+        return None
+
+
+@dataclass(slots=True)
+class HistoryTurn:
+    """One user message and the agent reply; timestamps are kept as epoch floats"""
+    user: str
+    agent: str
+    reply: str
+    product_ids: Tuple[int, ...] = ()
+    timestamp: float = field(default_factory=_now)
+
+    def __post_init__(self):
+        # Agent names repeat across every turn of every session
+        self.agent = sys.intern(self.agent)
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> "HistoryTurn":
+        return cls(
+            data.get("user", ""),
+            data.get("agent", ""),
+            data.get("reply", ""),
+            tuple(int(pid) for pid in data.get("product_ids") or ()),
+            _from_iso(data.get("timestamp")) or _now()
+        )
+
+    def to_dict(self) -> Dict:
+        return {
+            "user": self.user,
+            "agent": self.agent,
+            "reply": self.reply,
+            "product_ids": list(self.product_ids),
+            "timestamp": _to_iso(self.timestamp)
+        }
+
+
+@dataclass(slots=True)
+class CartLine:
+    item_id: str
+    quantity: int = 1
+    product_id: Optional[int] = None
+    name: str = ""
+    variant: str = ""
+    price: Optional[float] = None  # None for lines that could not be matched to the catalog
+
+    @property
+    def cents(self) -> int:
+        return round(self.price * 100) * self.quantity if self.price is not None else 0
+
+    @classmethod
+    def from_dict(cls, data) -> "CartLine":
+        if isinstance(data, str):
+            # Earlier releases stored whatever text the model produced
+            return cls(item_id=data, name=data)
+        return cls(
+            str(data.get("item_id", "")),
+            int(data.get("quantity") or 1),
+            data.get("product_id"),
+            data.get("name", ""),
+            data.get("variant", ""),
+            data.get("price")
+        )
+
+    def to_dict(self) -> Dict:
+        return {
+            "item_id": self.item_id,
+            "quantity": self.quantity,
+            "product_id": self.product_id,
+            "name": self.name,
+            "variant": self.variant,
+            "price": self.price
+        }
+
+
+class Cart:
+    """
+    Lines keyed by item_id in insertion order. Subtotal and item count are
+    kept up to date on every change (in cents, so they never drift), so
+    reading them is O(1).
+    """
+    __slots__ = ("_lines", "_cents", "_count")
+
+    # Lines spelled out in the prompt digest; the rest are summarised
+    DIGEST_LINES = 10
+
+    def __init__(self, lines: Iterable[CartLine] = ()):
+        self._lines: Dict[str, CartLine] = {}
+        self._cents = 0
+        self._count = 0
+        for line in lines:
+            existing = self._lines.get(line.item_id)
+            self._put(replace(line, quantity=existing.quantity + line.quantity) if existing else line)
+
+    def _put(self, line: CartLine):
+        existing = self._lines.get(line.item_id)
+        if existing is not None:
+            self._cents -= existing.cents
+            self._count -= existing.quantity
+        self._lines[line.item_id] = line
+        self._cents += line.cents
+        self._count += line.quantity
+
+    def add(self, item_id: str, quantity: int = 1, product: Optional[Product] = None,
+            variant: Optional[Variant] = None) -> CartLine:
+        """Add quantity of item_id, merging with an existing line"""
+        existing = self._lines.get(item_id)
+        if existing is not None:
+            return self.set_quantity(item_id, existing.quantity + quantity)
+        line = CartLine(
+            item_id, quantity,
+            product.id if product else None,
+            product.name if product else item_id,
+            variant.variant if variant else "",
+            variant.price if variant else None
+        )
+        self._put(line)
+        return line
+
+    def set_quantity(self, item_id: str, quantity: int) -> Optional[CartLine]:
+        """Change a line's quantity; zero or less removes it"""
+        line = self._lines.get(item_id)
+        if line is None:
+            return None
+        if quantity <= 0:
+            self.remove(item_id)
+            return None
+        self._put(CartLine(line.item_id, quantity, line.product_id, line.name, line.variant, line.price))
+        return self._lines[item_id]
+
+    def remove(self, item_id: str, quantity: Optional[int] = None) -> bool:
+        """Remove quantity units of item_id (the whole line when quantity is None)"""
+        line = self._lines.get(item_id)
+        if line is None:
+            return False
+        if quantity is not None and quantity < line.quantity:
+            self.set_quantity(item_id, line.quantity - quantity)
+            return True
+        del self._lines[item_id]
+        self._cents -= line.cents
+        self._count -= line.quantity
+        return True
+
+    def clear(self):
+        self._lines.clear()
+        self._cents = 0
+        self._count = 0
+
+    def get(self, item_id: str) -> Optional[CartLine]:
+        return self._lines.get(item_id)
+
+    @property
+    def lines(self) -> List[CartLine]:
+        return list(self._lines.values())
+
+    @property
+    def subtotal(self) -> float:
+        return self._cents / 100
+
+    @property
+    def item_count(self) -> int:
+        return self._count
+
+    def __len__(self) -> int:
+        return len(self._lines)
+
+    def __contains__(self, item_id: str) -> bool:
+        return item_id in self._lines
+
+    def digest(self, max_lines: int = DIGEST_LINES) -> str:
+        """Compact one-line summary for the prompt"""
+        if not self._lines:
+            return "empty"
+        parts = []
+        for line in list(self._lines.values())[:max_lines]:
+            label = f"{line.name} ({line.variant})" if line.variant else line.name
+            price = f" @ {line.price:.2f}" if line.price is not None else " (unpriced)"
+            parts.append(f"{line.quantity}x {label} [{line.item_id}]{price}")
+        if len(self._lines) > max_lines:
+            parts.append(f"+{len(self._lines) - max_lines} more lines")
+        return f"{self._count} items, subtotal {self.subtotal:.2f}: " + "; ".join(parts)
+
+    def to_list(self) -> List[Dict]:
+        return [line.to_dict() for line in self._lines.values()]
+
+    @classmethod
+    def from_list(cls, items) -> "Cart":
+        return cls(CartLine.from_dict(item) for item in items or [])
+
+
+@dataclass(slots=True)
+class PreferenceProfile:
+    """
+    Exponential moving average of the embeddings of products a user viewed,
+    was shown or put in the cart, L2-normalised. Tagged with the embedder
+    name so a model change starts a fresh profile instead of mixing spaces.
+    """
+    vector: Optional[np.ndarray] = None
+    model: str = ""
+    updates: int = 0
+
+    def matches(self, model: str) -> bool:
+        return self.vector is not None and self.model == model
+
+    def update(self, embedding: np.ndarray, model: str, alpha: float, weight: float = 1.0):
+        """Blend in one embedding; weight 2 moves the profile as far as two updates of weight 1"""
+        embedding = np.asarray(embedding, dtype=np.float32)
+        if not self.matches(model) or self.vector.shape != embedding.shape:
+            blended, self.updates = embedding, 0
+        else:
+            rate = 1 - (1 - alpha) ** weight
+            blended = (1 - rate) * self.vector + rate * embedding
+        norm = np.linalg.norm(blended)
+        if not norm:
+            return
+        # A new array rather than an in-place update, so concurrent readers see old or new, never half
+        self.vector = (blended / norm).astype(np.float32)
+        self.model = model
+        self.updates += 1
+
+    def to_dict(self) -> Dict:
+        if self.vector is None:
+            return {}
+        # float16 bytes: a 768-d profile costs 1.5 KB in the session document
+        return {"vector": self.vector.astype(np.float16).tobytes(), "model": self.model, "updates": self.updates}
+
+    @classmethod
+    def from_dict(cls, data: Optional[Dict]) -> "PreferenceProfile":
+        data = data or {}
+        raw = data.get("vector")
+        if not raw:
+            return cls()
+        try:
+            vector = np.frombuffer(bytes(raw), dtype=np.float16).astype(np.float32)
+        except (TypeError, ValueError):
+            return cls()
+        return cls(vector, data.get("model", ""), int(data.get("updates") or 0))
+
+
+@dataclass(slots=True)
+class SessionContext:
+    """
+    Per-user conversation state. to_document/from_document keep the Mongo
+    session_data layout that earlier releases wrote as a plain dict.
+    """
+    conversation_history: List[HistoryTurn] = field(default_factory=list)
+    preferences: PreferenceProfile = field(default_factory=PreferenceProfile)
+    products_mentioned: List[str] = field(default_factory=list)
+    cart: Cart = field(default_factory=Cart)
+    customer_info: Dict[str, str] = field(default_factory=dict)
+    issues_reported: List[Dict] = field(default_factory=list)
+    recommendations_given: List[str] = field(default_factory=list)
+    transactions: List[Dict] = field(default_factory=list)
+    loyalty_points: int = 0
+    follow_ups: List[Dict] = field(default_factory=list)
+    start_time: Optional[float] = None
+    last_interaction: Optional[float] = None
+    interaction_count: int = 0
+
+    @property
+    def started_at(self) -> Optional[str]:
+        return _to_iso(self.start_time)
+
+    def touch(self):
+        now = _now()
+        if self.start_time is None:
+            self.start_time = now
+        self.last_interaction = now
+        self.interaction_count += 1
+
+    def add_turn(self, user: str, agent: str, reply: str, product_ids=()) -> HistoryTurn:
+        turn = HistoryTurn(user, agent, reply, tuple(product_ids))
+        self.conversation_history.append(turn)
+        return turn
+
+    def to_document(self) -> Dict:
+        return {
+            "conversation_history": [turn.to_dict() for turn in self.conversation_history],
+            "user_preferences": self.preferences.to_dict(),
+            "products_mentioned": self.products_mentioned,
+            "cart_items": self.cart.to_list(),
+            "customer_info": self.customer_info,
+            "issues_reported": self.issues_reported,
+            "recommendations_given": self.recommendations_given,
+            "transactions": self.transactions,
+            "loyalty_points": self.loyalty_points,
+            "follow_ups": self.follow_ups,
+            "session_metadata": {
+                "start_time": _to_iso(self.start_time),
+                "last_interaction": _to_iso(self.last_interaction),
+                "interaction_count": self.interaction_count
+            }
+        }
+
+    @classmethod
+    def from_document(cls, doc: Optional[Dict]) -> "SessionContext":
+        doc = doc or {}
+        metadata = doc.get("session_metadata") or {}
+        return cls(
+            conversation_history=[HistoryTurn.from_dict(t) for t in doc.get("conversation_history") or []],
+            preferences=PreferenceProfile.from_dict(doc.get("user_preferences")),
+            products_mentioned=list(doc.get("products_mentioned") or []),
+            cart=Cart.from_list(doc.get("cart_items")),
+            customer_info=dict(doc.get("customer_info") or {}),
+            issues_reported=list(doc.get("issues_reported") or []),
+            recommendations_given=list(doc.get("recommendations_given") or []),
+            transactions=list(doc.get("transactions") or []),
+            loyalty_points=int(doc.get("loyalty_points") or 0),
+            follow_ups=list(doc.get("follow_ups") or []),
+            start_time=_from_iso(metadata.get("start_time")),
+            last_interaction=_from_iso(metadata.get("last_interaction")),
+            interaction_count=int(metadata.get("interaction_count") or 0)
+        )
@@ -0,0 +1,572 @@
+"""
+Catalog snapshots and product retrieval (BM25, vectors, hybrid fusion,
+stock filter and personal re-ranking). Importing this module has no side
+effects, so offline tools can load a catalog without the chat server.
+"""
+import os
+import glob
+import hashlib
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from dataclasses import dataclass, replace
+from typing import List, Dict, Tuple, Optional
+import numpy as np
+import metrics
+from catalog_store import ProductStore, load_product_store, product_text, text_digests
+import catalog_artifacts
+from models import Product, Variant
+import vector_index
+from inventory import InventoryService, stock
+from related_items import RelatedItems
+import scheduler
+from lexical_index import LexicalIndex, reciprocal_rank_fusion
+from embedders import EMBEDDING_BATCH_SIZE, create_embedder
+from search_sidecar import SearchSidecarClient, SidecarUnavailable
+try:
+    import fcntl
+except ImportError:  # Windows: no cross-process lock, each worker embeds on its own
+    fcntl = None
+
+# "hybrid" fuses BM25 and vector rankings with RRF; "vector" or "lexical" use one retriever
+RETRIEVAL_MODE = os.getenv("RETRIEVAL_MODE", "hybrid")
+# Each retriever contributes top_k * HYBRID_CANDIDATES rows to the fusion
+HYBRID_CANDIDATES = int(os.getenv("HYBRID_CANDIDATES", "4"))
+# How far affinity to the user's preference profile moves a candidate in personal re-ranking
+PREFERENCE_WEIGHT = float(os.getenv("PREFERENCE_WEIGHT", "0.3"))
+
+@contextmanager
+def _host_lock(path: str):
+    """
+    Exclusive lock shared by every process on the host, so when N uvicorn
+    workers boot together one embeds and indexes while the rest wait and
+    then map the files it wrote.
+    """
+    if fcntl is None:
+        yield
+        return
+    with open(path, "a") as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+@dataclass(frozen=True)
+class CatalogSnapshot:
+    """Immutable view of the catalog; reloads build a new one and swap the reference"""
+    products: ProductStore
+    text_digests: np.ndarray  # uint64 digest of each product's embedding text
+    product_rows: Dict[int, int]  # a dict, or a memory-mapped SortedIndex from prebuilt artifacts
+    item_rows: Dict[str, int]
+    embeddings: Optional[np.ndarray] = None  # L2-normalised, one row per product
+    index: Optional[object] = None  # vector_index.ExactIndex / IVFFlatIndex over embeddings
+    lexical: Optional[LexicalIndex] = None  # BM25 postings over names, categories and variants
+
+    @classmethod
+    def build(cls, products: ProductStore, text_digests: np.ndarray,
+              embeddings: Optional[np.ndarray] = None) -> "CatalogSnapshot":
+        product_rows = {}
+        for row, pid in enumerate(products.ids):
+            if pid != -1:
+                product_rows[int(pid)] = row
+        item_rows = {}
+        strings = products.strings
+        for row in range(len(products)):
+            for item_row in range(products.item_offsets[row], products.item_offsets[row + 1]):
+                item_id = strings[products.item_ids[item_row]]
+                if item_id:
+                    item_rows[item_id] = row
+        return cls(products, text_digests, product_rows, item_rows, embeddings,
+                   lexical=LexicalIndex.build(products))
+
+    def diff(self, new: "CatalogSnapshot") -> Dict[str, int]:
+        """
+        Products added, removed and changed in new, by id, straight from the
+        id and digest columns; changed means the embedded text differs
+        """
+        old_ids = np.asarray(self.products.ids, dtype=np.int64)
+        new_ids = np.asarray(new.products.ids, dtype=np.int64)
+        old_keep, new_keep = old_ids != -1, new_ids != -1
+        old_ids, new_ids = old_ids[old_keep], new_ids[new_keep]
+        _, old_rows, new_rows = np.intersect1d(old_ids, new_ids, return_indices=True)
+        changed = self.text_digests[old_keep][old_rows] != new.text_digests[new_keep][new_rows]
+        return {
+            "added": int(np.count_nonzero(~np.isin(new_ids, old_ids))),
+            "removed": int(np.count_nonzero(~np.isin(old_ids, new_ids))),
+            "changed": int(np.count_nonzero(changed))
+        }
+
+
+class ProductRAGWithEmbeddings:
+    """Proper RAG system using embeddings and cosine similarity"""
+    
+    QUERY_CACHE_SIZE = 256
+
+    def __init__(self, products_json_path: str = "rproducts.json",
+                 embeddings_cache_prefix: Optional[str] = None, embedder=None,
+                 inventory: Optional[InventoryService] = None,
+                 search_client: Optional[SearchSidecarClient] = None):
+        self.products_json_path = products_json_path
+        # Stock levels for the in-stock filter; the process-wide service unless one is given
+        self.inventory = inventory or stock
+        # Vector search in the sidecar process (see search_sidecar.py); None searches in-process
+        self.search_client = search_client
+        # Gemini API, local ONNX model or hashed n-grams, per the EMBEDDER setting; the sidecar's with a client
+        self.embedder = embedder or search_client or create_embedder()
+        # Cached matrices are named <prefix>.<fingerprint>.npy, so a file never changes once written
+        self.embeddings_cache_prefix = embeddings_cache_prefix or os.path.splitext(products_json_path)[0] + ".embeddings"
+        self.index_cache_path = os.path.splitext(products_json_path)[0] + ".index.npz"
+        # Quantised / bucket-ordered index arrays, mapped read-only by every worker on the host
+        self.index_store_prefix = os.path.splitext(products_json_path)[0] + ".index"
+        self._lock_path = self.embeddings_cache_prefix + ".lock"
+        # Similar / bought-together tables written by `python -m related_items`; None until one has run
+        self.related_items_path = os.path.splitext(products_json_path)[0] + ".related.npz"
+        self._snapshot = self._load_snapshot(products_json_path)
+        self.related = self._load_related(self._snapshot)
+        # Serialises writers (warm-up, reloads); readers only ever dereference self._snapshot once
+        self._write_lock = threading.Lock()
+        self._query_cache: "OrderedDict[str, np.ndarray]" = OrderedDict()
+        self._query_cache_lock = threading.Lock()
+    
+    @property
+    def products(self) -> List[Dict]:
+        return self._snapshot.products
+    
+    @property
+    def product_embeddings(self) -> Optional[np.ndarray]:
+        return self._snapshot.embeddings
+    
+    @property
+    def embeddings_generated(self) -> bool:
+        if self.search_client is not None:
+            return self.search_client.ready
+        return self._snapshot.embeddings is not None
+    
+    def get_product(self, product_id: int) -> Optional[Dict]:
+        """O(1) lookup by product id"""
+        snapshot = self._snapshot
+        row = snapshot.product_rows.get(product_id)
+        return snapshot.products[row] if row is not None else None
+    
+    def find_variant(self, item_id: str) -> Optional[Tuple[Product, Variant]]:
+        """O(1) lookup of a variant by item_id, with its parent product"""
+        snapshot = self._snapshot
+        row = snapshot.item_rows.get(item_id)
+        if row is None:
+            return None
+        product = snapshot.products.model(row)
+        return product, product.variant(item_id)
+        
+    def _load_products(self, path: str) -> ProductStore:
+        """Stream products from a JSON or JSON Lines file into a columnar store"""
+        try:
+            return load_product_store(path)
+        except FileNotFoundError:
+            print(f"Warning: {path} not found. Using empty product list.")
+            return ProductStore()
+    
+    def _load_snapshot(self, path: str) -> CatalogSnapshot:
+        """
+        Catalog snapshot (without embeddings) from the artifacts built by
+        `python -m catalog_import`, memory-mapped, when they match the file;
+        otherwise parse and index the file.
+        """
+        try:
+            prebuilt = catalog_artifacts.load(catalog_artifacts.artifacts_dir(path),
+                                              catalog_artifacts.catalog_signature(path))
+        except OSError:
+            prebuilt = None
+        if prebuilt is not None:
+            products, digests, lexical, product_rows, item_rows = prebuilt
+            print(f"✓ Mapped prebuilt catalog artifacts: {len(products)} products")
+            return CatalogSnapshot(products, digests, product_rows, item_rows, lexical=lexical)
+        products = self._load_products(path)
+        return CatalogSnapshot.build(products, text_digests(products))
+    
+    def _prepare_product_text(self, product: Dict) -> str:
+        return product_text(product)
+
+    
+    @staticmethod
+    def _normalize(matrix: np.ndarray) -> np.ndarray:
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return (matrix / norms).astype(np.float32)
+    
+    def _build_index(self, embeddings: np.ndarray, text_digests: np.ndarray, previous=None):
+        """Build the configured vector index; an existing IVF layout is re-bucketed, not retrained"""
+        fingerprint = self._catalog_fingerprint(text_digests)
+        store_path = f"{self.index_store_prefix}.{fingerprint[:16]}"
+        if previous is not None and previous.kind == vector_index.choose_kind(len(embeddings)):
+            index = previous.with_vectors(embeddings, store_path)
+            try:
+                index.save(self.index_cache_path, fingerprint)
+            except OSError as e:
+                print(f"⚠ Could not persist vector index: {e}")
+        else:
+            index = vector_index.build_index(embeddings, cache_path=self.index_cache_path,
+                                             fingerprint=fingerprint, store_path=store_path)
+        # Arrays of older catalogs; processes still searching them keep their mapping
+        for stale in glob.glob(f"{glob.escape(self.index_store_prefix)}.*.npy"):
+            if not stale.startswith(store_path + "."):
+                try:
+                    os.remove(stale)
+                except OSError:
+                    pass
+        return index
+    
+    def _catalog_fingerprint(self, text_digests: np.ndarray) -> str:
+        """Hash of the embedded text for every product; invalidates the on-disk cache on change"""
+        digest = hashlib.sha256(self.embedder.name.encode())
+        digest.update(text_digests.astype("<u8").tobytes())
+        return digest.hexdigest()
+    
+    def _embeddings_cache_file(self, text_digests: np.ndarray) -> str:
+        return f"{self.embeddings_cache_prefix}.{self._catalog_fingerprint(text_digests)[:16]}.npy"
+    
+    def _load_cached_embeddings(self, text_digests: np.ndarray) -> Optional[np.ndarray]:
+        """Memory-map embeddings persisted for exactly this catalog, if present"""
+        try:
+            embeddings = np.load(self._embeddings_cache_file(text_digests), mmap_mode='r')
+        except (FileNotFoundError, ValueError, OSError):
+            return None
+        
+        if embeddings.shape[0] != len(text_digests) or embeddings.dtype != np.float32:
+            return None
+        return embeddings
+    
+    def _save_cached_embeddings(self, embeddings: np.ndarray, text_digests: np.ndarray) -> np.ndarray:
+        """
+        Persist embeddings and return a read-only memory map of them, so the
+        float32 rows live in the page cache rather than on the heap.
+        """
+        path = self._embeddings_cache_file(text_digests)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        try:
+            with open(tmp_path, 'wb') as f:
+                np.save(f, embeddings)
+            os.replace(tmp_path, path)
+            # Older fingerprints are unlinked; live snapshots keep their mapping to the old inode
+            for stale in glob.glob(f"{glob.escape(self.embeddings_cache_prefix)}.*.npy"):
+                if stale != path:
+                    os.remove(stale)
+            return np.load(path, mmap_mode='r')
+        except OSError as e:
+            print(f"⚠ Could not persist embeddings cache: {e}")
+            return embeddings
+    
+    def _embed_documents(self, products: ProductStore, rows: List[int]) -> np.ndarray:
+        """Embed the given product rows in batches; returns L2-normalised rows"""
+        embeddings_list = []
+        # Indexing yields the embedding quota to interactive query embeddings
+        with metrics.span("embedding_generation"), scheduler.request_class(priority=scheduler.BACKGROUND):
+            for start in range(0, len(rows), EMBEDDING_BATCH_SIZE):
+                batch = rows[start:start + EMBEDDING_BATCH_SIZE]
+                embeddings_list.extend(self.embedder.embed_documents(
+                    [self._prepare_product_text(products[row]) for row in batch]
+                ))
+                print(f"  Progress: {len(embeddings_list)}/{len(rows)} products")
+        return self._normalize(np.array(embeddings_list))
+    
+    def generate_embeddings(self):
+        """
+        ONE-TIME PREPROCESSING: Generate embeddings for all products
+        Reuses the on-disk cache when the catalog is unchanged
+        """
+        if self.search_client is not None:
+            print(f"✓ Vector search is served by the sidecar at {self.search_client.path}")
+            return
+        with self._write_lock, _host_lock(self._lock_path):
+            snapshot = self._snapshot
+            if snapshot.embeddings is not None:
+                print("✓ Embeddings already generated")
+                return
+            
+            if not snapshot.products:
+                print("⚠ No products to embed")
+                return
+            
+            embeddings = self._load_cached_embeddings(snapshot.text_digests)
+            if embeddings is not None:
+                print(f"✓ Loaded cached embeddings: {embeddings.shape}")
+                fresh = False
+            else:
+                print(f"🔄 Generating embeddings for {len(snapshot.products)} products...")
+                embeddings = self._embed_documents(snapshot.products, list(range(len(snapshot.products))))
+                fresh = True
+            
+            if fresh:
+                embeddings = self._save_cached_embeddings(embeddings, snapshot.text_digests)
+                print(f"✓ Embeddings generated: {embeddings.shape}")
+            index = self._build_index(embeddings, snapshot.text_digests)
+            self._snapshot = replace(snapshot, embeddings=embeddings, index=index)
+            print(f"✓ Vector index ready: {index.kind} over {len(index)} products")
+    
+    def _load_related(self, snapshot: CatalogSnapshot) -> Optional[RelatedItems]:
+        """Related-items tables cut down to the snapshot's products, so a removed product is never suggested"""
+        related = RelatedItems.load(self.related_items_path)
+        return related.restricted(snapshot.products.ids) if related is not None else None
+    
+    def reload_catalog(self, path: Optional[str] = None) -> Dict[str, int]:
+        """
+        Reload the catalog file and swap it in atomically.
+        Only products whose embedded text changed are re-embedded; in-flight
+        searches keep using the snapshot they started with.
+        """
+        path = path or self.products_json_path
+        loaded = self._load_snapshot(path)
+        new_products, new_digests = loaded.products, loaded.text_digests
+        
+        with self._write_lock:
+            old = self._snapshot
+            stats = dict(old.diff(loaded), reembedded=0, total=len(new_products))
+            
+            embeddings = None
+            if old.embeddings is not None and new_products:
+                with _host_lock(self._lock_path):
+                    embeddings = self._reembed(old, new_products, new_digests, stats)
+            
+            snapshot = replace(loaded, embeddings=embeddings)
+            if embeddings is not None:
+                snapshot = replace(snapshot, index=self._build_index(embeddings, new_digests, old.index))
+            self._snapshot = snapshot
+            self.products_json_path = path
+            self.related = self._load_related(snapshot)
+        
+        if self.search_client is not None:
+            try:
+                self.search_client.reload(path)
+            except SidecarUnavailable as e:
+                print(f"⚠ Search sidecar did not reload the catalog: {e}")
+        print(f"✓ Catalog reloaded: {stats}")
+        return stats
+    
+    def _reembed(self, old: CatalogSnapshot, new_products: ProductStore, new_digests: np.ndarray,
+                 stats: Dict[str, int]) -> np.ndarray:
+        """Embeddings for the new catalog: another worker's cached matrix, else old rows plus the changed ones"""
+        cached = self._load_cached_embeddings(new_digests)
+        if cached is not None:
+            return cached
+        # Embeddings depend only on the product text, so reuse any row whose text survived
+        old_rows = {int(d): row for row, d in enumerate(old.text_digests)}
+        source = np.array([old_rows.get(int(d), -1) for d in new_digests], dtype=np.int64)
+        kept = np.flatnonzero(source >= 0)
+        missing = np.flatnonzero(source < 0).tolist()
+        embeddings = np.empty((len(new_products), old.embeddings.shape[1]), dtype=np.float32)
+        embeddings[kept] = old.embeddings[source[kept]]
+        if missing:
+            print(f"🔄 Re-embedding {len(missing)} changed products...")
+            embeddings[missing] = self._embed_documents(new_products, missing)
+        stats["reembedded"] = len(missing)
+        return self._save_cached_embeddings(embeddings, new_digests)
+    
+    def _embed_query(self, query: str) -> np.ndarray:
+        """Embed a search query, reusing recent results from a small LRU cache"""
+        key = query.strip().lower()
+        with self._query_cache_lock:
+            cached = self._query_cache.get(key)
+            if cached is not None:
+                self._query_cache.move_to_end(key)
+        metrics.record_cache("query_embedding", cached is not None)
+        if cached is not None:
+            return cached
+        
+        with metrics.span("query_embedding"):
+            query_embedding = self.embedder.embed_query(query)
+        
+        with self._query_cache_lock:
+            self._query_cache[key] = query_embedding
+            if len(self._query_cache) > self.QUERY_CACHE_SIZE:
+                self._query_cache.popitem(last=False)
+        return query_embedding
+    
+    def cosine_similarity(self, vec1: np.ndarray, vec2: np.ndarray) -> float:
+        """Calculate cosine similarity between two vectors"""
+        dot_product = np.dot(vec1, vec2)
+        magnitude1 = np.linalg.norm(vec1)
+        magnitude2 = np.linalg.norm(vec2)
+        
+        if magnitude1 == 0 or magnitude2 == 0:
+            return 0.0
+        
+        return dot_product / (magnitude1 * magnitude2)
+    
+    def _vector_rows(self, snapshot: CatalogSnapshot, query: str, top_k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Rows and cosine scores from the snapshot's vector index"""
+        query_embedding = self._embed_query(query)
+        
+        with metrics.span("similarity_search"):
+            norm = np.linalg.norm(query_embedding)
+            query_vector = (query_embedding / norm if norm else query_embedding).astype(np.float32)
+            return snapshot.index.search(query_vector, top_k)
+    
+    def _lexical_rows(self, snapshot: CatalogSnapshot, query: str, top_k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Rows and BM25 scores from the snapshot's inverted index"""
+        with metrics.span("keyword_search"):
+            return snapshot.lexical.search(query, top_k)
+    
+    def _row_in_stock(self, snapshot: CatalogSnapshot, row: int) -> bool:
+        """True if any variant of the product at row can still be reserved (untracked variants can)"""
+        products = snapshot.products
+        strings = products.strings
+        item_rows = range(products.item_offsets[row], products.item_offsets[row + 1])
+        return not item_rows or any(self.inventory.in_stock(strings[products.item_ids[i]] or "") for i in item_rows)
+    
+    def mean_embedding(self, product_ids: List[int]) -> Optional[np.ndarray]:
+        """Normalised mean of the products' embeddings; None before warm-up or for unknown ids"""
+        if self.search_client is not None:
+            try:
+                return self.search_client.mean_embedding(product_ids)
+            except SidecarUnavailable:
+                return None
+        snapshot = self._snapshot
+        if snapshot.embeddings is None:
+            return None
+        rows = [snapshot.product_rows[pid] for pid in product_ids if pid in snapshot.product_rows]
+        if not rows:
+            return None
+        mean = np.asarray(snapshot.embeddings[rows], dtype=np.float32).mean(axis=0)
+        norm = np.linalg.norm(mean)
+        return mean / norm if norm else None
+    
+    def _personal_rerank(self, snapshot: CatalogSnapshot, ranked: List[Tuple[int, float]],
+                         preference: np.ndarray) -> List[Tuple[int, float]]:
+        """Min-max normalised retrieval score plus PREFERENCE_WEIGHT x cosine affinity to the user's profile"""
+        if not ranked:
+            return ranked
+        rows = np.array([int(row) for row, _ in ranked], dtype=np.int64)
+        base = np.array([score for _, score in ranked], dtype=np.float32)
+        spread = base.max() - base.min()
+        base = (base - base.min()) / spread if spread > 0 else np.ones_like(base)
+        affinity = np.asarray(snapshot.embeddings[rows], dtype=np.float32) @ preference
+        final = base + PREFERENCE_WEIGHT * affinity
+        order = np.argsort(-final, kind="stable")
+        return [(int(rows[i]), float(final[i])) for i in order]
+    
+    def _local_rows(self, snapshot: CatalogSnapshot, query: str, top_k: int, mode: str) -> List[Tuple[int, float]]:
+        """Ranked rows from this process's lexical and vector indexes"""
+        if mode == "lexical":
+            rows, scores = self._lexical_rows(snapshot, query, top_k)
+        elif mode == "vector":
+            rows, scores = self._vector_rows(snapshot, query, top_k)
+        else:
+            candidates = top_k * HYBRID_CANDIDATES
+            lexical_rows, _ = self._lexical_rows(snapshot, query, candidates)
+            try:
+                vector_rows, _ = self._vector_rows(snapshot, query, candidates)
+            except Exception as e:
+                print(f"⚠ Query embedding failed, using lexical results only: {e}")
+                vector_rows = np.empty(0, dtype=np.int64)
+            with metrics.span("rank_fusion"):
+                fused = reciprocal_rank_fusion([lexical_rows, vector_rows], top_k)
+            rows = [row for row, _ in fused]
+            scores = [score for _, score in fused]
+        return list(zip(rows, scores))
+    
+    def _remote_rows(self, snapshot: CatalogSnapshot, query: str, top_k: int, mode: str,
+                     preference: Optional[np.ndarray]) -> List[Tuple[int, float]]:
+        """Ranked rows from the sidecar, which returns product ids (the catalogs match after a reload)"""
+        with metrics.span("sidecar_search"):
+            ids, scores = self.search_client.search(query, top_k, mode, preference)
+        return [(snapshot.product_rows[pid], score) for pid, score in zip(ids, scores)
+                if pid in snapshot.product_rows]
+    
+    def _ranked_rows(self, snapshot: CatalogSnapshot, query: str, top_k: int,
+                     mode: Optional[str] = None, in_stock_only: bool = False,
+                     preference: Optional[np.ndarray] = None) -> List[Tuple[int, float]]:
+        """
+        Rank catalog rows for a query. Hybrid mode fuses the lexical and
+        vector candidate lists with reciprocal rank fusion, so exact SKU or
+        variant names surface even when the embedding misses them.
+        in_stock_only and a preference vector both rank extra candidates,
+        then drop sold-out products and re-rank by affinity before the cut.
+        """
+        in_stock_only = in_stock_only and self.inventory.tracking
+        personalize = (preference is not None and snapshot.embeddings is not None
+                       and len(preference) == snapshot.embeddings.shape[1])
+        final_k = top_k
+        if in_stock_only or personalize:
+            top_k *= HYBRID_CANDIDATES
+        mode = mode or RETRIEVAL_MODE
+        
+        ranked = None
+        if self.search_client is not None and mode != "lexical":
+            # The sidecar holds the vectors, so it also applies the preference re-rank
+            try:
+                ranked = self._remote_rows(snapshot, query, top_k, mode, preference)
+            except SidecarUnavailable as e:
+                print(f"⚠ Search sidecar unavailable, using keyword search: {e}")
+                metrics.record_degraded("search_sidecar")
+                mode = "lexical"
+        elif snapshot.embeddings is None and mode != "lexical":
+            print("⚠ Embeddings not generated yet! Using fallback search.")
+            mode = "lexical"
+        
+        if ranked is None:
+            ranked = self._local_rows(snapshot, query, top_k, mode)
+        
+        if in_stock_only:
+            with metrics.span("stock_filter"):
+                ranked = [(row, score) for row, score in ranked if self._row_in_stock(snapshot, int(row))]
+        if personalize:
+            with metrics.span("personal_rerank"):
+                ranked = self._personal_rerank(snapshot, ranked, preference)
+        return [(int(row), float(score)) for row, score in ranked[:final_k]]
+    
+    def _rank(self, snapshot: CatalogSnapshot, query: str, top_k: int,
+              mode: Optional[str] = None, in_stock_only: bool = False,
+              preference: Optional[np.ndarray] = None) -> List[Tuple[Dict, float]]:
+        """Ranked products and scores (see _ranked_rows)"""
+        return [(snapshot.products[row], score)
+                for row, score in self._ranked_rows(snapshot, query, top_k, mode, in_stock_only, preference)]
+    
+    def search_products(self, query: str, top_k: int = 5, in_stock_only: bool = False,
+                        preference: Optional[np.ndarray] = None) -> List[Dict]:
+        """
+        Search products with the configured retriever (hybrid by default)
+        Returns: List of relevant products (without scores for backward compatibility)
+        """
+        return [product for product, score in self.search_products_with_scores(
+            query, top_k, in_stock_only=in_stock_only, preference=preference
+        )]
+    
+    def search_products_with_scores(self, query: str, top_k: int = 5, mode: Optional[str] = None,
+                                    in_stock_only: bool = False,
+                                    preference: Optional[np.ndarray] = None) -> List[Tuple[Dict, float]]:
+        """
+        Search products and return with scores (RRF, cosine or BM25 depending on mode)
+        Useful for debugging or showing confidence
+        """
+        snapshot = self._snapshot
+        if not snapshot.products:
+            return []
+        
+        return self._rank(snapshot, query, top_k, mode, in_stock_only, preference)
+    
+    def _keyword_search(self, query: str, top_k: int = 5,
+                        snapshot: Optional[CatalogSnapshot] = None) -> List[Dict]:
+        """Fallback keyword-based search if embeddings fail"""
+        snapshot = snapshot or self._snapshot
+        rows, _ = self._lexical_rows(snapshot, query, top_k)
+        return [snapshot.products[int(i)] for i in rows]
+    
+    def _format_products_for_context(self, products: List[Dict]) -> str:
+        """Format products for LLM context"""
+        formatted = []
+        for i, p in enumerate(products, 1):
+            name = p.get('name') or p.get('title') or p.get('product_name', 'Unknown')
+            price = p.get('price') or p.get('cost', 'N/A')
+            category = p.get('category') or p.get('type', 'General')
+            description = p.get('description', '')[:100]
+            product_id = p.get('id', 'N/A')
+            variants = ", ".join(
+                f"{item.get('item_id')} {item.get('variant', '')} {item.get('price')}" for item in p.get('items') or []
+            )
+            
+            formatted.append(
+                f"{i}. {name} (ID: {product_id}) | Category: {category} | Price: {price} | {description}"
+                + (f" | Variants (item_id name price): {variants}" if variants else "")
+            )
+        return "\n".join(formatted)
@@ -0,0 +1,234 @@
+"""
+Precomputed cross-sell tables: the top-N most similar products (from the
+embedding matrix) and the top-N products found in the same carts and
+recommendation lists (from saved sessions). Lookups at chat time are
+array reads.
+Build from app/: python -m related_items [--sessions sessions.jsonl] [--top-n 10]
+"""
+import os
+import sys
+import json
+import math
+import heapq
+import argparse
+from collections import defaultdict
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+RELATED_TOP_N = int(os.getenv("RELATED_TOP_N", "10"))
+# Weighted co-occurrences a pair needs before it counts as bought together
+CO_OCCURRENCE_MIN_SUPPORT = float(os.getenv("CO_OCCURRENCE_MIN_SUPPORT", "2"))
+# A recommendation shown in a session counts for less than an item put in the cart
+RECOMMENDATION_WEIGHT = 0.5
+MAX_BASKET_SIZE = 50
+# Memory for one block of the similarity matrix (rows x catalog size float32); sets the rows per block
+SIMILARITY_BLOCK_MB = float(os.getenv("SIMILARITY_BLOCK_MB", "64"))
+NO_NEIGHBOUR = -1
+
+
+def similarity_table(embeddings: np.ndarray, product_ids: np.ndarray,
+                     top_n: int = RELATED_TOP_N) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Top-n cosine neighbours per row of L2-normalised embeddings, computed
+    in blocks of rows sized so one block of scores fits SIMILARITY_BLOCK_MB
+    """
+    n = len(product_ids)
+    k = min(top_n, max(n - 1, 0))
+    neighbours = np.full((n, top_n), NO_NEIGHBOUR, dtype=np.int64)
+    scores = np.zeros((n, top_n), dtype=np.float16)
+    if k == 0:
+        return neighbours, scores
+    matrix = np.asarray(embeddings, dtype=np.float32)
+    block_rows = max(1, int(SIMILARITY_BLOCK_MB * 1024 * 1024) // (4 * n))
+    for start in range(0, n, block_rows):
+        block = matrix[start:start + block_rows]
+        sims = block @ matrix.T
+        sims[np.arange(len(block)), np.arange(start, start + len(block))] = -np.inf  # not its own neighbour
+        top = np.argpartition(-sims, k - 1, axis=1)[:, :k]
+        top_scores = np.take_along_axis(sims, top, axis=1)
+        order = np.argsort(-top_scores, axis=1)
+        top = np.take_along_axis(top, order, axis=1)
+        neighbours[start:start + len(block), :k] = product_ids[top]
+        scores[start:start + len(block), :k] = np.take_along_axis(top_scores, order, axis=1)
+    return neighbours, scores
+
+
+def session_baskets(docs: Iterable[Dict], name_to_id: Dict[str, int]) -> Iterator[Dict[int, float]]:
+    """One {product_id: weight} basket per saved session: cart lines, then recommended product names"""
+    for doc in docs:
+        data = doc.get("session_data", doc)
+        basket: Dict[int, float] = {}
+        for line in data.get("recommendations_given") or []:
+            pid = name_to_id.get(str(line).strip().lower())
+            if pid is not None:
+                basket[pid] = RECOMMENDATION_WEIGHT
+        for line in data.get("cart_items") or []:
+            pid = line.get("product_id") if isinstance(line, dict) else name_to_id.get(str(line).strip().lower())
+            if pid is not None:
+                basket[int(pid)] = 1.0
+        if len(basket) > 1:
+            yield dict(list(basket.items())[:MAX_BASKET_SIZE])
+
+
+def co_occurrence_table(baskets: Iterable[Dict[int, float]], product_ids: np.ndarray,
+                        top_n: int = RELATED_TOP_N,
+                        min_support: float = CO_OCCURRENCE_MIN_SUPPORT) -> Tuple[np.ndarray, np.ndarray]:
+    """Top-n products sharing baskets with each product, scored by cosine-normalised co-occurrence"""
+    pair_counts: Dict[int, Dict[int, float]] = defaultdict(lambda: defaultdict(float))
+    item_counts: Dict[int, float] = defaultdict(float)
+    for basket in baskets:
+        items = list(basket.items())
+        for pid, weight in items:
+            item_counts[pid] += weight
+        for i, (a, wa) in enumerate(items):
+            for b, wb in items[i + 1:]:
+                weight = min(wa, wb)
+                pair_counts[a][b] += weight
+                pair_counts[b][a] += weight
+
+    neighbours = np.full((len(product_ids), top_n), NO_NEIGHBOUR, dtype=np.int64)
+    scores = np.zeros((len(product_ids), top_n), dtype=np.float16)
+    for row, pid in enumerate(product_ids.tolist()):
+        partners = pair_counts.get(pid)
+        if not partners:
+            continue
+        ranked = heapq.nlargest(top_n, (
+            (count / math.sqrt(item_counts[pid] * item_counts[other]), other)
+            for other, count in partners.items() if count >= min_support
+        ))
+        for col, (score, other) in enumerate(ranked):
+            neighbours[row, col] = other
+            scores[row, col] = score
+    return neighbours, scores
+
+
+class RelatedItems:
+    """Neighbour tables keyed by product id (rows sorted by id, so a lookup is one searchsorted)"""
+
+    def __init__(self, product_ids: np.ndarray, similar: np.ndarray, similar_scores: np.ndarray,
+                 together: np.ndarray, together_scores: np.ndarray):
+        order = np.argsort(product_ids, kind="stable")
+        self.product_ids = product_ids[order]
+        self.similar_ids = similar[order]
+        self.similar_scores = similar_scores[order]
+        self.together_ids = together[order]
+        self.together_scores = together_scores[order]
+
+    def __len__(self) -> int:
+        return len(self.product_ids)
+
+    def _row(self, product_id: int) -> Optional[int]:
+        row = int(np.searchsorted(self.product_ids, product_id))
+        if row < len(self.product_ids) and self.product_ids[row] == product_id:
+            return row
+        return None
+
+    @staticmethod
+    def _ids(table: np.ndarray, row: Optional[int], k: int) -> List[int]:
+        if row is None:
+            return []
+        neighbours = table[row]
+        return [int(pid) for pid in neighbours[neighbours != NO_NEIGHBOUR][:k]]
+
+    def similar(self, product_id: int, k: int = RELATED_TOP_N) -> List[int]:
+        return self._ids(self.similar_ids, self._row(product_id), k)
+
+    def bought_together(self, product_id: int, k: int = RELATED_TOP_N) -> List[int]:
+        return self._ids(self.together_ids, self._row(product_id), k)
+
+    @staticmethod
+    def _keep(ids: np.ndarray, scores: np.ndarray, live: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """Neighbour lists with dead product ids removed, survivors moved left in their ranked order"""
+        dead = ~np.isin(ids, live)
+        order = np.argsort(dead, axis=1, kind="stable")
+        ids = np.take_along_axis(ids, order, axis=1)
+        scores = np.take_along_axis(scores, order, axis=1)
+        dead = np.take_along_axis(dead, order, axis=1)
+        ids[dead] = NO_NEIGHBOUR
+        scores[dead] = 0
+        return ids, scores
+
+    def restricted(self, product_ids: np.ndarray) -> "RelatedItems":
+        """Tables limited to the given catalog: no rows for, and no neighbours pointing at, removed products"""
+        live = np.unique(product_ids)
+        rows = np.isin(self.product_ids, live)
+        similar, similar_scores = self._keep(self.similar_ids[rows], self.similar_scores[rows], live)
+        together, together_scores = self._keep(self.together_ids[rows], self.together_scores[rows], live)
+        return RelatedItems(self.product_ids[rows], similar, similar_scores, together, together_scores)
+
+    def save(self, path: str):
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            np.savez(f, product_ids=self.product_ids, similar=self.similar_ids,
+                     similar_scores=self.similar_scores, together=self.together_ids,
+                     together_scores=self.together_scores)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str) -> Optional["RelatedItems"]:
+        """Tables from a build, or None if none has been run"""
+        try:
+            with np.load(path) as saved:
+                return cls(saved["product_ids"], saved["similar"], saved["similar_scores"],
+                           saved["together"], saved["together_scores"])
+        except (FileNotFoundError, KeyError, ValueError, OSError):
+            return None
+
+
+def build(rag, session_docs: Iterable[Dict], top_n: int = RELATED_TOP_N) -> RelatedItems:
+    """Tables for the catalog loaded in rag (a ProductRAGWithEmbeddings) and the given session documents"""
+    rag.generate_embeddings()
+    snapshot = rag._snapshot
+    store = snapshot.products
+    rows = np.array([row for row, pid in enumerate(store.ids) if pid != -1], dtype=np.int64)
+    product_ids = np.array([store.ids[row] for row in rows], dtype=np.int64)
+
+    if snapshot.embeddings is not None:
+        similar, similar_scores = similarity_table(snapshot.embeddings[rows], product_ids, top_n)
+    else:
+        similar = np.full((len(rows), top_n), NO_NEIGHBOUR, dtype=np.int64)
+        similar_scores = np.zeros((len(rows), top_n), dtype=np.float16)
+
+    name_to_id = {store.strings[store.names[row]].lower(): int(store.ids[row])
+                  for row in rows if store.strings[store.names[row]]}
+    together, together_scores = co_occurrence_table(session_baskets(session_docs, name_to_id), product_ids, top_n)
+    return RelatedItems(product_ids, similar, similar_scores, together, together_scores)
+
+
+def _session_docs(path: Optional[str]) -> Iterator[Dict]:
+    """Saved sessions from a JSON Lines export, or straight from the sessions collection"""
+    if path:
+        with open(path) as f:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+        return
+    from pymongo import MongoClient
+    from auth import MONGODB_URL, DATABASE_NAME
+    client = MongoClient(MONGODB_URL)
+    try:
+        yield from client[DATABASE_NAME]["sessions"].find({}, {"session_data.cart_items": 1,
+                                                             "session_data.recommendations_given": 1})
+    finally:
+        client.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--catalog", default="rproducts.json")
+    parser.add_argument("--sessions", help="JSON Lines export of session documents (default: read Mongo)")
+    parser.add_argument("--top-n", type=int, default=RELATED_TOP_N)
+    args = parser.parse_args()
+
+    from product_rag import ProductRAGWithEmbeddings
+    rag = ProductRAGWithEmbeddings(args.catalog)
+    try:
+        related = build(rag, _session_docs(args.sessions), args.top_n)
+    except Exception as e:
+        print(f"⚠ Related-items build failed: {e}")
+        sys.exit(1)
+    related.save(rag.related_items_path)
+    with_partners = int((related.together_ids[:, 0] != NO_NEIGHBOUR).sum())
+    print(f"✓ Wrote {rag.related_items_path}: {len(related)} products, "
+          f"{with_partners} with bought-together partners")
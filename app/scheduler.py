@@ -0,0 +1,239 @@
+"""
+Process-wide token-bucket scheduler for Gemini calls: request and token
+quotas, priority classes, and round-robin fairness between users.
+"""
+import os
+import time
+import threading
+import contextvars
+from collections import deque, OrderedDict
+from contextlib import contextmanager
+from typing import Callable, Dict, Optional
+
+import metrics
+
+# Priority classes; lower runs first
+INTERACTIVE = 0
+BACKGROUND = 1
+
+# Per-minute limits for the shared API key; 0 disables a limit
+LLM_RPM = float(os.getenv("LLM_RPM", "0"))
+LLM_TPM = float(os.getenv("LLM_TPM", "0"))
+EMBED_RPM = float(os.getenv("EMBED_RPM", "0"))
+# Seconds of quota that may be spent at once
+QUOTA_BURST_SECONDS = float(os.getenv("QUOTA_BURST_SECONDS", "5"))
+# Tokens charged up front for a request whose size is unknown; settled against usage_metadata
+DEFAULT_TOKEN_ESTIMATE = 1024
+RATE_LIMIT_BACKOFF = float(os.getenv("RATE_LIMIT_BACKOFF", "1.0"))
+
+_current_user: contextvars.ContextVar[str] = contextvars.ContextVar("scheduler_user", default="anonymous")
+_current_priority: contextvars.ContextVar[int] = contextvars.ContextVar("scheduler_priority", default=INTERACTIVE)
+
+
+class QuotaExceeded(Exception):
+    """No quota became available before the caller's deadline"""
+
+
+@contextmanager
+def request_class(user: Optional[str] = None, priority: Optional[int] = None):
+    """Attribute calls made inside the block (and in to_thread workers it spawns) to a user and priority"""
+    tokens = []
+    if user is not None:
+        tokens.append((_current_user, _current_user.set(user)))
+    if priority is not None:
+        tokens.append((_current_priority, _current_priority.set(priority)))
+    try:
+        yield
+    finally:
+        for var, token in reversed(tokens):
+            var.reset(token)
+
+
+def is_rate_limit_error(error: Exception) -> bool:
+    """429 / RESOURCE_EXHAUSTED from the Gemini client"""
+    return (type(error).__name__ in ("ResourceExhausted", "TooManyRequests")
+            or getattr(error, "code", None) == 429)
+
+
+class TokenBucket:
+    """Refills continuously at rate per second up to capacity; may go into debt when settling"""
+
+    def __init__(self, per_minute: float, burst_seconds: float = QUOTA_BURST_SECONDS):
+        self.rate = per_minute / 60.0
+        self.capacity = max(1.0, self.rate * burst_seconds)
+        self.level = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float):
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount: float, now: float) -> float:
+        """Seconds until amount is available (amount is capped at capacity so huge requests still run)"""
+        self._refill(now)
+        needed = min(amount, self.capacity) - self.level
+        return 0.0 if needed <= 0 else needed / self.rate
+
+    def take(self, amount: float):
+        self.level -= amount
+
+
+class _Waiter:
+    __slots__ = ("user", "priority", "tokens")
+
+    def __init__(self, user: str, priority: int, tokens: float):
+        self.user = user
+        self.priority = priority
+        self.tokens = tokens
+
+
+class QuotaScheduler:
+    """
+    Callers block in acquire() until their turn. The next request is the
+    oldest one of the user at the front of a round-robin rotation, within
+    the highest priority class that has waiters; it goes once both the
+    request and the token bucket can cover it.
+    """
+
+    def __init__(self, name: str, requests_per_minute: float = 0, tokens_per_minute: float = 0):
+        self.name = name
+        self.requests = TokenBucket(requests_per_minute) if requests_per_minute else None
+        self.tokens = TokenBucket(tokens_per_minute) if tokens_per_minute else None
+        # Set by backoff() after an upstream 429; nothing is admitted before it
+        self.paused_until = 0.0
+        self._cond = threading.Condition()
+        # priority -> user -> FIFO of waiters; the OrderedDict order is the round-robin rotation
+        self._queues: Dict[int, "OrderedDict[str, deque]"] = {}
+
+    @property
+    def enabled(self) -> bool:
+        return self.requests is not None or self.tokens is not None
+
+    def _head(self) -> Optional[_Waiter]:
+        for priority in sorted(self._queues):
+            users = self._queues[priority]
+            if users:
+                return users[next(iter(users))][0]
+        return None
+
+    def _pop(self, waiter: _Waiter):
+        users = self._queues[waiter.priority]
+        queue = users.pop(waiter.user)
+        queue.popleft()
+        if queue:
+            users[waiter.user] = queue  # re-inserted at the back: the next user goes first
+        if not users:
+            del self._queues[waiter.priority]
+
+    def _remove(self, waiter: _Waiter):
+        users = self._queues.get(waiter.priority, {})
+        queue = users.get(waiter.user)
+        if queue is not None and waiter in queue:
+            queue.remove(waiter)
+            if not queue:
+                del users[waiter.user]
+            if not users:
+                self._queues.pop(waiter.priority, None)
+
+    def _wait_time(self, amount: float, now: float) -> float:
+        wait = max(0.0, self.paused_until - now)
+        if self.requests:
+            wait = max(wait, self.requests.wait_time(1, now))
+        if self.tokens:
+            wait = max(wait, self.tokens.wait_time(amount, now))
+        return wait
+
+    def acquire(self, tokens: float = DEFAULT_TOKEN_ESTIMATE, deadline: Optional[float] = None):
+        """Block until this caller may send a request; QuotaExceeded if the monotonic deadline passes first"""
+        if not self.enabled and time.monotonic() >= self.paused_until:
+            return
+        waiter = _Waiter(_current_user.get(), _current_priority.get(), tokens)
+        start = time.monotonic()
+        with self._cond:
+            self._queues.setdefault(waiter.priority, OrderedDict()).setdefault(waiter.user, deque()).append(waiter)
+            while True:
+                now = time.monotonic()
+                wait = None
+                if self._head() is waiter:
+                    wait = self._wait_time(tokens, now)
+                    if wait <= 0:
+                        self._pop(waiter)
+                        if self.requests:
+                            self.requests.take(1)
+                        if self.tokens:
+                            self.tokens.take(tokens)
+                        self._cond.notify_all()
+                        break
+                if deadline is not None and now >= deadline:
+                    self._remove(waiter)
+                    self._cond.notify_all()
+                    metrics.record_degraded(f"{self.name}_quota")
+                    raise QuotaExceeded(f"{self.name} quota wait exceeded the deadline")
+                timeout = wait if wait is not None else None
+                if deadline is not None:
+                    timeout = min(timeout, deadline - now) if timeout is not None else deadline - now
+                self._cond.wait(timeout)
+        metrics.record_queue_wait(self.name, time.monotonic() - start)
+
+    def settle(self, estimated: float, actual: Optional[float]):
+        """Correct the token bucket once usage_metadata reports the real size of a request"""
+        if self.tokens is None or actual is None:
+            return
+        with self._cond:
+            self.tokens.take(actual - estimated)
+            self._cond.notify_all()
+
+    def backoff(self, seconds: float = RATE_LIMIT_BACKOFF):
+        """Upstream returned 429: hold every queued request for a while"""
+        with self._cond:
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+            self._cond.notify_all()
+
+    def backlog_seconds(self) -> float:
+        """Rough wait a new request would see: pause or bucket refill plus one slot per queued request"""
+        with self._cond:
+            now = time.monotonic()
+            queued = sum(len(q) for users in self._queues.values() for q in users.values())
+            wait = self._wait_time(DEFAULT_TOKEN_ESTIMATE, now)
+            if self.requests:
+                wait += queued / self.requests.rate
+            return wait
+
+    def run(self, fn: Callable, tokens: float = DEFAULT_TOKEN_ESTIMATE,
+            deadline: Optional[float] = None, usage: Optional[Callable] = None,
+            retry_rate_limits: bool = True):
+        """
+        Call fn() under the quota. A 429 pauses the scheduler and retries
+        while the deadline allows (or, without retry_rate_limits, pauses
+        and re-raises so the caller can go elsewhere); usage(result) ->
+        actual tokens, if given, settles the token estimate.
+        """
+        attempt = 0
+        while True:
+            self.acquire(tokens, deadline)
+            try:
+                result = fn()
+            except Exception as e:
+                if not is_rate_limit_error(e):
+                    raise
+                attempt += 1
+                backoff = RATE_LIMIT_BACKOFF * (2 ** min(attempt - 1, 4))
+                metrics.record_degraded(f"{self.name}_429")
+                if not retry_rate_limits or (deadline is not None and time.monotonic() + backoff >= deadline):
+                    self.backoff(backoff)
+                    raise
+                print(f"⚠ {self.name} rate limited upstream; backing off {backoff:.1f}s")
+                self.backoff(backoff)
+                continue
+            if usage is not None:
+                self.settle(tokens, usage(result))
+            return result
+
+
+def estimate_tokens(text: str, completion: int = 512) -> float:
+    """Rough prompt size (about 4 characters per token) plus room for the reply"""
+    return len(text) / 4 + completion
+
+
+llm_scheduler = QuotaScheduler("llm", LLM_RPM, LLM_TPM)
+embedding_scheduler = QuotaScheduler("embedding", EMBED_RPM)
@@ -0,0 +1,197 @@
+"""
+Optional search sidecar: one process on the host holds the embedding model,
+the vectors and the index, and answers the uvicorn workers' searches over a
+Unix socket, so per-worker memory stays flat as workers are added. Workers
+use it when SEARCH_SIDECAR is set to the socket path; if it is down they
+fall back to their own keyword index.
+Run from app/: python -m search_sidecar [--socket /tmp/salescrew-search.sock]
+"""
+import os
+import sys
+import json
+import time
+import base64
+import socket
+import asyncio
+import argparse
+import threading
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+# Socket of a running sidecar; empty (default) means each worker searches in-process
+SEARCH_SIDECAR = os.getenv("SEARCH_SIDECAR", "")
+SIDECAR_TIMEOUT_MS = float(os.getenv("SIDECAR_TIMEOUT_MS", "1000"))
+# Seconds a status reply (readiness, embedding model name) is reused before asking again
+SIDECAR_STATUS_TTL = 5.0
+# Seconds a worker waits for the sidecar to reload (and re-embed) the catalog
+RELOAD_TIMEOUT = 600.0
+DEFAULT_SOCKET = "/tmp/salescrew-search.sock"
+# Longest request line the sidecar accepts (queries plus a preference vector)
+MAX_REQUEST_BYTES = 1 << 20
+
+
+class SidecarUnavailable(Exception):
+    """The sidecar did not answer (not running, timed out, or returned an error)"""
+
+
+def _encode_vector(vector: np.ndarray) -> str:
+    return base64.b64encode(np.asarray(vector, dtype=np.float32).tobytes()).decode()
+
+
+def _decode_vector(data: Optional[str]) -> Optional[np.ndarray]:
+    if not data:
+        return None
+    return np.frombuffer(base64.b64decode(data), dtype=np.float32)
+
+
+class SearchSidecarClient:
+    """
+    Worker side of the socket protocol (one JSON object per line each way),
+    with one connection per thread. Also stands in for the embedder: name is
+    the sidecar's embedding model, since queries are embedded over there.
+    """
+
+    def __init__(self, path: str, timeout_ms: float = SIDECAR_TIMEOUT_MS):
+        self.path = path
+        self.timeout = timeout_ms / 1000
+        self._local = threading.local()
+        self._status: Dict = {}
+        self._status_at = 0.0
+
+    def _connection(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            sock.settimeout(self.timeout)
+            sock.connect(self.path)
+            conn = self._local.conn = (sock, sock.makefile("rwb"))
+        return conn
+
+    def _close(self):
+        conn = getattr(self._local, "conn", None)
+        self._local.conn = None
+        if conn is not None:
+            for part in reversed(conn):
+                try:
+                    part.close()
+                except OSError:
+                    pass
+
+    def _call(self, request: Dict, timeout: Optional[float] = None) -> Dict:
+        try:
+            sock, stream = self._connection()
+            sock.settimeout(timeout or self.timeout)
+            stream.write(json.dumps(request).encode() + b"\n")
+            stream.flush()
+            line = stream.readline()
+            if not line:
+                raise ConnectionError("sidecar closed the connection")
+            response = json.loads(line)
+        except (OSError, ValueError) as e:
+            # A timed-out reply may still arrive later, so the connection cannot be reused
+            self._close()
+            raise SidecarUnavailable(f"{self.path}: {e}") from e
+        if "error" in response:
+            raise SidecarUnavailable(response["error"])
+        return response
+
+    def status(self) -> Dict:
+        now = time.monotonic()
+        if now - self._status_at > SIDECAR_STATUS_TTL:
+            try:
+                self._status = self._call({"op": "status"})
+            except SidecarUnavailable:
+                self._status = {}
+            self._status_at = now
+        return self._status
+
+    @property
+    def ready(self) -> bool:
+        return bool(self.status().get("ready"))
+
+    @property
+    def name(self) -> str:
+        return self.status().get("model", "")
+
+    def search(self, query: str, top_k: int, mode: Optional[str] = None,
+               preference: Optional[np.ndarray] = None) -> Tuple[List[int], List[float]]:
+        """Product ids and scores, re-ranked by preference when one is given"""
+        response = self._call({
+            "op": "search", "query": query, "top_k": top_k, "mode": mode,
+            "preference": _encode_vector(preference) if preference is not None else None
+        })
+        return response["ids"], response["scores"]
+
+    def mean_embedding(self, product_ids: List[int]) -> Optional[np.ndarray]:
+        return _decode_vector(self._call({"op": "mean_embedding", "ids": list(product_ids)})["vector"])
+
+    def reload(self, path: str) -> Dict:
+        """Have the sidecar reload the catalog file a worker just reloaded (may re-embed, so no short timeout)"""
+        return self._call({"op": "reload", "path": path}, timeout=RELOAD_TIMEOUT)
+
+
+def handle(rag, request: Dict) -> Dict:
+    """Answer one request with rag (a warmed-up ProductRAGWithEmbeddings)"""
+    op = request.get("op")
+    if op == "status":
+        return {"ready": rag.embeddings_generated, "products": len(rag.products), "model": rag.embedder.name}
+    if op == "search":
+        snapshot = rag._snapshot
+        ranked = rag._ranked_rows(snapshot, request["query"], int(request["top_k"]), request.get("mode"),
+                                  preference=_decode_vector(request.get("preference")))
+        ids, scores = [], []
+        for row, score in ranked:
+            pid = int(snapshot.products.ids[row])
+            if pid != -1:
+                ids.append(pid)
+                scores.append(score)
+        return {"ids": ids, "scores": scores}
+    if op == "mean_embedding":
+        vector = rag.mean_embedding([int(pid) for pid in request.get("ids") or []])
+        return {"vector": _encode_vector(vector) if vector is not None else None}
+    if op == "reload":
+        return rag.reload_catalog(request.get("path"))
+    return {"error": f"unknown op {op!r}"}
+
+
+async def serve(rag, path: str):
+    async def connection(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                try:
+                    response = await asyncio.to_thread(handle, rag, json.loads(line))
+                except Exception as e:
+                    response = {"error": f"{type(e).__name__}: {e}"}
+                writer.write(json.dumps(response).encode() + b"\n")
+                await writer.drain()
+        except (ConnectionError, asyncio.LimitOverrunError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    if os.path.exists(path):
+        os.unlink(path)  # left over from a previous run
+    server = await asyncio.start_unix_server(connection, path=path, limit=MAX_REQUEST_BYTES)
+    os.chmod(path, 0o660)
+    print(f"✓ Search sidecar listening on {path}")
+    async with server:
+        await server.serve_forever()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--socket", default=SEARCH_SIDECAR or DEFAULT_SOCKET)
+    args = parser.parse_args()
+
+    # This process is the one that searches in-process
+    os.environ.pop("SEARCH_SIDECAR", None)
+    from crew_backend import crew
+    threading.Thread(target=crew.warm_up, daemon=True).start()
+    try:
+        asyncio.run(serve(crew.product_rag, args.socket))
+    except KeyboardInterrupt:
+        sys.exit(0)
@@ -0,0 +1,196 @@
+"""Live websocket sessions that outlive a dropped connection, with a replay buffer of sequenced frames"""
+import os
+import time
+import asyncio
+from collections import deque, OrderedDict
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+from models import SessionContext
+
+# Server frames kept per session for replay after a reconnect
+REPLAY_BUFFER_SIZE = int(os.getenv("REPLAY_BUFFER_SIZE", "50"))
+# Seconds a disconnected session stays resumable before it must be reloaded from Mongo
+SESSION_RESUME_TTL = float(os.getenv("SESSION_RESUME_TTL", "120"))
+# Seconds between write-behind saves of changed sessions; 0 saves after every turn instead
+SESSION_FLUSH_INTERVAL = float(os.getenv("SESSION_FLUSH_INTERVAL", "10"))
+# Seconds between eviction passes (and retries of failed saves) when sessions are saved every turn
+SESSION_EVICT_INTERVAL = 10.0
+# Estimated memory for live sessions; past it, the least recently used disconnected ones are evicted early
+SESSION_MEMORY_BUDGET_MB = float(os.getenv("SESSION_MEMORY_BUDGET_MB", "256"))
+# Per-session cost beyond the text it holds (objects, dicts, cart lines), for the estimate
+SESSION_BASE_BYTES = 4096
+TURN_BASE_BYTES = 400
+
+
+class LiveSession:
+    """
+    One user's conversation context plus every frame sent to them,
+    numbered by seq. Replies are keyed by the client's message id so a
+    message resent after a reconnect is answered from the buffer (or the
+    still-running call) instead of a second LLM call.
+    """
+
+    def __init__(self, email: str, context: SessionContext, buffer_size: int = REPLAY_BUFFER_SIZE):
+        self.email = email
+        self.context = context
+        self.seq = 0
+        self.frames: deque = deque(maxlen=buffer_size)  # (seq, frame)
+        self.replies: "OrderedDict[str, Dict]" = OrderedDict()  # client message id -> reply frame
+        self.inflight: Dict[str, asyncio.Future] = {}
+        self.buffer_size = buffer_size
+        self.owner = None  # websocket currently attached
+        self.detached_at: Optional[float] = None
+        self.last_active = time.monotonic()
+        # Changes since the last save; a turn still running is saved once it finishes
+        self.version = 0
+        self.saved_version = 0
+        self.running = 0
+
+    @property
+    def dirty(self) -> bool:
+        return self.version != self.saved_version
+
+    def mark_changed(self):
+        self.version += 1
+        self.last_active = time.monotonic()
+
+    def snapshot(self) -> Tuple[int, Dict]:
+        """(version, session document) to save; pass the version to mark_saved once written"""
+        return self.version, self.context.to_document()
+
+    def mark_saved(self, version: int):
+        self.saved_version = max(self.saved_version, version)
+
+    def footprint(self) -> int:
+        """Rough bytes held: history and replay text plus fixed overheads"""
+        context = self.context
+        size = SESSION_BASE_BYTES + len(context.cart) * TURN_BASE_BYTES
+        for turn in context.conversation_history:
+            size += TURN_BASE_BYTES + len(turn.user) + len(turn.reply)
+        for _, frame in self.frames:
+            size += TURN_BASE_BYTES + len(frame.get("message", ""))
+        if context.preferences.vector is not None:
+            size += context.preferences.vector.nbytes
+        return size
+
+    def frame(self, data: Dict, reply_to: Optional[str] = None) -> Dict:
+        """
+        Number and buffer a frame; call before sending so it survives a
+        failed send. Frames are kept unencoded so a resumed connection can
+        use a different wire encoding.
+        """
+        self.seq += 1
+        frame = dict(data, seq=self.seq)
+        if reply_to is not None:
+            frame["reply_to"] = reply_to
+        self.frames.append((self.seq, frame))
+        if reply_to is not None:
+            self.replies[reply_to] = frame
+            while len(self.replies) > self.buffer_size:
+                self.replies.popitem(last=False)
+        return frame
+
+    def frames_after(self, seq: int) -> Optional[List[Dict]]:
+        """Frames the client has not seen, or None if some of them already fell out of the buffer"""
+        if seq >= self.seq:
+            return []
+        if not self.frames or self.frames[0][0] > seq + 1:
+            return None
+        return [frame for s, frame in self.frames if s > seq]
+
+
+class SessionRegistry:
+    """
+    Live sessions by email. Detached ones expire after the resume TTL, but
+    only once saved: an unsaved session stays (and is resumed) until the
+    flush writes it, so a reply finished after a disconnect is not lost.
+    """
+
+    def __init__(self, ttl: float = SESSION_RESUME_TTL):
+        self.ttl = ttl
+        self._sessions: Dict[str, LiveSession] = {}
+        # Sessions that left memory since the last take_dropped(), so their stock holds can be released
+        self._dropped: List[LiveSession] = []
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+    @staticmethod
+    def _evictable(session: LiveSession) -> bool:
+        return session.owner is None and not session.dirty and not session.running
+
+    def _prune(self) -> int:
+        now = time.monotonic()
+        expired = [email for email, s in self._sessions.items()
+                   if s.detached_at is not None and now - s.detached_at > self.ttl and self._evictable(s)]
+        for email in expired:
+            self._dropped.append(self._sessions.pop(email))
+        return len(expired)
+
+    def get(self, email: str) -> Optional[LiveSession]:
+        self._prune()
+        return self._sessions.get(email)
+
+    def attach(self, email: str, owner, context: Optional[SessionContext] = None) -> LiveSession:
+        """The live session for email, created around context if there is none; owner takes it over"""
+        session = self.get(email)
+        if session is None:
+            session = LiveSession(email, context or SessionContext())
+            self._sessions[email] = session
+        session.owner = owner
+        session.detached_at = None
+        session.last_active = time.monotonic()
+        return session
+
+    def detach(self, session: LiveSession, owner):
+        """owner's connection dropped; keep the session resumable for the TTL unless another connection took it"""
+        if session.owner is owner:
+            session.owner = None
+            session.detached_at = time.monotonic()
+
+    def discard(self, email: str):
+        session = self._sessions.pop(email, None)
+        if session is not None:
+            self._dropped.append(session)
+
+    def take_dropped(self) -> List[LiveSession]:
+        dropped, self._dropped = self._dropped, []
+        return dropped
+
+    def emails(self) -> List[str]:
+        return list(self._sessions)
+
+    async def flush(self, save_many: Callable[[Dict[str, Dict]], Awaitable]) -> int:
+        """Save every changed session with no turn running in one save_many({email: document}) call"""
+        pending = {email: s.snapshot() for email, s in self._sessions.items() if s.dirty and not s.running}
+        if not pending:
+            return 0
+        await save_many({email: doc for email, (_, doc) in pending.items()})
+        for email, (version, _) in pending.items():
+            session = self._sessions.get(email)
+            if session is not None:
+                session.mark_saved(version)
+        return len(pending)
+
+    def evict(self, budget_bytes: float) -> Tuple[int, int, int]:
+        """
+        Drop expired sessions, then the least recently used saved, detached
+        ones while the estimate is over budget. Returns (expired, evicted
+        for memory, estimated bytes left); attached sessions always stay.
+        """
+        expired = self._prune()
+        sizes = {email: s.footprint() for email, s in self._sessions.items()}
+        total = sum(sizes.values())
+        evicted = 0
+        if total > budget_bytes:
+            idle = sorted((s for s in self._sessions.values() if self._evictable(s)), key=lambda s: s.last_active)
+            for session in idle:
+                if total <= budget_bytes:
+                    break
+                self._dropped.append(self._sessions.pop(session.email))
+                total -= sizes[session.email]
+                evicted += 1
+        return expired, evicted, total
+
+
+live_sessions = SessionRegistry()
@@ -74,16 +74,26 @@ const protocol = window.location.protocol === 'https:' ? 'wss:' : 'ws:';
 const wsUrl = `${protocol}//${window.location.host}/ws`;
 console.log('🔌 Connecting to WebSocket:', wsUrl);
 
-const ws = new WebSocket(wsUrl);
 const chatbox = document.getElementById("chatbox");
 const input = document.getElementById("userInput");
 const sendBtn = document.getElementById("sendBtn");
 const voiceBtn = document.getElementById("voiceBtn");
 const voiceIcon = document.getElementById("voiceIcon");
 
+let ws = null;
 let wsReady = false;
 let messageQueue = [];
 
+// Resumable session: the server numbers every frame (seq) and replays the ones we missed
+let lastSeq = null;
+let nextMessageId = 0;
+const pendingMessages = new Map(); // message id -> payload not yet answered
+let reconnectAttempts = 0;
+const MAX_RECONNECT_ATTEMPTS = 8;
+
+// Wire encoding requested for server frames: 'msgpack' (binary) or 'json'; the server may answer in JSON either way
+const FRAME_ENCODING = localStorage.getItem('wsEncoding') || 'msgpack';
+
 // Voice recognition setup
 let recognition = null;
 let isRecording = false;
@@ -139,38 +149,67 @@ if (voiceBtn) {
   };
 }
 
-ws.onopen = () => {
+function connect() {
+  ws = new WebSocket(wsUrl);
+  ws.binaryType = 'arraybuffer';
+  ws.onopen = handleOpen;
+  ws.onmessage = handleMessage;
+  ws.onerror = handleError;
+  ws.onclose = handleClose;
+}
+
+function handleOpen() {
   console.log('✅ WebSocket connected');
   console.log('📤 Sending authentication...');
   
   try {
-    const authPayload = JSON.stringify({ token });
-    console.log('Auth payload:', { hasToken: !!token, tokenLength: token?.length });
+    const auth = { token, encoding: FRAME_ENCODING };
+    if (lastSeq !== null) auth.resume_seq = lastSeq;
+    const authPayload = JSON.stringify(auth);
+    console.log('Auth payload:', { hasToken: !!token, tokenLength: token?.length, resumeSeq: auth.resume_seq });
     ws.send(authPayload);
     console.log('✅ Auth token sent successfully');
   } catch (error) {
     console.error('❌ Error sending auth token:', error);
     appendMessage("bot", "❌ Failed to authenticate. Please refresh the page.");
   }
-};
+}
 
-ws.onmessage = (event) => {
+function handleMessage(event) {
   console.log('📨 Raw message received:', event.data);
   
   try {
-    const data = JSON.parse(event.data);
+    const data = decodeFrame(event.data);
     console.log('📦 Parsed message data:', data);
     
-    // Check if this is the welcome message
-    if (data.message && data.message.includes('Welcome')) {
+    // A session that was not resumed (server restart, expired resume window, another worker)
+    // numbers its frames from 1 again, so earlier sequence numbers no longer apply
+    if (data.session && !data.session.resumed) lastSeq = null;
+    if (typeof data.seq === 'number') {
+      // Replays can overlap what we already showed; skip anything not newer
+      if (lastSeq !== null && data.seq <= lastSeq) {
+        console.log('↩️ Skipping already-seen frame:', data.seq);
+        return;
+      }
+      lastSeq = data.seq;
+    }
+    if (data.reply_to) pendingMessages.delete(data.reply_to);
+    
+    // The welcome (or resume) frame carries the session state
+    if (data.session) {
       wsReady = true;
+      reconnectAttempts = 0;
       console.log('✅ WebSocket authenticated and ready');
       
+      // Messages sent before a drop that were never answered go again under the same id;
+      // the server answers them from its buffer rather than calling the model twice
+      pendingMessages.forEach(payload => ws.send(payload));
+      
       // Process any queued messages
       if (messageQueue.length > 0) {
         console.log('📬 Processing queued messages:', messageQueue.length);
         messageQueue.forEach(msg => {
-          ws.send(msg);
+          ws.send(trackMessage(msg));
         });
         messageQueue = [];
       }
@@ -184,29 +223,103 @@ ws.onmessage = (event) => {
       appendMessage("bot", data.message);
     } else {
       console.warn('⚠️ Unrecognized message format:', data);
-      appendMessage("bot", event.data);
+      appendMessage("bot", JSON.stringify(data));
     }
   } catch (e) {
     console.error('❌ Error parsing message:', e);
     console.log('Raw data:', event.data);
-    appendMessage("bot", event.data);
+    if (typeof event.data === 'string') appendMessage("bot", event.data);
   }
-};
+}
 
-ws.onerror = (error) => {
+function handleError(error) {
   console.error('❌ WebSocket error:', error);
-  appendMessage("bot", "⚠️ Connection error. Please check your internet connection and refresh the page.");
-};
+}
 
-ws.onclose = (event) => {
+function handleClose(event) {
   console.log('🔴 WebSocket closed');
   console.log('Close code:', event.code);
   console.log('Close reason:', event.reason);
   console.log('Clean close:', event.wasClean);
   
-  appendMessage("bot", "Connection closed. Please refresh to reconnect.");
   wsReady = false;
-};
+  if (event.code === 1000 || reconnectAttempts >= MAX_RECONNECT_ATTEMPTS) {
+    appendMessage("bot", "Connection closed. Please refresh to reconnect.");
+    return;
+  }
+  // Resume the same session with exponential backoff
+  const delay = Math.min(500 * 2 ** reconnectAttempts, 10000);
+  reconnectAttempts += 1;
+  console.log(`🔄 Reconnecting in ${delay}ms (attempt ${reconnectAttempts})`);
+  setTimeout(connect, delay);
+}
+
+// Server frames arrive as JSON text or msgpack binary
+function decodeFrame(raw) {
+  return typeof raw === 'string' ? JSON.parse(raw) : msgpackDecode(new Uint8Array(raw));
+}
+
+// Minimal msgpack decoder covering what the server sends (nil, bool, ints, floats, str, bin, array, map)
+function msgpackDecode(bytes) {
+  const view = new DataView(bytes.buffer, bytes.byteOffset, bytes.byteLength);
+  const utf8 = new TextDecoder();
+  let pos = 0;
+
+  const str = (n) => { const s = utf8.decode(bytes.subarray(pos, pos + n)); pos += n; return s; };
+  const bin = (n) => { const b = bytes.slice(pos, pos + n); pos += n; return b; };
+  const array = (n) => { const a = new Array(n); for (let i = 0; i < n; i++) a[i] = read(); return a; };
+  const map = (n) => { const m = {}; for (let i = 0; i < n; i++) { const k = read(); m[k] = read(); } return m; };
+  const u8 = () => view.getUint8(pos++);
+  const u16 = () => { const v = view.getUint16(pos); pos += 2; return v; };
+  const u32 = () => { const v = view.getUint32(pos); pos += 4; return v; };
+
+  function read() {
+    const b = u8();
+    if (b <= 0x7f) return b;
+    if (b >= 0xe0) return b - 0x100;
+    if ((b & 0xe0) === 0xa0) return str(b & 0x1f);
+    if ((b & 0xf0) === 0x90) return array(b & 0x0f);
+    if ((b & 0xf0) === 0x80) return map(b & 0x0f);
+    let v;
+    switch (b) {
+      case 0xc0: return null;
+      case 0xc2: return false;
+      case 0xc3: return true;
+      case 0xc4: return bin(u8());
+      case 0xc5: return bin(u16());
+      case 0xc6: return bin(u32());
+      case 0xca: v = view.getFloat32(pos); pos += 4; return v;
+      case 0xcb: v = view.getFloat64(pos); pos += 8; return v;
+      case 0xcc: return u8();
+      case 0xcd: return u16();
+      case 0xce: return u32();
+      case 0xcf: v = Number(view.getBigUint64(pos)); pos += 8; return v;
+      case 0xd0: v = view.getInt8(pos); pos += 1; return v;
+      case 0xd1: v = view.getInt16(pos); pos += 2; return v;
+      case 0xd2: v = view.getInt32(pos); pos += 4; return v;
+      case 0xd3: v = Number(view.getBigInt64(pos)); pos += 8; return v;
+      case 0xd9: return str(u8());
+      case 0xda: return str(u16());
+      case 0xdb: return str(u32());
+      case 0xdc: return array(u16());
+      case 0xdd: return array(u32());
+      case 0xde: return map(u16());
+      case 0xdf: return map(u32());
+      default: throw new Error(`Unsupported msgpack type 0x${b.toString(16)}`);
+    }
+  }
+  return read();
+}
+
+// Wraps a chat message with an id so a resend after reconnecting is recognised
+function trackMessage(msg) {
+  const id = `${Date.now().toString(36)}-${nextMessageId++}`;
+  const payload = JSON.stringify({ id, text: msg });
+  pendingMessages.set(id, payload);
+  return payload;
+}
+
+connect();
 
 sendBtn.onclick = sendMessage;
 input.addEventListener("keypress", (e) => {
@@ -231,12 +344,6 @@ function sendMessage() {
     CLOSED: WebSocket.CLOSED
   });
   
-  if (ws.readyState !== WebSocket.OPEN) {
-    console.error('❌ WebSocket not open. State:', ws.readyState);
-    appendMessage("bot", "⚠️ Connection lost. Please refresh the page.");
-    return;
-  }
-  
   if (!wsReady) {
     console.log('⏳ WebSocket not ready, queuing message');
     messageQueue.push(msg);
@@ -251,7 +358,7 @@ function sendMessage() {
   
   try {
     console.log('📤 Sending message to server');
-    ws.send(msg);
+    ws.send(trackMessage(msg));
     console.log('✅ Message sent successfully');
   } catch (error) {
     console.error('❌ Error sending message:', error);
@@ -0,0 +1,155 @@
+"""
+Queries over the turn event log (see turn_events.py): how turns are
+routed across agents and paths, and how often recommended products are
+opened or carted afterwards.
+Run from app/: python -m turn_analytics [--source jsonl] [--hours 24]
+"""
+import os
+import sys
+import glob
+import json
+import time
+import argparse
+from collections import defaultdict
+from typing import Dict, Iterable, List, Optional
+
+from turn_events import EVENT_LOG, EVENT_LOG_DIR
+
+# Fast-path intents where the user asked for a specific product: a click on an earlier recommendation
+CLICK_INTENTS = ("show_product", "show_item", "stock_check")
+# A recommendation counts as clicked if the product is opened or carted within this many later turns
+CTR_HORIZON = int(os.getenv("CTR_HORIZON", "10"))
+
+
+def load_events(source: str = EVENT_LOG, since: Optional[float] = None,
+                directory: str = EVENT_LOG_DIR) -> List[Dict]:
+    """Events with ts >= since (epoch seconds) from the jsonl or parquet files, or the Mongo collection"""
+    since = since or 0.0
+    if source == "jsonl":
+        events = []
+        for path in sorted(glob.glob(os.path.join(directory, "turns-*.jsonl"))):
+            with open(path) as f:
+                events.extend(json.loads(line) for line in f if line.strip())
+        return [e for e in events if e["ts"] >= since]
+    if source == "parquet":
+        import pyarrow.parquet as pq
+        paths = sorted(glob.glob(os.path.join(directory, "turns-*.parquet")))
+        events = [row for path in paths for row in pq.read_table(path).to_pylist()]
+        return [e for e in events if e["ts"] >= since]
+    if source == "mongo":
+        from pymongo import MongoClient
+        from auth import MONGODB_URL, DATABASE_NAME
+        client = MongoClient(MONGODB_URL)
+        try:
+            return list(client[DATABASE_NAME]["turn_events"].find({"ts": {"$gte": since}}, {"_id": 0}))
+        finally:
+            client.close()
+    raise ValueError(f"Unknown source {source!r}; expected mongo, jsonl or parquet")
+
+
+def _percentile(sorted_values: List[float], q: float) -> float:
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(q * len(sorted_values)))]
+
+
+def routing_distribution(events: Iterable[Dict], key: str = "agent") -> Dict[str, Dict]:
+    """Turns, share, latency p50/p95 (ms) and mean tokens per value of key (agent, route or intent)"""
+    groups: Dict[str, List[Dict]] = defaultdict(list)
+    for event in events:
+        groups[str(event.get(key))].append(event)
+    total = sum(len(group) for group in groups.values())
+    table = {}
+    for name, group in sorted(groups.items(), key=lambda item: -len(item[1])):
+        latencies = sorted(e["latency_ms"] for e in group)
+        table[name] = {
+            "turns": len(group),
+            "share": len(group) / total,
+            "p50_ms": _percentile(latencies, 0.5),
+            "p95_ms": _percentile(latencies, 0.95),
+            "prompt_tokens": sum(e["prompt_tokens"] for e in group) / len(group),
+            "completion_tokens": sum(e["completion_tokens"] for e in group) / len(group),
+        }
+    return table
+
+
+def _recommends(event: Dict) -> bool:
+    """Turns whose product_ids are suggestions, not the products the user asked for or their cart"""
+    return event["route"] in ("llm", "degraded") or event.get("intent") == "related_products"
+
+
+def _engaged(event: Dict) -> set:
+    engaged = set(event.get("carted_ids") or [])
+    if event.get("intent") in CLICK_INTENTS:
+        engaged.update(event.get("product_ids") or [])
+    return engaged
+
+
+def recommendation_ctr(events: Iterable[Dict], horizon: int = CTR_HORIZON) -> Dict:
+    """
+    Share of recommended products the user opened or carted within
+    horizon later turns of the same session, overall and by agent.
+    """
+    sessions: Dict[str, List[Dict]] = defaultdict(list)
+    for event in events:
+        if event.get("session"):
+            sessions[event["session"]].append(event)
+
+    shown: Dict[str, int] = defaultdict(int)
+    clicked: Dict[str, int] = defaultdict(int)
+    for turns in sessions.values():
+        turns.sort(key=lambda e: (e["ts"], e.get("turn") or 0))
+        engaged = [_engaged(e) for e in turns]
+        for i, event in enumerate(turns):
+            if not _recommends(event):
+                continue
+            later = set().union(*engaged[i + 1:i + 1 + horizon])
+            for pid in dict.fromkeys(event.get("product_ids") or []):
+                shown[event["agent"]] += 1
+                clicked[event["agent"]] += pid in later
+
+    impressions, clicks = sum(shown.values()), sum(clicked.values())
+    return {
+        "impressions": impressions,
+        "clicks": clicks,
+        "ctr": clicks / impressions if impressions else 0.0,
+        "by_agent": {agent: {"impressions": n, "clicks": clicked[agent], "ctr": clicked[agent] / n}
+                     for agent, n in sorted(shown.items(), key=lambda item: -item[1])},
+    }
+
+
+def _print_distribution(title: str, table: Dict[str, Dict]):
+    print(f"\n{title}")
+    print(f"  {'':<30} {'turns':>7} {'share':>7} {'p50 ms':>8} {'p95 ms':>8} {'prompt tok':>11} {'compl tok':>10}")
+    for name, row in table.items():
+        print(f"  {name:<30} {row['turns']:7d} {100 * row['share']:6.1f}% {row['p50_ms']:8.1f} "
+              f"{row['p95_ms']:8.1f} {row['prompt_tokens']:11.0f} {row['completion_tokens']:10.0f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--source", default=EVENT_LOG if EVENT_LOG != "off" else "mongo",
+                        choices=("mongo", "jsonl", "parquet"))
+    parser.add_argument("--dir", default=EVENT_LOG_DIR, help="Directory of the jsonl or parquet files")
+    parser.add_argument("--hours", type=float, help="Only turns from the last N hours")
+    parser.add_argument("--horizon", type=int, default=CTR_HORIZON)
+    args = parser.parse_args()
+
+    since = time.time() - args.hours * 3600 if args.hours else None
+    try:
+        events = load_events(args.source, since, args.dir)
+    except Exception as e:
+        print(f"⚠ Could not read turn events: {e}")
+        sys.exit(1)
+    if not events:
+        print("No turn events found")
+        sys.exit(0)
+
+    print(f"{len(events)} turns in {len({e.get('session') for e in events})} sessions")
+    _print_distribution("By agent", routing_distribution(events, "agent"))
+    _print_distribution("By route", routing_distribution(events, "route"))
+    ctr = recommendation_ctr(events, args.horizon)
+    print(f"\nRecommendation CTR (opened or carted within {args.horizon} turns): "
+          f"{ctr['clicks']}/{ctr['impressions']} = {100 * ctr['ctr']:.1f}%")
+    for agent, row in ctr["by_agent"].items():
+        print(f"  {agent:<30} {row['clicks']:5d}/{row['impressions']:<5d} {100 * row['ctr']:6.1f}%")
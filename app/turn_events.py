@@ -0,0 +1,181 @@
+"""
+Append-only log of chat turns for analytics. record() only appends to an
+in-memory buffer; a background task writes it out in batches to Mongo,
+JSON Lines or Parquet, so the chat path never waits on the sink.
+Query the log with turn_analytics.py.
+"""
+import os
+import json
+import time
+import hmac
+import asyncio
+import hashlib
+import datetime
+from collections import deque
+from typing import Dict, List, Optional
+
+import metrics
+
+try:
+    import pyarrow
+    import pyarrow.parquet as pq
+except ImportError:  # optional; only needed for EVENT_LOG=parquet
+    pyarrow = None
+
+# Where turn events go: mongo (turn_events collection), jsonl, parquet or off
+EVENT_LOG = os.getenv("EVENT_LOG", "mongo").lower()
+# Directory for the jsonl and parquet sinks (one file per UTC day, or per batch for parquet)
+EVENT_LOG_DIR = os.getenv("EVENT_LOG_DIR", "events")
+# Seconds between batch writes
+EVENT_FLUSH_INTERVAL = float(os.getenv("EVENT_FLUSH_INTERVAL", "2"))
+EVENT_BATCH_SIZE = int(os.getenv("EVENT_BATCH_SIZE", "500"))
+# Events held while the sink is slow or down; the oldest are dropped beyond this
+EVENT_BUFFER_LIMIT = int(os.getenv("EVENT_BUFFER_LIMIT", "50000"))
+# Key for the pseudonymous session ids in events; defaults to the JWT secret
+EVENT_SESSION_KEY = os.getenv("EVENT_SESSION_KEY") or os.getenv("SECRET_KEY", "")
+
+
+def session_key(session: Optional[str]) -> Optional[str]:
+    """Stable opaque id for a session (the user's email), so events carry no personal data"""
+    if not session:
+        return None
+    return hmac.new(EVENT_SESSION_KEY.encode(), session.encode(), hashlib.sha256).hexdigest()[:16]
+
+
+class EventLog:
+    """
+    Bounded buffer of turn events. deque appends and pops are atomic, so
+    chat threads record without a lock while the flush task drains.
+    Delivery is at least once: a failed batch is put back and retried.
+    When the buffer is full the oldest events go first, counted in
+    crew_turn_events_dropped_total.
+    """
+
+    def __init__(self, enabled: bool = True, limit: int = EVENT_BUFFER_LIMIT):
+        self.enabled = enabled
+        self._buffer = deque(maxlen=limit)
+        self.dropped = 0
+
+    def __len__(self) -> int:
+        return len(self._buffer)
+
+    def record(self, timer, session: Optional[str], turn_index: int, agent: str, product_ids: List[int]):
+        """Queue the event for a finished turn (timer is its metrics.TurnTimer)"""
+        if not self.enabled:
+            return
+        if len(self._buffer) == self._buffer.maxlen:
+            self._drop(1)
+        self._buffer.append({
+            "ts": time.time(),
+            "session": session_key(session),
+            "turn": turn_index,
+            "agent": agent,
+            "route": timer.route,
+            "intent": timer.intent,
+            "latency_ms": round(timer.elapsed * 1000, 2),
+            "prompt_tokens": timer.tokens.get("prompt", 0),
+            "completion_tokens": timer.tokens.get("completion", 0),
+            "retrieved_ids": list(dict.fromkeys(timer.products.get("retrieved", []))),
+            "product_ids": [int(pid) for pid in product_ids],
+            "carted_ids": list(dict.fromkeys(timer.products.get("carted", []))),
+        })
+
+    def _drop(self, count: int):
+        self.dropped += count
+        metrics.record_events_dropped(count)
+
+    def _requeue(self, batch: List[Dict]):
+        """Put a failed batch back in front of newer events, dropping its oldest if they no longer fit"""
+        room = self._buffer.maxlen - len(self._buffer)
+        if room < len(batch):
+            self._drop(len(batch) - room)
+            batch = batch[len(batch) - room:] if room > 0 else []
+        self._buffer.extendleft(reversed(batch))
+
+    def _drain(self, limit: int) -> List[Dict]:
+        batch = []
+        while len(batch) < limit:
+            try:
+                batch.append(self._buffer.popleft())
+            except IndexError:
+                break
+        return batch
+
+    async def flush(self, sink, batch_size: int = EVENT_BATCH_SIZE) -> int:
+        """Write everything buffered so far; a failed batch goes back to the front"""
+        written = 0
+        while True:
+            batch = self._drain(batch_size)
+            if not batch:
+                return written
+            try:
+                await sink.write(batch)
+            except Exception:
+                self._requeue(batch)
+                raise
+            written += len(batch)
+
+
+class MongoSink:
+    def __init__(self, collection):
+        self.collection = collection
+
+    async def write(self, events: List[Dict]):
+        # Copies: insert_many adds _id to the dicts it is given
+        await self.collection.insert_many([dict(event) for event in events], ordered=False)
+
+
+def _day(ts: float) -> str:
+    return datetime.datetime.fromtimestamp(ts, datetime.timezone.utc).strftime("%Y-%m-%d")
+
+
+class JsonlSink:
+    """turns-YYYY-MM-DD.jsonl files in directory, appended to from a worker thread"""
+
+    def __init__(self, directory: str = EVENT_LOG_DIR):
+        self.directory = directory
+
+    def _append(self, events: List[Dict]):
+        os.makedirs(self.directory, exist_ok=True)
+        by_day: Dict[str, List[str]] = {}
+        for event in events:
+            by_day.setdefault(_day(event["ts"]), []).append(json.dumps(event))
+        for day, lines in by_day.items():
+            with open(os.path.join(self.directory, f"turns-{day}.jsonl"), "a") as f:
+                f.write("\n".join(lines) + "\n")
+
+    async def write(self, events: List[Dict]):
+        await asyncio.to_thread(self._append, events)
+
+
+class ParquetSink:
+    """One turns-YYYY-MM-DD-<time>-<pid>.parquet file per batch (Parquet files cannot be appended to)"""
+
+    def __init__(self, directory: str = EVENT_LOG_DIR):
+        if pyarrow is None:
+            raise RuntimeError("EVENT_LOG=parquet needs pyarrow installed")
+        self.directory = directory
+
+    def _write(self, events: List[Dict]):
+        os.makedirs(self.directory, exist_ok=True)
+        name = f"turns-{_day(events[0]['ts'])}-{time.time_ns()}-{os.getpid()}.parquet"
+        pq.write_table(pyarrow.Table.from_pylist(events), os.path.join(self.directory, name))
+
+    async def write(self, events: List[Dict]):
+        await asyncio.to_thread(self._write, events)
+
+
+def create_sink(kind: str = EVENT_LOG, collection=None):
+    """Sink for EVENT_LOG, or None when the log is off"""
+    if kind == "off":
+        return None
+    if kind == "jsonl":
+        return JsonlSink()
+    if kind == "parquet":
+        return ParquetSink()
+    if kind == "mongo":
+        return MongoSink(collection)
+    raise ValueError(f"Unknown EVENT_LOG {kind!r}; expected mongo, jsonl, parquet or off")
+
+
+log = EventLog(enabled=EVENT_LOG != "off")
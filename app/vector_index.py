@@ -0,0 +1,294 @@
+"""Vector indexes behind ProductRAGWithEmbeddings.search_products: exact scan and IVF-flat"""
+import os
+import hashlib
+from typing import Callable, Optional, Tuple
+
+import numpy as np
+
+# "exact", "ivf", or "auto" (IVF once the catalog reaches IVF_AUTO_THRESHOLD rows)
+VECTOR_INDEX = os.getenv("VECTOR_INDEX", "auto")
+IVF_AUTO_THRESHOLD = int(os.getenv("IVF_AUTO_THRESHOLD", "50000"))
+IVF_NLIST = int(os.getenv("IVF_NLIST", "0"))  # 0 = about 4 * sqrt(n)
+IVF_NPROBE = int(os.getenv("IVF_NPROBE", "32"))
+# Compact storage for scoring: "none" (float32), "int8" with a per-row scale (recommended), or
+# "float16" (memory only: widening half floats makes scoring several times slower than float32)
+VECTOR_QUANTIZATION = os.getenv("VECTOR_QUANTIZATION", "none")
+# Re-score the best top_k * VECTOR_RERANK candidates with the float32 rows (0 disables)
+VECTOR_RERANK = int(os.getenv("VECTOR_RERANK", "4"))
+SCORE_BLOCK_ROWS = 256
+
+
+def _top_k(scores: np.ndarray, top_k: int) -> np.ndarray:
+    k = min(top_k, len(scores))
+    if k <= 0:
+        return np.empty(0, dtype=np.int64)
+    top = np.argpartition(-scores, k - 1)[:k]
+    return top[np.argsort(-scores[top])]
+
+
+class VectorStore:
+    """
+    Row storage used for scoring. float16 halves and int8 quarters the
+    float32 footprint; rows are widened to float32 one block at a time, so
+    the working set stays small while the resident matrix stays compact.
+    """
+
+    def __init__(self, data: np.ndarray, scales: Optional[np.ndarray], mode: str):
+        self.data = data
+        self.scales = scales
+        self.mode = mode
+
+    @classmethod
+    def encode(cls, vectors: np.ndarray, mode: str = VECTOR_QUANTIZATION) -> "VectorStore":
+        if mode == "float16":
+            return cls(vectors.astype(np.float16), None, mode)
+        if mode == "int8":
+            scales = np.abs(vectors).max(axis=1).astype(np.float32) / 127.0
+            scales[scales == 0] = 1.0
+            codes = np.empty(vectors.shape, dtype=np.int8)
+            for start in range(0, len(vectors), SCORE_BLOCK_ROWS):
+                block = vectors[start:start + SCORE_BLOCK_ROWS] / scales[start:start + SCORE_BLOCK_ROWS, None]
+                codes[start:start + SCORE_BLOCK_ROWS] = np.rint(block)
+            return cls(codes, scales, mode)
+        return cls(vectors, None, "none")
+
+    @classmethod
+    def shared(cls, source: Callable[[], np.ndarray], n_rows: int, mode: str = VECTOR_QUANTIZATION,
+               path_prefix: Optional[str] = None) -> "VectorStore":
+        """
+        Encode source() once per host: the arrays are saved as
+        <path_prefix>.<mode>.npy and memory-mapped, so every worker process
+        maps the same pages instead of holding its own copy.
+        """
+        if path_prefix is None:
+            return cls.encode(source(), mode)
+        data_path, scales_path = f"{path_prefix}.{mode}.npy", f"{path_prefix}.{mode}.scales.npy"
+        try:
+            data = np.load(data_path, mmap_mode='r')
+            scales = np.load(scales_path, mmap_mode='r') if mode == "int8" else None
+            if len(data) == n_rows:
+                return cls(data, scales, mode)
+        except (FileNotFoundError, ValueError, OSError):
+            pass
+        store = cls.encode(source(), mode)
+        try:
+            for path, array in ((data_path, store.data), (scales_path, store.scales)):
+                if array is None:
+                    continue
+                tmp_path = f"{path}.{os.getpid()}.tmp"
+                with open(tmp_path, "wb") as f:
+                    np.save(f, array)
+                os.replace(tmp_path, path)
+            return cls(np.load(data_path, mmap_mode='r'),
+                       np.load(scales_path, mmap_mode='r') if store.scales is not None else None, mode)
+        except OSError as e:
+            print(f"⚠ Could not persist the {mode} vector store: {e}")
+            return store
+
+    @property
+    def quantized(self) -> bool:
+        return self.mode != "none"
+
+    @property
+    def nbytes(self) -> int:
+        return self.data.nbytes + (self.scales.nbytes if self.scales is not None else 0)
+
+    def __len__(self):
+        return len(self.data)
+
+    def scores(self, query: np.ndarray, positions: Optional[np.ndarray] = None) -> np.ndarray:
+        """Inner products of the query with all rows (or the given row positions)"""
+        data = self.data if positions is None else self.data[positions]
+        scales = self.scales if positions is None or self.scales is None else self.scales[positions]
+        if not self.quantized:
+            return data @ query
+        out = np.empty(len(data), dtype=np.float32)
+        for start in range(0, len(data), SCORE_BLOCK_ROWS):
+            out[start:start + SCORE_BLOCK_ROWS] = data[start:start + SCORE_BLOCK_ROWS].astype(np.float32) @ query
+        if scales is not None:
+            out *= scales
+        return out
+
+
+def _rerank(full: np.ndarray, query: np.ndarray, rows: np.ndarray, top_k: int) -> Tuple[np.ndarray, np.ndarray]:
+    """Exact float32 scores for a short candidate list (full may be memory-mapped)"""
+    rows = np.sort(rows)  # ascending reads keep memory-mapped access sequential
+    exact = np.asarray(full[rows], dtype=np.float32) @ query
+    best = _top_k(exact, top_k)
+    return rows[best], exact[best]
+
+
+class ExactIndex:
+    """Brute-force inner product over L2-normalised rows"""
+    kind = "exact"
+
+    def __init__(self, vectors: np.ndarray, quantization: str = VECTOR_QUANTIZATION,
+                 rerank: int = VECTOR_RERANK, store_path: Optional[str] = None):
+        self.vectors = vectors
+        # Unquantized scoring reads the (memory-mapped) vectors directly; nothing to share
+        self.store = VectorStore.shared(lambda: vectors, len(vectors), quantization,
+                                        f"{store_path}.{self.kind}" if store_path and quantization != "none" else None)
+        self.rerank = rerank
+
+    def __len__(self):
+        return len(self.vectors)
+
+    def search(self, query: np.ndarray, top_k: int) -> Tuple[np.ndarray, np.ndarray]:
+        scores = self.store.scores(query)
+        if self.store.quantized and self.rerank:
+            return _rerank(self.vectors, query, _top_k(scores, top_k * self.rerank), top_k)
+        rows = _top_k(scores, top_k)
+        return rows, scores[rows]
+
+    def with_vectors(self, vectors: np.ndarray, store_path: Optional[str] = None) -> "ExactIndex":
+        return ExactIndex(vectors, self.store.mode, self.rerank, store_path)
+
+    def save(self, path: str, fingerprint: str):
+        pass  # the embedding matrix itself is the index
+
+
+class IVFFlatIndex:
+    """
+    Inverted-file index: rows are bucketed by their nearest k-means centroid
+    and a query only scans the n_probe closest buckets. Rows are stored
+    contiguously per bucket, so each probe is one dense matrix product.
+    """
+    kind = "ivf"
+
+    def __init__(self, centroids: np.ndarray, list_offsets: np.ndarray, row_ids: np.ndarray,
+                 vectors: np.ndarray, n_probe: int = IVF_NPROBE,
+                 quantization: str = VECTOR_QUANTIZATION, rerank: int = VECTOR_RERANK,
+                 store_path: Optional[str] = None):
+        self.centroids = centroids
+        self.list_offsets = list_offsets
+        self.row_ids = row_ids
+        # vectors are the full-precision rows in catalog order, used only for re-ranking
+        self.vectors = vectors
+        # The bucket-ordered copy is shared between processes when store_path is given; the
+        # file is keyed by the bucket order too, so a retrained layout never reads stale rows
+        layout = hashlib.blake2b(np.ascontiguousarray(row_ids).tobytes(), digest_size=6).hexdigest()
+        self.store = VectorStore.shared(lambda: np.ascontiguousarray(vectors[row_ids]), len(row_ids), quantization,
+                                        f"{store_path}.{self.kind}-{layout}" if store_path else None)
+        self.n_probe = n_probe
+        self.rerank = rerank
+
+    def __len__(self):
+        return len(self.row_ids)
+
+    @staticmethod
+    def train_centroids(vectors: np.ndarray, n_lists: int, iterations: int = 10,
+                        points_per_list: int = 32, seed: int = 0) -> np.ndarray:
+        """Spherical k-means on a sample of about points_per_list rows per list"""
+        rng = np.random.default_rng(seed)
+        sample_size = max(n_lists, points_per_list * n_lists)
+        sample = vectors if len(vectors) <= sample_size else vectors[rng.choice(len(vectors), sample_size, replace=False)]
+        centroids = sample[rng.choice(len(sample), n_lists, replace=False)].astype(np.float32)
+        for _ in range(iterations):
+            assignments = IVFFlatIndex._assign(sample, centroids)
+            counts = np.bincount(assignments, minlength=n_lists)
+            order = np.argsort(assignments, kind="stable")
+            starts = np.concatenate([[0], np.cumsum(counts)[:-1]])
+            sums = np.zeros_like(centroids)
+            filled = counts > 0
+            sums[filled] = np.add.reduceat(sample[order], starts[filled], axis=0)
+            empty = counts == 0
+            # Re-seed empty lists from random rows so every list stays useful
+            if empty.any():
+                sums[empty] = sample[rng.choice(len(sample), int(empty.sum()))]
+            norms = np.linalg.norm(sums, axis=1, keepdims=True)
+            norms[norms == 0] = 1.0
+            centroids = (sums / norms).astype(np.float32)
+        return centroids
+
+    @staticmethod
+    def _assign(vectors: np.ndarray, centroids: np.ndarray, block: int = 8192) -> np.ndarray:
+        assignments = np.empty(len(vectors), dtype=np.int32)
+        for start in range(0, len(vectors), block):
+            assignments[start:start + block] = np.argmax(vectors[start:start + block] @ centroids.T, axis=1)
+        return assignments
+
+    @classmethod
+    def from_centroids(cls, vectors: np.ndarray, centroids: np.ndarray, n_probe: int = IVF_NPROBE,
+                       quantization: str = VECTOR_QUANTIZATION, rerank: int = VECTOR_RERANK,
+                       store_path: Optional[str] = None) -> "IVFFlatIndex":
+        assignments = cls._assign(vectors, centroids)
+        order = np.argsort(assignments, kind="stable").astype(np.int32)
+        counts = np.bincount(assignments, minlength=len(centroids))
+        offsets = np.concatenate([[0], np.cumsum(counts)]).astype(np.int64)
+        return cls(centroids, offsets, order, vectors, n_probe, quantization, rerank, store_path)
+
+    @classmethod
+    def build(cls, vectors: np.ndarray, n_lists: int = IVF_NLIST, n_probe: int = IVF_NPROBE,
+              iterations: int = 10, seed: int = 0, quantization: str = VECTOR_QUANTIZATION,
+              rerank: int = VECTOR_RERANK, store_path: Optional[str] = None) -> "IVFFlatIndex":
+        n_lists = n_lists or max(1, int(4 * np.sqrt(len(vectors))))
+        n_lists = min(n_lists, len(vectors))
+        centroids = cls.train_centroids(vectors, n_lists, iterations, seed=seed)
+        return cls.from_centroids(vectors, centroids, n_probe, quantization, rerank, store_path)
+
+    def with_vectors(self, vectors: np.ndarray, store_path: Optional[str] = None) -> "IVFFlatIndex":
+        """Re-bucket a changed catalog against the existing centroids (no retraining)"""
+        return IVFFlatIndex.from_centroids(vectors, self.centroids, self.n_probe, self.store.mode, self.rerank,
+                                           store_path)
+
+    def search(self, query: np.ndarray, top_k: int,
+               n_probe: Optional[int] = None) -> Tuple[np.ndarray, np.ndarray]:
+        n_probe = min(n_probe or self.n_probe, len(self.centroids))
+        lists = _top_k(self.centroids @ query, n_probe)
+        spans = [(self.list_offsets[i], self.list_offsets[i + 1]) for i in lists]
+        positions = np.concatenate([np.arange(a, b) for a, b in spans]) if spans else np.empty(0, dtype=np.int64)
+        if len(positions) == 0:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+        scores = self.store.scores(query, positions)
+        if self.store.quantized and self.rerank:
+            candidates = self.row_ids[positions[_top_k(scores, top_k * self.rerank)]].astype(np.int64)
+            return _rerank(self.vectors, query, candidates, top_k)
+        best = _top_k(scores, top_k)
+        return self.row_ids[positions[best]].astype(np.int64), scores[best]
+
+    def save(self, path: str, fingerprint: str):
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            np.savez(f, kind=self.kind, fingerprint=fingerprint, centroids=self.centroids,
+                     list_offsets=self.list_offsets, row_ids=self.row_ids)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str, fingerprint: str, vectors: np.ndarray, n_probe: int = IVF_NPROBE,
+             store_path: Optional[str] = None) -> Optional["IVFFlatIndex"]:
+        """Rebuild from persisted bucket layout; None if missing or built for another catalog"""
+        try:
+            with np.load(path) as saved:
+                if str(saved["fingerprint"]) != fingerprint or len(saved["row_ids"]) != len(vectors):
+                    return None
+                return cls(saved["centroids"], saved["list_offsets"], saved["row_ids"], vectors, n_probe,
+                           store_path=store_path)
+        except (FileNotFoundError, KeyError, ValueError, OSError):
+            return None
+
+
+def choose_kind(n_rows: int, kind: str = VECTOR_INDEX) -> str:
+    if kind == "auto":
+        return "ivf" if n_rows >= IVF_AUTO_THRESHOLD else "exact"
+    return kind
+
+
+def build_index(vectors: np.ndarray, kind: str = VECTOR_INDEX, cache_path: Optional[str] = None,
+                fingerprint: str = "", store_path: Optional[str] = None):
+    """
+    Build (or load from cache_path) the configured index over L2-normalised
+    rows; with store_path its scoring arrays are memory-mapped files shared by all processes
+    """
+    if choose_kind(len(vectors), kind) != "ivf" or len(vectors) == 0:
+        return ExactIndex(vectors, store_path=store_path)
+    if cache_path:
+        index = IVFFlatIndex.load(cache_path, fingerprint, vectors, store_path=store_path)
+        if index is not None:
+            return index
+    index = IVFFlatIndex.build(vectors, store_path=store_path)
+    if cache_path:
+        try:
+            index.save(cache_path, fingerprint)
+        except OSError as e:
+            print(f"⚠ Could not persist vector index: {e}")
+    return index
@@ -0,0 +1,48 @@
+"""Wire encodings for /ws frames: JSON text (default) or msgpack binary"""
+import os
+import json
+from typing import Dict, Optional
+
+try:
+    import msgpack
+except ImportError:  # optional; clients asking for it get JSON
+    msgpack = None
+
+# permessage-deflate for /ws, negotiated with clients that offer it (browsers do)
+WS_PER_MESSAGE_DEFLATE = os.getenv("WS_PER_MESSAGE_DEFLATE", "1") != "0"
+
+
+class JsonCodec:
+    name = "json"
+    binary = False
+
+    def encode(self, frame: Dict) -> str:
+        return json.dumps(frame)
+
+
+class MsgpackCodec:
+    name = "msgpack"
+    binary = True
+
+    def encode(self, frame: Dict) -> bytes:
+        return msgpack.packb(frame, use_bin_type=True)
+
+
+JSON = JsonCodec()
+
+
+def negotiate(requested: Optional[str]):
+    """Codec for the encoding a client asked for in its auth message"""
+    if requested == "msgpack":
+        if msgpack is not None:
+            return MsgpackCodec()
+        print("⚠ msgpack frames requested but msgpack is not installed; using JSON")
+    return JSON
+
+
+async def send_frame(websocket, codec, frame: Dict):
+    data = codec.encode(frame)
+    if codec.binary:
+        await websocket.send_bytes(data)
+    else:
+        await websocket.send_text(data)